@@ -0,0 +1,87 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare cold starts with and without the precompiled template cache.
+
+Requires the python-app example's requirements (mistune). Each run starts a
+new Python process, which creates the python-app example and makes the first
+request to each of its pages, as the first requests to a new instance would.
+It reports the time for the first requests, and for the app's setup.
+
+    PYTHONPATH=src python benchmarks/bench_coldstart.py --runs 20
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import EXAMPLES_DIR, settings
+
+
+# Runs in a new process, in the example's directory.
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, ".")
+import main
+created = time.perf_counter()
+client = main.app.test_client()
+for path in ["/", "/csrf", "/headers"]:
+    assert client.get(path, base_url="https://localhost").status_code == 200
+done = time.perf_counter()
+print(json.dumps({"create": created - start, "first_requests": done - created}))
+"""
+
+
+def run(runs: int) -> dict:
+    results = []
+
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", CHILD], cwd=os.path.join(EXAMPLES_DIR, "python-app"), env=os.environ
+        )
+        results.append(json.loads(output))
+
+    return {name: statistics.median(result[name] for result in results) for name in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    cache_dir = tempfile.mkdtemp()
+    example_dir = os.path.join(EXAMPLES_DIR, "python-app")
+
+    try:
+        subprocess.check_call(
+            [sys.executable, "-m", "securescaffold.build", "templates", "--output", cache_dir], cwd=example_dir
+        )
+        print(f"{'':16} {'create_app (ms)':>16} {'first requests (ms)':>20}")
+
+        for name, cache in [("compile", None), ("bytecode cache", cache_dir)]:
+            with settings(JINJA_BYTECODE_CACHE=cache):
+                result = run(args.runs)
+
+            print(f"{name:16} {result['create'] * 1000:16.1f} {result['first_requests'] * 1000:20.1f}")
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == "__main__":
+    main()
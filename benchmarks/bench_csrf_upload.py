@@ -0,0 +1,88 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark rejecting large multipart uploads with a bad CSRF token.
+
+Compares CSRF_MODE = "form" (the token is read from the parsed form data)
+with CSRF_MODE = "header" (only the X-CSRFToken header is read).
+
+    python benchmarks/bench_csrf_upload.py --size-mb 32 --repeat 5
+"""
+import argparse
+import io
+import logging
+import os
+import time
+
+import flask
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+import securescaffold
+from common import settings
+
+
+def make_app(mode: str) -> flask.Flask:
+    with settings(CSRF_MODE=mode):
+        app = securescaffold.create_app("bench")
+
+    @app.route("/upload", methods=["POST"])
+    def upload():
+        return ""
+
+    return app
+
+
+def bench(mode: str, payload: bytes, repeat: int) -> float:
+    app = make_app(mode)
+    app.logger.setLevel(logging.ERROR)
+
+    # Encode the multipart body once, so only the app is timed.
+    builder = EnvironBuilder(
+        path="/upload",
+        method="POST",
+        base_url="https://localhost",
+        headers={"Referer": "https://localhost/upload", "X-CSRFToken": "wrong"},
+        data={"_csrf_token": "wrong", "file": (io.BytesIO(payload), "upload.bin")},
+    )
+    environ = builder.get_environ()
+    body = environ["wsgi.input"].read()
+    timings = []
+
+    for _ in range(repeat):
+        environ["wsgi.input"] = io.BytesIO(body)
+        start = time.perf_counter()
+        _, status, _ = run_wsgi_app(app, dict(environ), buffered=True)
+        timings.append(time.perf_counter() - start)
+
+        assert status.startswith("403")
+
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = os.urandom(args.size_mb * 1024 * 1024)
+
+    for mode in ("form", "header"):
+        best = bench(mode, payload, args.repeat)
+        print(f"CSRF_MODE={mode!r:9} rejected {args.size_mb} MB upload in {best * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
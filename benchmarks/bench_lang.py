@@ -0,0 +1,79 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare redirecting and serving the localized page at the site root.
+
+Loads the language-redirect example and times the work the app does for
+each mode. With "redirect" the browser makes two requests (the redirect,
+then the page from the static handler); with "serve" it makes one. The
+network round trip that saves is not measured here, only the time spent
+in the app.
+
+    PYTHONPATH=src python benchmarks/bench_lang.py --count 5000
+"""
+import argparse
+import os
+import time
+
+from common import load_example
+
+
+def time_requests(client, path: str, headers: dict, count: int) -> float:
+    """Average seconds the app takes to respond to a request."""
+    start = time.perf_counter()
+
+    for _ in range(count):
+        client.get(path, headers=headers).close()
+
+    return (time.perf_counter() - start) / count
+
+
+def read_static(path: str, count: int) -> float:
+    """Average seconds to read a page, standing in for the static handler."""
+    start = time.perf_counter()
+
+    for _ in range(count):
+        with open(path, "rb") as fh:
+            fh.read()
+
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000)
+    args = parser.parse_args()
+
+    module = load_example("language-redirect", LOCALES_SERVE_MODE="serve")
+    app = module.app
+    client = app.test_client()
+    headers = {"Accept-Language": "fr-CH, fr;q=0.9", "X-Forwarded-Proto": "https"}
+
+    app.config["LOCALES_SERVE_MODE"] = "redirect"
+    redirect_app = time_requests(client, "/", headers, args.count)
+    redirect_static = read_static(os.path.join(app.root_path, "dist/intl/fr/index.html"), args.count)
+
+    app.config["LOCALES_SERVE_MODE"] = "serve"
+    serve_app = time_requests(client, "/", headers, args.count)
+
+    redirect_total = redirect_app + redirect_static
+    print(f"{'mode':<10} {'requests':>8} {'app time':>10}")
+    print(f"{'redirect':<10} {2:>8} {redirect_total * 1000:>8.3f}ms  (redirect + static page)")
+    print(f"{'serve':<10} {1:>8} {serve_app * 1000:>8.3f}ms")
+    print(f"Difference: {(serve_app - redirect_total) * 1000:+.3f}ms per visit, and one round trip fewer for serve")
+
+
+if __name__ == "__main__":
+    main()
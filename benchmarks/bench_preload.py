@@ -0,0 +1,135 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compare gunicorn workers with and without --preload.
+
+Requires gunicorn and the python-app example's requirements (mistune), on
+Linux. Starts the python-app example with gunicorn, waits until it answers
+requests, then reports the boot time and the memory used by each worker.
+USS is the memory private to a worker, PSS also counts a share of the memory
+shared with the other processes.
+
+    PYTHONPATH=src python benchmarks/bench_preload.py --workers 4
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from common import EXAMPLES_DIR, settings
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def children(pid: int) -> list:
+    with open(f"/proc/{pid}/task/{pid}/children") as fh:
+        return [int(child) for child in fh.read().split()]
+
+
+def memory(pid: int) -> dict:
+    """Read the PSS and USS of a process, in KiB."""
+    values = {}
+
+    with open(f"/proc/{pid}/smaps_rollup") as fh:
+        for line in fh:
+            parts = line.split()
+
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+
+    return {
+        "pss": values["Pss"],
+        "uss": values["Private_Clean"] + values["Private_Dirty"],
+    }
+
+
+def run(preload: bool, workers: int, requests: int, config: str) -> dict:
+    port = free_port()
+    # The example redirects HTTP requests to HTTPS.
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/", headers={"X-Forwarded-Proto": "https"})
+    command = [
+        sys.executable, "-m", "gunicorn",
+        # Ignore the example's gunicorn.conf.py, which sets preload_app.
+        "--config", config,
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(workers),
+        "--worker-class", "gthread",
+        "--threads", "8",
+        "--log-level", "warning",
+        "main:app",
+    ]
+
+    if preload:
+        command.insert(-1, "--preload")
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=os.path.join(EXAMPLES_DIR, "python-app"))
+
+    try:
+        while True:
+            try:
+                urllib.request.urlopen(request, timeout=1).read()
+            except OSError:
+                time.sleep(0.01)
+                continue
+
+            if len(children(process.pid)) == workers:
+                break
+
+        boot = time.perf_counter() - start
+
+        # Warm up every worker, so the comparison includes memory touched by
+        # handling requests.
+        for _ in range(requests):
+            urllib.request.urlopen(request).read()
+
+        usage = [memory(pid) for pid in children(process.pid)]
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+
+    return {
+        "boot": boot,
+        "pss": sum(item["pss"] for item in usage) / len(usage),
+        "uss": sum(item["uss"] for item in usage) / len(usage),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'':12} {'boot (s)':>9} {'PSS/worker (MiB)':>17} {'USS/worker (MiB)':>17}")
+
+    with settings(), tempfile.NamedTemporaryFile(suffix=".py") as config:
+        for preload in [False, True]:
+            result = run(preload, args.workers, args.requests, config.name)
+            name = "--preload" if preload else "no preload"
+            print(f"{name:12} {result['boot']:9.2f} {result['pss'] / 1024:17.1f} {result['uss'] / 1024:17.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the python-app example's pages.
+
+Requires the example's requirements (mistune). Measures requests per second
+for each page through the WSGI interface, including conditional requests
+that are answered from the render cache.
+
+    python benchmarks/bench_python_app.py --duration 2
+"""
+import argparse
+
+import flask
+
+from common import load_example, throughput
+
+
+def uncached_render(template_name, cache_key=None, **context):
+    return flask.make_response(flask.render_template(template_name, **context))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=2.0)
+    args = parser.parse_args()
+
+    example = load_example("python-app", CSP_POLICY_NONCE_IN=["script-src", "style-src"])
+    app = example.app
+    client = app.test_client()
+    https = {"base_url": "https://localhost"}
+    etag = client.get("/", **https).headers["ETag"]
+
+    cases = [
+        ("GET / (render cache)", lambda: client.get("/", **https)),
+        ("GET / If-None-Match (304)", lambda: client.get("/", headers={"If-None-Match": etag}, **https)),
+        ("GET /headers", lambda: client.get("/headers", **https)),
+    ]
+
+    for name, func in cases:
+        print(f"{name:32} {throughput(func, args.duration):9.1f} req/s")
+
+    # The same page without the render cache, for comparison.
+    app.render_cache.render = uncached_render
+    func = lambda: client.get("/", **https)  # noqa: E731
+    print(f"{'GET / (no render cache)':32} {throughput(func, args.duration):9.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Load-test the python-app example with different worker settings.
+
+Requires gunicorn and the python-app example's requirements (mistune). Runs
+the example with `securescaffold.serve` for each combination of workers and
+threads, and reports requests per second and latency percentiles from a
+number of concurrent keep-alive clients.
+
+    PYTHONPATH=src python benchmarks/bench_serve.py --workers 1 2 --threads 1 8
+"""
+import argparse
+import http.client
+import itertools
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from common import EXAMPLES_DIR, settings
+from bench_preload import free_port
+
+
+def wait_until_ready(port: int, timeout: float = 30.0) -> None:
+    end = time.monotonic() + timeout
+
+    while time.monotonic() < end:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/", headers={"X-Forwarded-Proto": "https"})
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+    raise RuntimeError("Server did not start")
+
+
+def load(port: int, path: str, clients: int, duration: float, delay: float) -> dict:
+    """Send requests from concurrent clients, return req/s and latencies."""
+    latencies = []
+    lock = threading.Lock()
+    end = time.monotonic() + duration
+    headers = {"X-Forwarded-Proto": "https"}
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        times = []
+
+        while time.monotonic() < end:
+            start = time.perf_counter()
+            conn.request("GET", path, headers=headers)
+            conn.getresponse().read()
+            times.append(time.perf_counter() - start)
+
+            if delay:
+                time.sleep(delay)
+
+        conn.close()
+
+        with lock:
+            latencies.extend(times)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+
+    def percentile(value):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * value))] * 1000
+
+    return {
+        "rps": len(latencies) / duration,
+        "p50": percentile(0.5),
+        "p99": percentile(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--path", default="/")
+    parser.add_argument("--delay", type=float, default=0.0, help="Client think time between requests")
+    args = parser.parse_args()
+
+    print(f"{'workers':>7} {'threads':>7} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+
+    with settings():
+        for workers, threads in itertools.product(args.workers, args.threads):
+            port = free_port()
+            command = [
+                sys.executable, "-m", "securescaffold.serve",
+                "--bind", f"127.0.0.1:{port}",
+                "--workers", str(workers),
+                "--threads", str(threads),
+                "--log-level", "warning",
+                "main:app",
+            ]
+            process = subprocess.Popen(command, cwd=os.path.join(EXAMPLES_DIR, "python-app"))
+
+            try:
+                wait_until_ready(port)
+                result = load(port, args.path, args.clients, args.duration, args.delay)
+            finally:
+                process.send_signal(signal.SIGTERM)
+                process.wait()
+
+            print(f"{workers:7} {threads:7} {result['rps']:9.1f} {result['p50']:9.2f} {result['p99']:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers for the benchmark scripts."""
+import contextlib
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+
+@contextlib.contextmanager
+def settings(**values):
+    """Point FLASK_SETTINGS_FILENAME at a file with the given settings.
+
+    A SECRET_KEY is always set, so apps do not need the datastore.
+    """
+    values.setdefault("SECRET_KEY", "bench")
+    lines = [f"{name} = {value!r}\n" for name, value in values.items()]
+
+    with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as fh:
+        fh.writelines(lines)
+
+    old = os.environ.get("FLASK_SETTINGS_FILENAME")
+    os.environ["FLASK_SETTINGS_FILENAME"] = fh.name
+
+    try:
+        yield
+    finally:
+        if old is None:
+            del os.environ["FLASK_SETTINGS_FILENAME"]
+        else:
+            os.environ["FLASK_SETTINGS_FILENAME"] = old
+
+        os.unlink(fh.name)
+
+
+def load_example(name: str, **values):
+    """Import an example's main.py, and change to the example's directory."""
+    path = os.path.join(EXAMPLES_DIR, name)
+    spec = importlib.util.spec_from_file_location(f"example_{name.replace('-', '_')}", os.path.join(path, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    os.chdir(path)
+    sys.path.insert(0, path)
+
+    with settings(**values):
+        spec.loader.exec_module(module)
+
+    return module
+
+
+def throughput(func, duration: float = 2.0) -> float:
+    """Call func repeatedly for a duration, and return calls per second."""
+    count = 0
+    start = time.perf_counter()
+    end = start + duration
+
+    while time.perf_counter() < end:
+        func()
+        count += 1
+
+    return count / (time.perf_counter() - start)
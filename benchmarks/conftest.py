@@ -0,0 +1,37 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Fixtures for the pytest-benchmark suite.
+
+    pytest benchmarks --benchmark-autosave
+"""
+import flask
+import pytest
+
+import securescaffold
+from common import settings
+
+
+@pytest.fixture(scope="session")
+def app() -> flask.Flask:
+    """An app with an empty view, created with `create_app`."""
+    with settings(LOCALES=["en", "fr", "de", "es-419", "pt-BR", "ja"]):
+        app = securescaffold.create_app(__name__)
+
+    @app.route("/empty")
+    def empty():
+        return ""
+
+    return app
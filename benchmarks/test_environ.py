@@ -0,0 +1,28 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import flask
+import pytest
+
+from securescaffold import environ
+
+
+@pytest.mark.parametrize(
+    "headers",
+    [{}, {"X-Appengine-Queuename": "default"}, {"X-Appengine-User-Is-Admin": "1"}],
+    ids=["public", "task", "admin"],
+)
+def test_is_tasks_or_admin_request(benchmark, app, headers):
+    with app.test_request_context(headers=headers):
+        benchmark(environ.is_tasks_or_admin_request, flask.request)
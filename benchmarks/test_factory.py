@@ -0,0 +1,28 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from securescaffold import factory
+
+
+def test_get_talisman_config(benchmark, app):
+    benchmark(factory.get_talisman_config, app.config)
+
+
+def test_empty_view(benchmark, app):
+    # The overhead of the scaffold's request hooks and middleware.
+    client = app.test_client()
+
+    response = benchmark(client.get, "/empty", base_url="https://localhost")
+
+    assert response.status_code == 200
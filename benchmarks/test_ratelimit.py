@@ -0,0 +1,66 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import flask
+import pytest
+
+import securescaffold
+from common import settings
+from securescaffold import ratelimit
+
+
+@pytest.fixture(scope="module")
+def limited_app() -> flask.Flask:
+    """The same app as `app`, with a global rate limit that is never reached."""
+    with settings(RATE_LIMIT="1000000/second"):
+        app = securescaffold.create_app(__name__)
+
+    @app.route("/empty")
+    def empty():
+        return ""
+
+    return app
+
+
+def test_hit(benchmark):
+    limiter = ratelimit.RateLimiter()
+    limit = ratelimit.Limit(1000000, 1)
+
+    benchmark(limiter.hit, "*", "ip:192.0.2.1", limit)
+
+
+def test_hit_with_store(benchmark):
+    # Counting for the shared store, the sync itself is in the background.
+    limiter = ratelimit.RateLimiter(store=ratelimit.MemoryStore(), sync_interval=3600)
+    limit = ratelimit.Limit(1000000, 1)
+
+    benchmark(limiter.hit, "*", "ip:192.0.2.1", limit)
+
+
+def test_reject(benchmark, app):
+    limiter = ratelimit.RateLimiter()
+    limit = ratelimit.Limit(1, 60)
+
+    with app.test_request_context():
+        benchmark(limiter.reject, limit)
+
+
+def test_empty_view_rate_limited(benchmark, limited_app):
+    # Compare with test_factory.py::test_empty_view for the overhead per request.
+    client = limited_app.test_client()
+    headers = {ratelimit.X_APPENGINE_USER_IP: "192.0.2.1"}
+
+    response = benchmark(client.get, "/empty", headers=headers, base_url="https://localhost")
+
+    assert response.status_code == 200
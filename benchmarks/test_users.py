@@ -0,0 +1,40 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from securescaffold.contrib.appengine import users
+
+
+HEADERS = {
+    users.USER_AUTH_DOMAIN_HEADER: "example.com",
+    users.USER_EMAIL_HEADER: "alice@example.com",
+    users.USER_ID_HEADER: "123",
+}
+
+
+@pytest.fixture
+def request_context(app):
+    with app.test_request_context(headers=HEADERS):
+        yield
+
+
+def test_user(benchmark, request_context):
+    benchmark(users.User)
+
+
+def test_user_nickname(benchmark, request_context):
+    user = users.User()
+
+    benchmark(user.nickname)
@@ -0,0 +1,48 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from werkzeug.datastructures import LanguageAccept
+from werkzeug.http import parse_accept_header
+
+from securescaffold import views
+
+
+SUPPORTED = ["en", "fr", "de", "es-419", "pt-BR", "ja"]
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        "en-US,en;q=0.9",
+        "pt-PT,pt;q=0.9,en-US;q=0.8",
+        "zh-CN,zh;q=0.9",
+    ],
+    ids=["exact", "language-only", "no-match"],
+)
+def test_best_match(benchmark, header):
+    requested = parse_accept_header(header, LanguageAccept)
+
+    benchmark(views.best_match, requested, SUPPORTED)
+
+
+def test_add_query_to_url(benchmark):
+    benchmark(views.add_query_to_url, "/intl/en/?a=1", "utm_source=x&utm_medium=y")
+
+
+def test_lang_redirect(benchmark, app):
+    headers = {"Accept-Language": "fr-CH,fr;q=0.9,en;q=0.8"}
+
+    with app.test_request_context("/?utm_source=x", headers=headers):
+        benchmark(views.lang_redirect)
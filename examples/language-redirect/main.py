@@ -18,8 +18,11 @@ import securescaffold.views
 
 app = securescaffold.create_app(__name__)
 
-# The only route redirects visitors to /intl/LANG/ depending on the
-# Accept-Language header.
-app.add_url_rule("/", "lang_redirect", securescaffold.views.lang_redirect)
+# The only route serves dist/intl/LANG/index.html depending on the
+# Accept-Language header, without redirecting. Crawlers are redirected to
+# /intl/LANG/. Set "LOCALES_SERVE_MODE" to "redirect" to redirect everyone.
+app.add_url_rule("/", "lang_index", securescaffold.views.lang_index)
 app.config["LOCALES"] = ["en", "fr"]
 app.config["LOCALES_REDIRECT_TO"] = "/intl/{locale}/"
+app.config["LOCALES_SERVE_MODE"] = "serve"
+app.config["LOCALES_SERVE_FILE"] = "dist/intl/{locale}/index.html"
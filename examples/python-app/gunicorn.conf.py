@@ -0,0 +1,40 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Gunicorn configuration, used by the entrypoint in app.yaml.
+#
+# https://docs.gunicorn.org/en/stable/settings.html
+
+import os
+
+from securescaffold import serve
+
+
+# Workers sized for the instance class, as `securescaffold-serve` does.
+bind = ":" + os.environ.get("PORT", "8080")
+instance = serve.worker_config()
+workers = instance["workers"]
+threads = instance["threads"]
+worker_class = "gthread"
+
+# Import the app once in the master process, and fork the workers from it.
+# Workers share the imported modules and the app's configuration and routes
+# (copy-on-write), so they use less memory and start faster. The scaffold
+# re-creates clients and connection pools in each worker after the fork.
+preload_app = True
+
+
+# Compile the routes before the workers are forked, rather than in each
+# worker on its first request.
+when_ready = serve.when_ready
@@ -20,6 +20,7 @@ import flask
 import markupsafe
 import mistune
 import securescaffold
+import securescaffold.caching
 
 
 app = securescaffold.create_app(__name__)
@@ -29,22 +30,22 @@ app = securescaffold.create_app(__name__)
 def about():
     """One-page introduction to Secure Scaffold.
 
-    This renders Markdown to HTML on-the-fly, trusting the Markdown content
-    can be used to generate <a> tags. Do not do this on production sites!
+    This renders Markdown to HTML, trusting the Markdown content can be used
+    to generate <a> tags. Do not do this on production sites!
     """
-
-    # The Anchors renderer trusts the headers in the Markdown file.
-    with open("README.md") as fh:
-        m = mistune.create_markdown(renderer=Anchors())
-        readme = m(fh.read())
-        readme = markupsafe.Markup(readme)
+    # The Markdown is rendered once, and again if README.md changes.
+    readme = readme_cache.get("README.md")
 
     context = {
         "page_title": "Secure Scaffold",
         "readme": readme,
     }
 
-    return flask.render_template("about.html", **context)
+    # The rendered page is cached (with a placeholder for the CSP nonce, if
+    # the templates use one), and conditional requests get a 304 response.
+    cache_key = readme_cache.version("README.md")
+
+    return securescaffold.caching.render_template("about.html", cache_key=cache_key, **context)
 
 
 @app.route("/csrf", methods=["GET", "POST"])
@@ -75,6 +76,17 @@ def headers():
     return flask.render_template("headers.html", **context)
 
 
+def render_markdown(text):
+    """Render Markdown to HTML."""
+    # The Anchors renderer trusts the headers in the Markdown file.
+    m = mistune.create_markdown(renderer=Anchors())
+
+    return markupsafe.Markup(m(text))
+
+
+readme_cache = securescaffold.caching.FileCache(render_markdown)
+
+
 class Anchors(mistune.HTMLRenderer):
     """Adds id attributes to <h*> elements.
 
@@ -20,6 +20,7 @@ import google.auth
 import google.auth.transport.requests
 import requests
 import securescaffold
+import securescaffold.credentials
 from google.auth.compute_engine import credentials
 from google.cloud import storage
 from google.oauth2 import service_account
@@ -45,7 +46,8 @@ def new_creds(scopes=None):
         creds, _ = google.auth.default(scopes=scopes)
         return creds
 
-    request = google.auth.transport.requests.Request()
+    # Re-use pooled connections from the app's HTTP sessions.
+    request = app.http.auth_request()
     creds = credentials.IDTokenCredentials(request, None)
     signer = creds.signer
     service_account_email = creds.service_account_email
@@ -58,6 +60,13 @@ def new_creds(scopes=None):
     return creds
 
 
+# Credentials (and clients) are created once for each set of scopes, and the
+# tokens are refreshed in a background thread before they expire.
+creds_cache = securescaffold.credentials.CredentialsCache(
+    new_creds, request_factory=app.http.auth_request
+)
+
+
 @app.route('/')
 def home():
     """List the Google Cloud Storage buckets."""
@@ -65,8 +74,7 @@ def home():
     # but imagine there were other scopes you wanted to use with the default
     # service account.
     try:
-        creds = new_creds()
-        client = storage.Client(credentials=creds)
+        client = creds_cache.client(storage.Client)
         buckets = [repr(o) for o in client.list_buckets()]
         error = None
     except Exception:
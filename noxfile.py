@@ -12,6 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import glob
+import os
+
 import nox
 
 
@@ -23,5 +26,53 @@ nox.options.default_venv_backend = "venv"
 def tests(session, flask):
     session.install("pytest")
     session.install(f"flask~={flask}.0")
-    session.install(".")
+    session.install(".[build]")
     session.run("pytest", "--disable-warnings")
+
+
+# A reference run, committed to the repository. Runs are compared with it,
+# and never saved over it. Update it with `nox --session benchmark_baseline`.
+# It was recorded on a different machine from CI's, so the comparison is
+# reported, not enforced.
+BENCHMARK_STORAGE = os.path.join("benchmarks", "baseline")
+BENCHMARK_BASELINE = "0001"
+
+
+@nox.session(python="3.11")
+def benchmarks(session):
+    # Microbenchmarks for the hot paths, with the change from the committed
+    # baseline. To fail on a regression, record a baseline on the same
+    # machine and pass e.g. `-- --benchmark-compare-fail=min:25%`.
+    session.install("pytest", "pytest-benchmark")
+    session.install(".")
+    session.run(
+        "pytest",
+        "benchmarks",
+        f"--benchmark-storage={BENCHMARK_STORAGE}",
+        f"--benchmark-compare={BENCHMARK_BASELINE}",
+        *session.posargs,
+    )
+
+
+@nox.session(python="3.11")
+def benchmark_baseline(session):
+    # Replace the baseline with a new run. Run this on the same kind of
+    # machine as CI, the timings depend on the hardware.
+    session.install("pytest", "pytest-benchmark")
+    session.install(".")
+
+    for path in glob.glob(os.path.join(BENCHMARK_STORAGE, "*", "*.json")):
+        os.remove(path)
+
+    session.run("pytest", "benchmarks", f"--benchmark-storage={BENCHMARK_STORAGE}", "--benchmark-save=baseline")
+
+
+@nox.session(python="3.11")
+def bench(session):
+    # Load-test the scaffold's request path in-process and over local HTTP,
+    # failing on unexpected status codes. Compare the timings between runs.
+    session.install(".")
+    session.run("python", "-m", "securescaffold.bench", "--requests", "5000", "--check")
+    session.run(
+        "python", "-m", "securescaffold.bench", "--requests", "2000", "--http", "--concurrency", "4", "--check"
+    )
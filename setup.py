@@ -28,6 +28,18 @@ setuptools.setup(
     packages=setuptools.find_packages(where="src"),
     package_dir={"": "src"},
     install_requires=install_requires,
+    extras_require={
+        "build": ["PyYAML"],
+        "ratelimit": ["redis"],
+        "serve": ["gunicorn"],
+        "tasks": ["google-cloud-tasks"],
+    },
+    entry_points={
+        "console_scripts": [
+            "securescaffold-build=securescaffold.build:main",
+            "securescaffold-serve=securescaffold.serve:main",
+        ],
+    },
     include_package_data=True,
     description="Secure Scaffold for Google App Engine",
     long_description=long_description,
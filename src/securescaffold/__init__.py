@@ -13,7 +13,7 @@
 # limitations under the License.
 
 from .environ import admin_only, cron_only, tasks_only
-from .factory import AppConfig, create_app
+from .factory import AppConfig, create_app, prepare_app
 
 
 __all__ = [
@@ -21,5 +21,6 @@ __all__ = [
     "admin_only",
     "create_app",
     "cron_only",
+    "prepare_app",
     "tasks_only",
 ]
@@ -0,0 +1,271 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Run work after the response is sent.
+
+    from securescaffold import background
+
+    @app.route("/checkout", methods=["POST"])
+    def checkout():
+        ...
+        background.run_after_response(write_audit_log, order.key.id())
+        return flask.redirect(...)
+
+The function runs in a thread pool shared by the app (`app.background`),
+after the response has been sent, in an app context and an NDB context. The
+pool runs "BACKGROUND_MAX_WORKERS" functions at once, and accepts at most
+"BACKGROUND_MAX_PENDING" more. When it is full, functions decorated with
+`deferrable` are enqueued as a Cloud Task for the "BACKGROUND_TASKS_URL"
+view instead (if that is set), and other functions run on the request's
+thread after the response is sent. When the process exits it waits up to
+"BACKGROUND_DRAIN_TIMEOUT" seconds for the pool to finish.
+"""
+import atexit
+import functools
+import json
+import logging
+import queue
+import threading
+from typing import Callable, Optional
+
+import flask
+
+from . import datastore
+from . import environ
+from . import forksafe
+from . import tasks
+
+
+logger = logging.getLogger(__name__)
+
+# Functions that can be run by a task, by name.
+DEFERRABLE = {}
+
+
+def deferrable(func: Callable) -> Callable:
+    """Allow a function to run as a Cloud Task when the pool is full.
+
+    Its arguments must be JSON-serializable.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+    DEFERRABLE[name] = func
+    func.securescaffold_deferrable = name
+
+    return func
+
+
+def run_after_response(func: Callable, *args, **kwargs) -> None:
+    """Call a function after the response for the current request is sent.
+
+    Outside a request, the function is submitted to the pool now.
+    """
+    flask.current_app.background.run_after_response(func, *args, **kwargs)
+
+
+class BackgroundWork:
+    """Bounded thread pool for work that runs after the response.
+
+    `create_app` adds an instance to the app as `app.background`.
+    """
+
+    def __init__(self, app: Optional[flask.Flask] = None, max_workers: int = 4, max_pending: int = 100):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.tasks_url = None
+        self.drain_timeout = 10.0
+        self.app = None
+        self._queue = None
+        self._threads = []
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        forksafe.register(self._after_fork)
+        atexit.register(self.drain)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask) -> None:
+        config = app.config
+        self.app = app
+        self.max_workers = config.get("BACKGROUND_MAX_WORKERS", self.max_workers)
+        self.max_pending = config.get("BACKGROUND_MAX_PENDING", self.max_pending)
+        self.drain_timeout = config.get("BACKGROUND_DRAIN_TIMEOUT", self.drain_timeout)
+        self.tasks_url = config.get("BACKGROUND_TASKS_URL")
+        app.after_request(self._after_request)
+
+        if self.tasks_url:
+            view = environ.tasks_only(run_deferred)
+            app.add_url_rule(self.tasks_url, "securescaffold_background", view, methods=["POST"])
+            csrf = getattr(app, "csrf", None)
+
+            if csrf is not None:
+                csrf.exempt(view)
+
+        app.background = self
+
+    def run_after_response(self, func: Callable, *args, **kwargs) -> None:
+        call = functools.partial(func, *args, **kwargs)
+
+        if flask.has_request_context():
+            flask.g.setdefault("_securescaffold_after_response", []).append(call)
+        else:
+            self.submit(call)
+
+    def _after_request(self, response: flask.Response) -> flask.Response:
+        calls = flask.g.pop("_securescaffold_after_response", None)
+
+        if calls:
+            # Called by the WSGI server once the response is sent.
+            response.call_on_close(lambda: self._submit_all(calls))
+
+        return response
+
+    def _submit_all(self, calls: list) -> None:
+        for call in calls:
+            self.submit(call)
+
+    def submit(self, call: Callable[[], None]) -> None:
+        """Run a function in the pool, or fall back when the pool is full."""
+        with self._lock:
+            self._start()
+
+            try:
+                self._queue.put_nowait(call)
+                self._outstanding += 1
+                accepted = True
+            except queue.Full:
+                accepted = False
+
+        if not accepted and not self._defer(call):
+            # Slow down this thread, instead of queueing more work.
+            logger.warning("Background pool is full, running %r on the request thread", _func(call))
+            self._call(call)
+
+    def _start(self) -> None:
+        # Threads are started when they are first needed. They are daemon
+        # threads, so `drain` decides how long the process waits for them.
+        if self._queue is None:
+            # A Queue with a maxsize of 0 has no limit.
+            self._queue = queue.Queue(max(self.max_pending, 1))
+
+        while len(self._threads) < self.max_workers:
+            thread = threading.Thread(
+                target=self._worker,
+                args=(self._queue,),
+                name=f"securescaffold-background-{len(self._threads)}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self, work: queue.Queue) -> None:
+        while True:
+            call = work.get()
+
+            if call is None:
+                return
+
+            try:
+                self._call(call)
+            finally:
+                with self._lock:
+                    self._outstanding -= 1
+                    self._idle.notify_all()
+
+    def _call(self, call: Callable[[], None]) -> None:
+        try:
+            with self.app.app_context(), datastore.context():
+                call()
+        except Exception:
+            logger.exception("Background work %r failed", _func(call))
+
+    def _defer(self, call: Callable[[], None]) -> bool:
+        # Only partials have the arguments to send with the task.
+        name = getattr(getattr(call, "func", None), "securescaffold_deferrable", None)
+
+        if not self.tasks_url or name is None:
+            return False
+
+        try:
+            payload = json.dumps([call.args, call.keywords])
+        except TypeError:
+            return False
+
+        try:
+            with self.app.app_context():
+                tasks.enqueue(self.tasks_url, {"name": name, "payload": payload})
+        except Exception:
+            logger.exception("Failed to enqueue %s", name)
+            return False
+
+        return True
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the pool to finish its work, and stop its threads.
+
+        Called when the process exits.
+
+        :return: True if all the work finished.
+        """
+        timeout = self.drain_timeout if timeout is None else timeout
+
+        with self._lock:
+            finished = self._idle.wait_for(lambda: self._outstanding == 0, timeout)
+            work, threads = self._queue, self._threads
+            self._queue, self._threads = None, []
+
+        if not finished:
+            logger.warning("Stopped with %d background functions unfinished", self._outstanding)
+        elif work is not None:
+            for _ in threads:
+                try:
+                    work.put_nowait(None)
+                except queue.Full:
+                    # More work arrived, the daemon threads stop at exit.
+                    break
+
+        return finished
+
+    def _after_fork(self) -> None:
+        # The parent's threads do not exist in the child process.
+        self._queue = None
+        self._threads = []
+        self._outstanding = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+
+def run_deferred():
+    """View for the "BACKGROUND_TASKS_URL" task, runs a deferrable function."""
+    name = flask.request.form.get("name")
+    func = DEFERRABLE.get(name)
+
+    if func is None:
+        # Not retried, the function no longer exists.
+        logger.error("Unknown deferred function %r", name)
+        return "", 204
+
+    args, kwargs = json.loads(flask.request.form["payload"])
+
+    with datastore.context():
+        func(*args, **kwargs)
+
+    return "", 204
+
+
+def _func(call: Callable[[], None]) -> Callable:
+    # The function to name in log messages, `submit` also takes plain functions.
+    return getattr(call, "func", call)
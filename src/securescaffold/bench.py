@@ -0,0 +1,444 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Load-test an app with synthetic App Engine traffic.
+
+Drives an app in-process through the WSGI interface, or over HTTP, with a
+mix of requests like those App Engine sends: Accept-Language variations for
+the language redirect, users signed in with IAP, admin and Cron requests
+with the "X-Appengine-*" headers, CSRF-protected POSTs and static files.
+Reports the throughput and latency percentiles for each kind of request.
+
+    python -m securescaffold.bench --requests 5000
+    python -m securescaffold.bench --http --concurrency 8
+
+By default the traffic is sent to `demo_app()`, which uses the scaffold's
+request hooks, decorators and views. Nothing here uses the network, so this
+can run in CI to catch performance regressions.
+"""
+import argparse
+import collections
+import os
+import random
+import secrets
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from typing import Callable, List, NamedTuple, Optional
+
+import flask
+import requests
+import werkzeug.serving
+
+from . import environ
+from . import factory
+from . import views
+from .contrib.appengine import users
+
+
+ACCEPT_LANGUAGES = [
+    "en-US,en;q=0.9",
+    "en-GB,en;q=0.9,en-US;q=0.8",
+    "fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7",
+    "de-DE,de;q=0.9,en;q=0.8",
+    "es-MX,es;q=0.9,en;q=0.8",
+    "pt-BR,pt;q=0.9,en-US;q=0.8,en;q=0.7",
+    "ja,en-US;q=0.9,en;q=0.8",
+    "zh-CN,zh;q=0.9",
+    "*",
+    "",
+]
+LOCALES = ["en", "fr", "de", "es-419", "pt-BR", "ja"]
+AUTH_DOMAIN = "example.com"
+
+# How often each kind of request is sent, relative to the others.
+DEFAULT_MIX = {
+    "redirect": 25,
+    "page": 30,
+    "post": 10,
+    "admin": 5,
+    "forbidden": 5,
+    "cron": 5,
+    "static": 20,
+}
+
+DEMO_PAGE = """<!doctype html>
+<title>{{ user }}</title>
+<script nonce="{{ csp_nonce() }}">window.locale = "{{ locale }}";</script>
+<form method="post" action="/form">
+  <input type="hidden" name="_csrf_token" value="{{ csrf_token() }}">
+</form>
+"""
+
+
+class Request(NamedTuple):
+    kind: str
+    method: str
+    path: str
+    headers: dict
+    expected: int
+    csrf: bool = False
+
+
+class Result(NamedTuple):
+    kind: str
+    status: int
+    expected: int
+    elapsed: float
+
+
+def user_headers(rng: random.Random, admin: bool = False) -> dict:
+    """Headers for a user signed in with IAP / the App Engine users API."""
+    number = rng.randrange(1000)
+    email = f"user{number}@{AUTH_DOMAIN}"
+
+    return {
+        "X-Goog-Authenticated-User-Email": f"accounts.google.com:{email}",
+        "X-Goog-Authenticated-User-Id": f"accounts.google.com:{number}",
+        users.USER_EMAIL_HEADER: email,
+        users.USER_ID_HEADER: str(number),
+        users.USER_AUTH_DOMAIN_HEADER: AUTH_DOMAIN,
+        users.USER_ADMIN_HEADER: "1" if admin else "0",
+    }
+
+
+def make_requests(count: int, mix: Optional[dict] = None, seed: int = 0) -> List[Request]:
+    """Make a reproducible list of requests for the demo app."""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    result = []
+
+    for kind in kinds:
+        headers = {"Accept-Language": rng.choice(ACCEPT_LANGUAGES)}
+
+        if kind == "redirect":
+            request = Request(kind, "GET", "/?utm_source=bench", headers, 302)
+        elif kind == "page":
+            headers.update(user_headers(rng))
+            request = Request(kind, "GET", f"/intl/{rng.choice(LOCALES)}/", headers, 200)
+        elif kind == "post":
+            headers.update(user_headers(rng))
+            request = Request(kind, "POST", "/form", headers, 200, csrf=True)
+        elif kind == "admin":
+            headers.update(user_headers(rng, admin=True))
+            request = Request(kind, "GET", "/admin/", headers, 200)
+        elif kind == "forbidden":
+            headers.update(user_headers(rng))
+            request = Request(kind, "GET", "/admin/", headers, 403)
+        elif kind == "cron":
+            headers.update({"X-Appengine-Cron": "true", environ.X_APPENGINE_QUEUENAME: "__cron"})
+            request = Request(kind, "GET", "/cron/cleanup", headers, 200)
+        elif kind == "static":
+            request = Request(kind, "GET", "/static/app.js", headers, 200)
+        else:
+            raise ValueError(f"Unknown kind of request: {kind!r}")
+
+        result.append(request)
+
+    return result
+
+
+def demo_app() -> flask.Flask:
+    """Create an app that uses the scaffold's hooks, decorators and views.
+
+    Use "securescaffold.bench:demo_app()" to serve it with gunicorn.
+    """
+    directory = tempfile.TemporaryDirectory(prefix="securescaffold-bench-")
+    static_folder = os.path.join(directory.name, "static")
+    settings_filename = os.path.join(directory.name, "settings.py")
+    os.mkdir(static_folder)
+
+    with open(os.path.join(static_folder, "app.js"), "w") as fh:
+        fh.write("console.log('securescaffold');\n" * 64)
+
+    with open(settings_filename, "w") as fh:
+        fh.write(f"SECRET_KEY = {secrets.token_urlsafe(16)!r}\n")
+        fh.write(f"LOCALES = {LOCALES!r}\n")
+        fh.write("CSP_POLICY_NONCE_IN = ['script-src']\n")
+
+    old_filename = os.environ.get("FLASK_SETTINGS_FILENAME")
+    os.environ["FLASK_SETTINGS_FILENAME"] = settings_filename
+
+    try:
+        app = factory.create_app(__name__, static_folder=static_folder)
+    finally:
+        if old_filename is None:
+            del os.environ["FLASK_SETTINGS_FILENAME"]
+        else:
+            os.environ["FLASK_SETTINGS_FILENAME"] = old_filename
+
+    # Removes the files when the app is garbage collected.
+    app.extensions["securescaffold.bench"] = directory
+    app.add_url_rule("/", "redirect", views.lang_redirect)
+
+    @app.route("/intl/<locale>/")
+    def page(locale):
+        return flask.render_template_string(DEMO_PAGE, locale=locale, user=users.get_current_user())
+
+    @app.route("/form", methods=["GET", "POST"])
+    def form():
+        if flask.request.method == "GET":
+            return flask.render_template_string("{{ csrf_token() }}")
+
+        return "OK"
+
+    @app.route("/admin/")
+    @environ.admin_only
+    def admin():
+        return f"Hello {users.get_current_user().nickname()}"
+
+    @app.route("/cron/cleanup")
+    @environ.cron_only
+    def cron():
+        return "OK"
+
+    return app
+
+
+class WSGIDriver:
+    """Sends requests to an app in-process, through the WSGI interface."""
+
+    def __init__(self, app: flask.Flask, base_url: str = "https://localhost"):
+        self.client = app.test_client()
+        self.base_url = base_url
+        self._token = None
+
+    def token(self) -> str:
+        if self._token is None:
+            response = self.client.get("/form", base_url=self.base_url)
+            self._token = response.get_data(as_text=True)
+
+        return self._token
+
+    def send(self, request: Request) -> int:
+        headers = dict(request.headers)
+        data = None
+
+        if request.csrf:
+            headers["X-CSRFToken"] = self.token()
+            headers["Referer"] = self.base_url + "/"
+            data = {"message": "hello"}
+
+        response = self.client.open(
+            request.path, method=request.method, headers=headers, data=data, base_url=self.base_url
+        )
+        response.close()
+
+        return response.status_code
+
+
+class HTTPDriver:
+    """Sends requests over HTTP with a keep-alive session.
+
+    Requests to an "http://" URL have the "X-Forwarded-Proto: https" header,
+    as if they came through App Engine's front end, so they are not
+    redirected to HTTPS. Secure cookies are sent too, for the same reason.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self._token = None
+        parts = urllib.parse.urlsplit(base_url)
+        self.referer = f"https://{parts.netloc}/"
+
+        if parts.scheme == "http":
+            self.session.headers["X-Forwarded-Proto"] = "https"
+
+    def token(self) -> str:
+        if self._token is None:
+            response = self.session.get(self.base_url + "/form")
+            self._token = response.text
+            # The session jar would not send Secure cookies over HTTP.
+            cookies = "; ".join(f"{cookie.name}={cookie.value}" for cookie in response.cookies)
+            self.session.headers["Cookie"] = cookies
+
+        return self._token
+
+    def send(self, request: Request) -> int:
+        headers = dict(request.headers)
+        data = None
+
+        if request.csrf:
+            headers["X-CSRFToken"] = self.token()
+            headers["Referer"] = self.referer
+            data = {"message": "hello"}
+
+        response = self.session.request(
+            request.method, self.base_url + request.path, headers=headers, data=data, allow_redirects=False
+        )
+
+        return response.status_code
+
+
+class Report:
+    """Throughput and latency percentiles from a run."""
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, results: List[Result], duration: float):
+        self.results = results
+        self.duration = duration
+
+    @property
+    def errors(self) -> List[Result]:
+        """Results with an unexpected status code."""
+        return [result for result in self.results if result.status != result.expected]
+
+    @property
+    def throughput(self) -> float:
+        return len(self.results) / self.duration
+
+    def summary(self) -> dict:
+        """Count, errors and latency percentiles (in ms) for each kind."""
+        by_kind = collections.defaultdict(list)
+
+        for result in self.results:
+            by_kind[result.kind].append(result)
+            by_kind["all"].append(result)
+
+        summary = {}
+
+        for kind, results in sorted(by_kind.items()):
+            latencies = sorted(result.elapsed * 1000 for result in results)
+            row = {
+                "count": len(results),
+                "errors": sum(1 for result in results if result.status != result.expected),
+            }
+
+            for value in self.PERCENTILES:
+                row[f"p{value}"] = percentile(latencies, value)
+
+            summary[kind] = row
+
+        return summary
+
+    def format(self) -> str:
+        lines = [f"{'kind':10} {'count':>7} {'errors':>7} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8}"]
+
+        for kind, row in self.summary().items():
+            lines.append(
+                f"{kind:10} {row['count']:7} {row['errors']:7} {row['p50']:8.3f} {row['p90']:8.3f} {row['p99']:8.3f}"
+            )
+
+        lines.append(f"{len(self.results)} requests in {self.duration:.2f}s, {self.throughput:.1f} req/s")
+
+        return "\n".join(lines)
+
+
+def percentile(values: list, value: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+
+    index = max(0, min(len(values) - 1, int(round(value / 100 * len(values))) - 1))
+
+    return values[index]
+
+
+def run(make_driver: Callable, request_list: List[Request], concurrency: int = 1) -> Report:
+    """Send the requests from concurrent threads, each with its own driver."""
+    results = []
+    failures = []
+    lock = threading.Lock()
+    drivers = [make_driver() for _ in range(concurrency)]
+
+    # Fetch CSRF tokens before the clock starts.
+    if any(request.csrf for request in request_list):
+        for driver in drivers:
+            driver.token()
+
+    def worker(driver, requests_for_worker):
+        worker_results = []
+
+        try:
+            for request in requests_for_worker:
+                start = time.perf_counter()
+                status = driver.send(request)
+                elapsed = time.perf_counter() - start
+                worker_results.append(Result(request.kind, status, request.expected, elapsed))
+        except Exception as err:
+            failures.append(err)
+
+        with lock:
+            results.extend(worker_results)
+
+    threads = [
+        threading.Thread(target=worker, args=(driver, request_list[index::concurrency]))
+        for index, driver in enumerate(drivers)
+    ]
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    if failures:
+        raise failures[0]
+
+    return Report(results, time.perf_counter() - start)
+
+
+class QuietRequestHandler(werkzeug.serving.WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Load-test an app with synthetic App Engine traffic.")
+    parser.add_argument("--requests", type=int, default=2000, help="Number of requests to send")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of concurrent clients")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random traffic mix")
+    parser.add_argument("--http", action="store_true", help="Serve the demo app on a local HTTP server")
+    parser.add_argument("--url", help='Send requests to a server running "securescaffold.bench:demo_app()"')
+    parser.add_argument("--check", action="store_true", help="Exit with an error for unexpected status codes")
+    args = parser.parse_args(argv)
+
+    request_list = make_requests(args.requests, seed=args.seed)
+    server = None
+
+    if args.url:
+        make_driver = lambda: HTTPDriver(args.url)  # noqa: E731
+    elif args.http:
+        server = werkzeug.serving.make_server(
+            "127.0.0.1", 0, demo_app(), threaded=True, request_handler=QuietRequestHandler
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        make_driver = lambda: HTTPDriver(f"http://127.0.0.1:{server.port}")  # noqa: E731
+    else:
+        app = demo_app()
+        make_driver = lambda: WSGIDriver(app)  # noqa: E731
+
+    try:
+        report = run(make_driver, request_list, args.concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    print(report.format())
+
+    if args.check and report.errors:
+        statuses = collections.Counter((error.kind, error.status) for error in report.errors)
+        print(f"Unexpected status codes: {dict(statuses)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
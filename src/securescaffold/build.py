@@ -0,0 +1,484 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Build steps for deploying to App Engine.
+
+    securescaffold-build assets --source dist --output build
+
+The "assets" step copies the static files to the output directory, with
+a copy of each script, stylesheet, image and font with a content hash in
+its name. It rewrites the references in HTML and CSS files, adds
+subresource integrity (SRI) hashes to script and stylesheet tags, and
+writes gzip (and brotli, if the brotli library is installed) variants of
+text files.
+
+It also writes "app.build.yaml" from your "app.yaml", with handlers that let
+browsers cache the hashed files for a year, and keep the "http_headers" of
+your static handlers. Deploy with `gcloud app deploy app.build.yaml`.
+
+Generating the app.yaml requires PyYAML, which you can install with
+`pip install securescaffold[build]`.
+
+    securescaffold-build templates --app main:app --output .jinja-cache
+
+The "templates" step compiles the app's Jinja templates to a bytecode cache,
+which `create_app` loads when the "JINJA_BYTECODE_CACHE" setting is the
+output directory. Without `--app` the templates in the "templates" directory
+are compiled with Flask's default Jinja options.
+"""
+import argparse
+import base64
+import copy
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import posixpath
+import re
+import shutil
+import sys
+import time
+from typing import Optional
+
+import flask
+import jinja2
+
+from . import caching
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+HASHED_EXTENSIONS = (
+    ".css",
+    ".gif",
+    ".ico",
+    ".jpeg",
+    ".jpg",
+    ".js",
+    ".mjs",
+    ".png",
+    ".svg",
+    ".webp",
+    ".woff",
+    ".woff2",
+)
+COMPRESSED_EXTENSIONS = (".css", ".html", ".js", ".json", ".mjs", ".svg", ".txt", ".xml")
+HASH_LENGTH = 10
+HASHED_NAME_PATTERN = r".+\.[0-9a-f]{%d}\.[A-Za-z0-9]+" % HASH_LENGTH
+# The manifest is written next to the output directory, so it is not served.
+MANIFEST_SUFFIX = ".manifest.json"
+
+TAG_PATTERN = re.compile(r"<(script|link|img|source)\b[^>]*>", re.IGNORECASE)
+ATTR_PATTERN = re.compile(r"""\b(src|href|srcset)\s*=\s*(["'])(.*?)\2""", re.IGNORECASE)
+# url(...) and @import "..." in stylesheets.
+CSS_URL_PATTERN = re.compile(r"""url\(\s*(["']?)([^"')]*?)\1\s*\)|@import\s+(["'])(.*?)\3""", re.IGNORECASE)
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def sri_hash(data: bytes) -> str:
+    """Subresource integrity value for a file."""
+    digest = hashlib.sha384(data).digest()
+
+    return "sha384-" + base64.b64encode(digest).decode("ascii")
+
+
+def hashed_name(path: str, data: bytes) -> str:
+    """Add the content hash to a filename, "main.js" -> "main.0123456789.js"."""
+    root, ext = posixpath.splitext(path)
+
+    return f"{root}.{content_hash(data)}{ext}"
+
+
+def manifest_path(output: str) -> str:
+    """The manifest for an output directory, "build" -> "build.manifest.json"."""
+    return output.rstrip("/" + os.sep) + MANIFEST_SUFFIX
+
+
+def build_assets(source: str, output: str) -> dict:
+    """Copy static files to the output directory, with hashed names.
+
+    Files are also written under their own names, for URLs that are not
+    rewritten (like those built by scripts). References in stylesheets are
+    rewritten before the stylesheet is hashed, so a stylesheet's name
+    changes when a font or image it uses changes.
+
+    :param str source: The directory of static files, for example "dist".
+    :param str output: The directory to write, which is replaced.
+    :return: The manifest, which maps URL paths to a dict with the hashed
+        "path" and the "integrity" value. It is also written to
+        `manifest_path(output)`.
+    """
+    if os.path.exists(output):
+        shutil.rmtree(output)
+
+    manifest = {}
+    html_files = []
+    css_files = {}
+
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames.sort()
+
+        for filename in sorted(filenames):
+            src = os.path.join(dirpath, filename)
+            relpath = os.path.relpath(src, source).replace(os.sep, "/")
+
+            with open(src, "rb") as fh:
+                data = fh.read()
+
+            if relpath.lower().endswith(".html"):
+                html_files.append((relpath, data))
+                continue
+
+            if relpath.lower().endswith(".css"):
+                css_files[relpath] = data
+            elif relpath.lower().endswith(HASHED_EXTENSIONS):
+                write_hashed_file(output, relpath, data, manifest)
+            else:
+                write_file(output, relpath, data)
+
+    building = set()
+
+    def build_css(relpath):
+        if "/" + relpath in manifest or relpath in building:
+            return
+
+        # Imported stylesheets first, so this one refers to their hashed names.
+        building.add(relpath)
+        url_path = "/" + relpath
+        css = css_files[relpath].decode("utf-8", "surrogateescape")
+
+        for match in CSS_URL_PATTERN.finditer(css):
+            key = resolve_url(match.group(2) or match.group(4) or "", url_path)
+
+            if key is not None and key[1:] in css_files:
+                build_css(key[1:])
+
+        css = rewrite_css(css, url_path, manifest)
+        write_hashed_file(output, relpath, css.encode("utf-8", "surrogateescape"), manifest)
+
+    for relpath in css_files:
+        build_css(relpath)
+
+    for relpath, data in html_files:
+        html = rewrite_html(data.decode("utf-8"), "/" + relpath, manifest)
+        write_file(output, relpath, html.encode("utf-8"))
+
+    with open(manifest_path(output), "w") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def write_hashed_file(output: str, relpath: str, data: bytes, manifest: dict) -> None:
+    """Write a file under its hashed name and its own name, and add it to the manifest."""
+    target = hashed_name(relpath, data)
+    manifest["/" + relpath] = {"path": "/" + target, "integrity": sri_hash(data)}
+    write_file(output, target, data)
+    write_file(output, relpath, data)
+
+
+def write_file(output: str, relpath: str, data: bytes) -> None:
+    """Write a file, and its compressed variants."""
+    path = os.path.join(output, *relpath.split("/"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path, "wb") as fh:
+        fh.write(data)
+
+    if not relpath.lower().endswith(COMPRESSED_EXTENSIONS):
+        return
+
+    # mtime=0 so the output is the same for the same input.
+    variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data)))
+
+    for suffix, compressed in variants:
+        # Only worth keeping if it is smaller.
+        if len(compressed) < len(data):
+            with open(path + suffix, "wb") as fh:
+                fh.write(compressed)
+
+
+def resolve_url(url: str, url_path: str) -> Optional[str]:
+    """The path of a local URL referenced from the file at `url_path`."""
+    if not url or "://" in url or url.startswith(("//", "#", "data:")):
+        return None
+
+    path = re.split(r"[?#]", url, maxsplit=1)[0]
+
+    return posixpath.normpath(posixpath.join(posixpath.dirname(url_path), path))
+
+
+def hashed_url(url: str, url_path: str, manifest: dict) -> Optional[str]:
+    """The URL of the hashed file for a reference, or None if there isn't one.
+
+    The query string and fragment are kept, and relative URLs stay relative.
+    """
+    entry = manifest.get(resolve_url(url, url_path))
+
+    if entry is None:
+        return None
+
+    path, rest = re.match(r"([^?#]*)(.*)", url).groups()
+    base = posixpath.dirname(url_path) + "/"
+    new_path = entry["path"] if path.startswith("/") else posixpath.relpath(entry["path"], base)
+
+    return new_path + rest
+
+
+def rewrite_html(html: str, url_path: str, manifest: dict) -> str:
+    """Point script, stylesheet, icon and image tags at the hashed files.
+
+    Script and stylesheet tags also get an "integrity" attribute.
+    """
+
+    def replace_srcset(value):
+        candidates = []
+
+        for candidate in value.split(","):
+            url, space, descriptor = candidate.strip().partition(" ")
+            candidates.append((hashed_url(url, url_path, manifest) or url) + space + descriptor)
+
+        return ", ".join(candidates)
+
+    def replace_tag(match):
+        tag = match.group(0)
+        integrity = None
+
+        def replace_attr(attr):
+            nonlocal integrity
+            name, quote, value = attr.groups()
+
+            if name.lower() == "srcset":
+                new_value = replace_srcset(value)
+            else:
+                new_value = hashed_url(value, url_path, manifest)
+
+                if new_value is None:
+                    return attr.group(0)
+
+                integrity = manifest[resolve_url(value, url_path)]["integrity"]
+
+            return f"{name}={quote}{new_value}{quote}"
+
+        tag = ATTR_PATTERN.sub(replace_attr, tag)
+        needs_integrity = match.group(1).lower() == "script" or re.search(r"stylesheet", tag, re.IGNORECASE)
+
+        if integrity and needs_integrity and "integrity=" not in tag.lower():
+            end = -2 if tag.endswith("/>") else -1
+            tag = f'{tag[:end].rstrip()} integrity="{integrity}"{tag[end:]}'
+
+        return tag
+
+    return TAG_PATTERN.sub(replace_tag, html)
+
+
+def rewrite_css(css: str, url_path: str, manifest: dict) -> str:
+    """Point url(...) and @import references in a stylesheet at the hashed files."""
+
+    def replace_url(match):
+        group = 2 if match.group(4) is None else 4
+        new_url = hashed_url(match.group(group), url_path, manifest)
+
+        if new_url is None:
+            return match.group(0)
+
+        start = match.start(group) - match.start()
+        end = match.end(group) - match.start()
+
+        return match.group(0)[:start] + new_url + match.group(0)[end:]
+
+    return CSS_URL_PATTERN.sub(replace_url, css)
+
+
+STATIC_PATH_KEYS = ("static_dir", "static_files", "upload")
+
+
+def build_app_yaml(app_yaml: dict, source: str, output: str, html_expiration: str = "10m") -> dict:
+    """Make an app.yaml config for the output of `build_assets`.
+
+    Handlers are matched in order, so the order is kept. Static handlers
+    for the source directory are changed to use the output directory, and
+    are cached for `html_expiration` unless they set an "expiration". Each
+    "static_dir" handler comes after a new handler for its hashed files,
+    which are cached for a year. All the other settings of the handlers
+    (like "http_headers", "login" and "application_readable") are kept.
+    """
+    config = {key: value for key, value in app_yaml.items() if key != "handlers"}
+    source = source.rstrip("/")
+    output = output.rstrip("/")
+    handlers = []
+
+    for handler in app_yaml.get("handlers", []):
+        if not any(_in_dir(handler.get(key), source) for key in STATIC_PATH_KEYS):
+            handlers.append(handler)
+            continue
+
+        handler = dict(handler)
+
+        for key in STATIC_PATH_KEYS:
+            if _in_dir(handler.get(key), source):
+                handler[key] = output + handler[key][len(source):]
+
+        handler.setdefault("expiration", html_expiration)
+
+        if "static_dir" in handler:
+            handlers.append(_hashed_handler(handler))
+
+        handlers.append(handler)
+
+    config["handlers"] = handlers
+
+    return config
+
+
+def _in_dir(path: Optional[str], directory: str) -> bool:
+    return isinstance(path, str) and (path == directory or path.startswith(directory + "/"))
+
+
+def _hashed_handler(handler: dict) -> dict:
+    # The URL of a static_dir handler is a prefix, which may end with ".*".
+    prefix = handler["url"]
+
+    if prefix.endswith(".*"):
+        prefix = prefix[:-2]
+
+    prefix = prefix.rstrip("/") + "/"
+    directory = handler["static_dir"].rstrip("/")
+    result = {
+        "url": f"{prefix}({HASHED_NAME_PATTERN})$",
+        "static_files": directory + r"/\1",
+        "upload": f"{directory}/{HASHED_NAME_PATTERN}$",
+        "expiration": "365d",
+    }
+    ignored = ("url", "expiration", "mime_type") + STATIC_PATH_KEYS
+    # Copies, so PyYAML doesn't write anchors and aliases for shared values.
+    result.update((key, copy.deepcopy(value)) for key, value in handler.items() if key not in ignored)
+
+    return result
+
+
+def write_app_yaml(
+    app_yaml_path: str, output_path: str, source: str, output: str, html_expiration: str = "10m"
+) -> None:
+    if yaml is None:
+        raise RuntimeError("Writing app.yaml requires PyYAML, install securescaffold[build]")
+
+    with open(app_yaml_path) as fh:
+        app_yaml = yaml.safe_load(fh)
+
+    config = build_app_yaml(app_yaml, source, output, html_expiration)
+
+    with open(output_path, "w") as fh:
+        fh.write(f"# Generated by securescaffold-build from {os.path.basename(app_yaml_path)}, do not edit.\n\n")
+        yaml.safe_dump(config, fh, sort_keys=False, default_flow_style=False)
+
+
+def assets_command(args: argparse.Namespace) -> None:
+    manifest = build_assets(args.source, args.output)
+    print(f"Wrote {len(manifest)} hashed files to {args.output}")
+
+    if args.app_yaml:
+        write_app_yaml(args.app_yaml, args.output_app_yaml, args.source, args.output, args.html_expiration)
+        print(f"Wrote {args.output_app_yaml}")
+
+
+def load_app(app_path: str) -> flask.Flask:
+    """Import an app, given as "module:attribute" like gunicorn's argument."""
+    module_name, _, name = app_path.partition(":")
+    sys.path.insert(0, os.getcwd())
+    module = importlib.import_module(module_name)
+
+    return getattr(module, name or "app")
+
+
+def compile_templates(app: flask.Flask, output: str) -> list:
+    """Compile all the app's templates to a bytecode cache directory.
+
+    :return: The names of the templates.
+    """
+    os.makedirs(output, exist_ok=True)
+
+    # Remove templates that no longer exist.
+    for filename in os.listdir(output):
+        if filename.endswith(".cache"):
+            os.remove(os.path.join(output, filename))
+
+    # cache_size=0 so every template is compiled, even if the app's
+    # environment has already loaded it.
+    env = app.jinja_env.overlay(bytecode_cache=caching.TemplateBytecodeCache(output), cache_size=0)
+    names = env.list_templates()
+
+    for name in names:
+        env.get_template(name)
+
+    return names
+
+
+def templates_command(args: argparse.Namespace) -> None:
+    if args.app:
+        app = load_app(args.app)
+    else:
+        app = flask.Flask("securescaffold.build", root_path=os.getcwd(), template_folder=args.templates)
+
+    start = time.perf_counter()
+
+    try:
+        names = compile_templates(app, args.output)
+    except jinja2.TemplateSyntaxError as exc:
+        sys.exit(f"{exc.filename or exc.name}:{exc.lineno}: {exc.message}")
+
+    elapsed = time.perf_counter() - start
+    print(f"Compiled {len(names)} templates to {args.output} in {elapsed:.2f}s")
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Build steps for deploying to App Engine.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    assets = subparsers.add_parser("assets", help="Fingerprint and compress static files")
+    assets.add_argument("--source", default="dist", help='Directory of static files, default "dist"')
+    assets.add_argument("--output", default="build", help='Directory to write, default "build"')
+    assets.add_argument("--app-yaml", default="app.yaml", help='App config to read, or "" to skip')
+    assets.add_argument("--output-app-yaml", default="app.build.yaml", help='App config to write')
+    assets.add_argument("--html-expiration", default="10m", help='Cache time for HTML and other files')
+    assets.set_defaults(func=assets_command)
+
+    templates = subparsers.add_parser("templates", help="Compile Jinja templates to a bytecode cache")
+    templates.add_argument("--app", help='Import the app, like "main:app", to use its Jinja options')
+    templates.add_argument("--templates", default="templates", help='Template directory without --app')
+    templates.add_argument("--output", default=".jinja-cache", help='Directory to write, default ".jinja-cache"')
+    templates.set_defaults(func=templates_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Caching rendered templates, and conditional GET with ETags.
+
+Templates that use `csp_nonce()` produce a different page for every request.
+`RenderCache` renders a template with a placeholder for the nonce, caches the
+result, and computes the ETag from it. The request's nonce is substituted
+just before the response is sent, and requests with a matching If-None-Match
+header get a 304 response without rendering the template.
+
+`TemplateBytecodeCache` loads templates compiled at build time, so instances
+don't compile them on their first requests.
+"""
+import collections
+import hashlib
+import os
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+import flask
+import jinja2
+
+from . import forksafe
+
+
+NONCE_PLACEHOLDER = "__securescaffold_csp_nonce__"
+CSP_HEADERS = ("Content-Security-Policy", "Content-Security-Policy-Report-Only")
+
+
+class RenderCache:
+    """Cache of rendered templates, with the CSP nonce left as a placeholder.
+
+    `create_app` adds an instance to the app as `app.render_cache`. Use
+    `securescaffold.caching.render_template` in your request handlers.
+    """
+
+    def __init__(self, app: Optional[flask.Flask] = None, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        forksafe.register(self._after_fork)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask) -> None:
+        # After-request functions run in reverse order of registration. This
+        # must be registered before Flask-Talisman so it runs afterwards.
+        app.after_request(self._strip_not_modified)
+        app.render_cache = self
+
+    def render(self, template_name: str, cache_key: Optional[Hashable] = None, **context) -> flask.Response:
+        """Render a template, or answer a conditional GET with 304.
+
+        :param str template_name: The template to render.
+        :param cache_key: Identifies the rendered page. Defaults to a key
+            made from the template context.
+        :return: A response with a weak ETag header.
+        """
+        if cache_key is None:
+            cache_key = make_key(context)
+
+        key = (template_name, cache_key)
+        entry = self._cache.get(key)
+
+        if entry is None:
+            entry = self._render(template_name, context)
+
+            if entry is None:
+                # The template is not cacheable, render it as usual.
+                return flask.make_response(flask.render_template(template_name, **context))
+
+            self._store(key, entry)
+
+        etag, parts = entry
+        request = flask.request
+
+        if request.method in ("GET", "HEAD") and request.if_none_match.contains_weak(etag):
+            response = flask.Response(status=304)
+        else:
+            nonce = getattr(request, "csp_nonce", "").encode("ascii")
+            response = flask.Response(nonce.join(parts), mimetype="text/html")
+
+        response.set_etag(etag, weak=True)
+        # The nonce is unique to each response, so only the browser caches it.
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+        return response
+
+    def clear(self) -> None:
+        """Remove all cached pages."""
+        with self._lock:
+            self._cache.clear()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def _render(self, template_name, context):
+        request = flask.request
+        g = flask.g
+        had_nonce = hasattr(request, "csp_nonce")
+        nonce = getattr(request, "csp_nonce", None)
+        # Clear the flag, to see if the template itself asks for the token.
+        csrf_requested = g.pop("seasurf_csrf_token_requested", None)
+        request.csp_nonce = NONCE_PLACEHOLDER
+
+        try:
+            body = flask.render_template(template_name, **context)
+        finally:
+            if had_nonce:
+                request.csp_nonce = nonce
+            else:
+                del request.csp_nonce
+
+            rendered_csrf = g.pop("seasurf_csrf_token_requested", False)
+
+            # Flask-SeaSurf sets the CSRF cookie if the token was requested.
+            if csrf_requested or rendered_csrf:
+                g.seasurf_csrf_token_requested = True
+
+        if rendered_csrf:
+            # The page includes the user's CSRF token, never cache it.
+            return None
+
+        body = body.encode("utf-8")
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        parts = tuple(body.split(NONCE_PLACEHOLDER.encode("ascii")))
+
+        return etag, parts
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._cache[key] = entry
+
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def _strip_not_modified(response):
+        # A browser updates its cached response with the headers of a 304
+        # response. A new nonce in the CSP would not match the cached page,
+        # so the cached page keeps the policy it was sent with.
+        if response.status_code == 304 and "ETag" in response.headers:
+            for name in CSP_HEADERS:
+                response.headers.pop(name, None)
+
+        return response
+
+
+class FileCache:
+    """Cache of values computed from the contents of files.
+
+    The value is computed once, and computed again when the file's
+    modification time or size changes.
+
+    :param render: Callable that is passed the contents of the file.
+    :param str encoding: Used to read the file.
+    """
+
+    def __init__(self, render: Callable[[str], Any], encoding: str = "utf-8"):
+        self.render = render
+        self.encoding = encoding
+        self._cache = {}
+
+    def get(self, path: str) -> Any:
+        """Get the value for a file, computing it if the file changed."""
+        version = self.version(path)
+        entry = self._cache.get(path)
+
+        if entry is None or entry[0] != version:
+            with open(path, encoding=self.encoding) as fh:
+                value = self.render(fh.read())
+
+            entry = (version, value)
+            self._cache[path] = entry
+
+        return entry[1]
+
+    def version(self, path: str) -> tuple:
+        """Identifies the current contents of a file.
+
+        Use this as the `cache_key` for `render_template`, for pages that
+        only depend on the file.
+        """
+        stat = os.stat(path)
+
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+
+class TemplateBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """Jinja bytecode cache in a directory deployed with the app.
+
+    Fill the directory with `securescaffold-build templates`. Templates are
+    found by name, so the cache works when the app is deployed to a different
+    path than the one it was built in. A template that is missing from the
+    cache, changed since the build, or compiled by a different version of
+    Python is compiled as usual.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__(directory, "%s.cache")
+
+    def get_cache_key(self, name: str, filename: Optional[str] = None) -> str:
+        # The default includes the template's absolute filename.
+        return super().get_cache_key(name)
+
+    def load_bytecode(self, bucket: jinja2.bccache.Bucket) -> None:
+        try:
+            super().load_bytecode(bucket)
+        except Exception:
+            # A damaged file, compile the template instead.
+            bucket.reset()
+
+    def dump_bytecode(self, bucket: jinja2.bccache.Bucket) -> None:
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            # App Engine's filesystem is read-only, the compiled template is
+            # still cached in memory by the Jinja environment.
+            pass
+
+
+def make_key(context: dict) -> Hashable:
+    """Make a cache key from a template context."""
+    return tuple(sorted((name, repr(value)) for name, value in context.items()))
+
+
+def render_template(template_name: str, cache_key: Optional[Hashable] = None, **context) -> flask.Response:
+    """Render a template using the app's render cache.
+
+    Do not use this for pages with data that is specific to the user, unless
+    `cache_key` includes the user's identity. Pages that include the CSRF
+    token are never cached.
+    """
+    cache = flask.current_app.render_cache
+
+    return cache.render(template_name, cache_key=cache_key, **context)
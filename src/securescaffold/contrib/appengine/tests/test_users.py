@@ -13,10 +13,13 @@
 # limitations under the License.
 
 import contextlib
+import time
+import urllib.error
 from unittest import mock
 
 import flask
 import pytest
+from google.auth import jwt
 from werkzeug.exceptions import HTTPException
 
 from securescaffold.contrib.appengine import users
@@ -150,3 +153,164 @@ def test_user_hash():
         user = users.User()
 
         assert hash(user) == hash((user.email(), user.auth_domain()))
+
+
+@pytest.fixture(scope="module")
+def iap_key():
+    """Generate a key pair for signing IAP tokens."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from google.auth import crypt
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    private_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    public_pem = key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    signer = crypt.ES256Signer.from_string(private_pem, key_id="test-kid")
+
+    return signer, {"test-kid": public_pem.decode("ascii")}
+
+
+def make_iap_token(signer, email="alice@example.com", audience="/projects/1/apps/test", exp=None):
+    now = int(time.time())
+    payload = {
+        "aud": audience,
+        "email": email,
+        "exp": exp or now + 600,
+        "iat": now,
+        "iss": users.IAP_ISSUER,
+        "sub": "accounts.google.com:1",
+    }
+
+    return jwt.encode(signer, payload).decode("ascii")
+
+
+def iap_app(certs):
+    app = flask.Flask("test")
+    app.config["IAP_AUDIENCE"] = "/projects/1/apps/test"
+    fetch_certs = mock.MagicMock(return_value=certs)
+    app.extensions["securescaffold.iap"] = users.IAPVerifier(
+        "/projects/1/apps/test", fetch_certs=fetch_certs
+    )
+
+    return app, fetch_certs
+
+
+def test_get_current_user_verifies_iap_token(iap_key):
+    signer, certs = iap_key
+    app, fetch_certs = iap_app(certs)
+    headers = [
+        (users.USER_EMAIL_HEADER, "alice@example.com"),
+        (users.USER_AUTH_DOMAIN_HEADER, "example.com"),
+        (users.IAP_JWT_HEADER, make_iap_token(signer)),
+    ]
+
+    for _ in range(3):
+        with app.test_request_context(headers=headers):
+            user = users.get_current_user()
+
+        assert user.email() == "alice@example.com"
+
+    # The keys are fetched once, and cached.
+    assert fetch_certs.call_count == 1
+
+
+def test_get_current_user_rejects_invalid_iap_token(iap_key):
+    signer, certs = iap_key
+    app, _ = iap_app(certs)
+    tokens = [
+        None,
+        "not-a-token",
+        make_iap_token(signer, email="mallory@example.com"),
+        make_iap_token(signer, audience="/projects/2/apps/other"),
+        make_iap_token(signer, exp=int(time.time()) - 3600),
+    ]
+
+    for token in tokens:
+        headers = [
+            (users.USER_EMAIL_HEADER, "alice@example.com"),
+            (users.USER_AUTH_DOMAIN_HEADER, "example.com"),
+        ]
+
+        if token:
+            headers.append((users.IAP_JWT_HEADER, token))
+
+        with app.test_request_context(headers=headers):
+            assert users.get_current_user() is None
+
+
+def test_iap_verifier_caches_verified_tokens(iap_key):
+    signer, certs = iap_key
+    verifier = users.IAPVerifier("/projects/1/apps/test", fetch_certs=lambda: certs, cache_size=2)
+    tokens = [make_iap_token(signer, email=f"{i}@example.com") for i in range(3)]
+
+    for token in tokens:
+        verifier.verify(token)
+
+    assert list(verifier._tokens) == tokens[1:]
+
+    with mock.patch.object(verifier, "_verify_signature") as verify_signature:
+        assert verifier.verify(tokens[2])["email"] == "2@example.com"
+
+    assert not verify_signature.called
+
+
+def test_iap_verifier_refreshes_certs_in_background(iap_key):
+    _, certs = iap_key
+    now = [1000.0]
+    fetch_certs = mock.MagicMock(return_value=certs)
+    verifier = users.IAPVerifier(
+        "aud", fetch_certs=fetch_certs, certs_ttl=100, refresh_ahead=10, clock=lambda: now[0]
+    )
+
+    verifier.certs()
+    now[0] += 95
+
+    with mock.patch("threading.Thread") as thread:
+        assert verifier.certs() == certs
+
+    assert thread.return_value.start.called
+    assert fetch_certs.call_count == 1
+
+    # Expired keys are fetched before verifying.
+    now[0] += 10
+    verifier._refreshing = False
+    verifier.certs()
+    assert fetch_certs.call_count == 2
+
+
+def test_iap_verifier_limits_refreshes_for_unknown_keys(iap_key):
+    signer, certs = iap_key
+    now = [1000.0]
+    fetch_certs = mock.MagicMock(return_value={"other-kid": certs["test-kid"]})
+    verifier = users.IAPVerifier("/projects/1/apps/test", fetch_certs=fetch_certs, clock=lambda: now[0])
+    token = make_iap_token(signer)
+
+    for _ in range(3):
+        with pytest.raises(users.InvalidTokenError, match="Unknown key ID"):
+            verifier.verify(token)
+
+    # Fetched once when the keys were needed, and once for the unknown key.
+    assert fetch_certs.call_count == 2
+
+    # IAP rotated its keys.
+    now[0] += verifier.force_refresh_interval
+    fetch_certs.return_value = certs
+
+    assert verifier.verify(token)["email"] == "alice@example.com"
+    assert fetch_certs.call_count == 3
+
+
+def test_iap_verifier_fetch_error_is_invalid_token(iap_key):
+    signer, _ = iap_key
+    fetch_certs = mock.MagicMock(side_effect=urllib.error.URLError("Network is unreachable"))
+    verifier = users.IAPVerifier("/projects/1/apps/test", fetch_certs=fetch_certs)
+
+    with pytest.raises(users.InvalidTokenError, match="Could not fetch"):
+        verifier.verify(make_iap_token(signer))
@@ -15,13 +15,27 @@
 """
 This only works when IAP is enabled for your App Engine instance
 """
+import collections
+import json
+import threading
+import time
+import urllib.request
+
 import flask
+from google.auth import exceptions as auth_exceptions
+from google.auth import jwt
+
+from securescaffold import forksafe
 
 
 USER_ADMIN_HEADER = "X-Appengine-User-Is-Admin"
 USER_AUTH_DOMAIN_HEADER = "X-Appengine-Auth-Domain"
 USER_EMAIL_HEADER = "X-Appengine-User-Email"
 USER_ID_HEADER = "X-Appengine-User-Id"
+IAP_JWT_HEADER = "X-Goog-IAP-JWT-Assertion"
+
+IAP_CERTS_URL = "https://www.gstatic.com/iap/verify/public_key"
+IAP_ISSUER = "https://cloud.google.com/iap"
 
 
 class Error(Exception):
@@ -32,6 +46,10 @@ class UserNotFoundError(Error):
     """No email argument was specified, and no user is logged in."""
 
 
+class InvalidTokenError(UserNotFoundError):
+    """The IAP JWT assertion is missing, invalid or for a different user."""
+
+
 def requires_auth(func):
     """A decorator that requires a currently logged in user."""
 
@@ -61,6 +79,175 @@ def get_header(header):
     return flask.request.headers.get(header)
 
 
+def fetch_iap_certs(url=IAP_CERTS_URL):
+    """Fetch IAP's public keys, a dict of key ID to PEM-encoded key."""
+    with urllib.request.urlopen(url, timeout=10) as fh:
+        return json.load(fh)
+
+
+class IAPVerifier:
+    """Verifies the JWT assertions that IAP adds to requests.
+
+    The public keys are cached for `certs_ttl` seconds, and refreshed in a
+    background thread when they are due to expire. A token signed with an
+    unknown key fetches the keys again, at most once every
+    `force_refresh_interval` seconds. The claims of verified
+    tokens are cached (up to `cache_size` tokens) until the token expires, so
+    repeat requests with the same token skip the signature check.
+    """
+
+    def __init__(
+        self,
+        audience,
+        fetch_certs=fetch_iap_certs,
+        certs_ttl=3600,
+        refresh_ahead=300,
+        force_refresh_interval=60,
+        cache_size=1024,
+        clock=time.time,
+    ):
+        self.audience = audience
+        self.fetch_certs = fetch_certs
+        self.certs_ttl = certs_ttl
+        self.refresh_ahead = refresh_ahead
+        self.force_refresh_interval = force_refresh_interval
+        self.cache_size = cache_size
+        self.clock = clock
+        self._certs = None
+        self._certs_expires = 0
+        self._last_forced = None
+        self._certs_lock = threading.Lock()
+        self._refreshing = False
+        self._tokens = collections.OrderedDict()
+        self._tokens_lock = threading.Lock()
+        forksafe.register(self._after_fork)
+
+    def verify(self, token) -> dict:
+        """Verify a token and return its claims.
+
+        :raises InvalidTokenError: If the token is not valid.
+        """
+        if not token:
+            raise InvalidTokenError()
+
+        now = self.clock()
+        entry = self._tokens.get(token)
+
+        if entry is not None and entry[0] > now:
+            with self._tokens_lock:
+                if token in self._tokens:
+                    self._tokens.move_to_end(token)
+
+            return entry[1]
+
+        claims = self._verify_signature(token)
+
+        with self._tokens_lock:
+            self._tokens[token] = (claims["exp"], claims)
+
+            while len(self._tokens) > self.cache_size:
+                self._tokens.popitem(last=False)
+
+        return claims
+
+    def certs(self, force=False) -> dict:
+        """Get the cached public keys, fetching them if they have expired."""
+        now = self.clock()
+
+        if force or self._certs is None or now >= self._certs_expires:
+            with self._certs_lock:
+                # Another thread may have fetched the keys while we waited.
+                if force or self._certs is None or self.clock() >= self._certs_expires:
+                    self._update_certs()
+        elif now >= self._certs_expires - self.refresh_ahead and not self._refreshing:
+            self._refreshing = True
+            thread = threading.Thread(target=self._refresh_in_background, daemon=True)
+            thread.start()
+
+        return self._certs
+
+    def refresh_unknown_key(self) -> dict:
+        """Fetch the public keys again, unless that was done recently.
+
+        Tokens can name any key ID, so this limits how often they can make
+        the app fetch the keys.
+        """
+        with self._certs_lock:
+            now = self.clock()
+
+            if self._last_forced is None or now - self._last_forced >= self.force_refresh_interval:
+                self._last_forced = now
+                self._update_certs()
+
+        return self._certs
+
+    def _after_fork(self):
+        # The refresh thread does not survive a fork, nor do its locks.
+        self._certs_lock = threading.Lock()
+        self._tokens_lock = threading.Lock()
+        self._refreshing = False
+
+    def _update_certs(self):
+        certs = self.fetch_certs()
+        self._certs_expires = self.clock() + self.certs_ttl
+        self._certs = certs
+
+    def _refresh_in_background(self):
+        try:
+            with self._certs_lock:
+                self._update_certs()
+        except Exception:
+            # Keep the current keys, they are fetched again when they expire.
+            pass
+        finally:
+            self._refreshing = False
+
+    def _verify_signature(self, token) -> dict:
+        try:
+            header = jwt.decode_header(token)
+            certs = self.certs()
+
+            if header.get("kid") not in certs:
+                # IAP may have rotated its keys.
+                certs = self.refresh_unknown_key()
+
+            if header.get("kid") not in certs:
+                raise InvalidTokenError("Unknown key ID")
+
+            claims = jwt.decode(token, certs=certs, audience=self.audience)
+        except (ValueError, auth_exceptions.GoogleAuthError) as err:
+            raise InvalidTokenError(str(err)) from err
+        except OSError as err:
+            # Fetching the keys failed (urllib's URLError is an OSError).
+            raise InvalidTokenError(f"Could not fetch IAP keys: {err}") from err
+
+        if claims.get("iss") != IAP_ISSUER:
+            raise InvalidTokenError("Wrong issuer")
+
+        return claims
+
+
+def get_verifier():
+    """Get the IAP verifier for the current app, or None.
+
+    Verification is enabled by setting "IAP_AUDIENCE" in the app config. See
+    https://cloud.google.com/iap/docs/signed-headers-howto for the audience.
+    """
+    app = flask.current_app
+    audience = app.config.get("IAP_AUDIENCE")
+
+    if not audience:
+        return None
+
+    verifier = app.extensions.get("securescaffold.iap")
+
+    if verifier is None or verifier.audience != audience:
+        verifier = IAPVerifier(audience)
+        app.extensions["securescaffold.iap"] = verifier
+
+    return verifier
+
+
 class User:
     def __init__(self, email=None, _auth_domain=None, _user_id=None, _strict_mode=True):
         if not _auth_domain:
@@ -72,6 +259,13 @@ class User:
 
         if not email:
             email = get_header(USER_EMAIL_HEADER)
+            verifier = get_verifier()
+
+            if email and verifier:
+                claims = verifier.verify(get_header(IAP_JWT_HEADER))
+
+                if claims.get("email") != email:
+                    raise InvalidTokenError("Email does not match")
         self._email = email
 
         if not _user_id:
@@ -0,0 +1,173 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache credentials and API clients, keyed by OAuth scopes.
+
+Creating credentials on App Engine can mean a round trip to the metadata
+server and a token exchange, and creating a client opens a new HTTP session.
+`CredentialsCache` creates them once for each set of scopes, and refreshes
+the tokens in a background thread before they expire.
+"""
+import datetime
+import logging
+import threading
+from typing import Callable, Iterable, Optional
+
+import google.auth.transport.requests
+from google.auth import credentials as auth_credentials
+
+from . import forksafe
+
+
+logger = logging.getLogger(__name__)
+
+
+def utcnow() -> datetime.datetime:
+    # google-auth uses naive datetimes in UTC for the token expiry.
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class _Entry:
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.lock = threading.Lock()
+
+
+class CredentialsCache:
+    """Cache of credentials and API clients for each set of scopes.
+
+    :param factory: Callable that is passed a list of scopes (or None) and
+        returns new credentials.
+    :param float refresh_ahead: Seconds before the token expires that the
+        background thread refreshes it.
+    :param float poll_interval: Seconds between checks by the background
+        thread, or None for no background thread.
+    :param request_factory: Callable that returns a google-auth transport
+        request, used to refresh tokens.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[Optional[list]], auth_credentials.Credentials],
+        refresh_ahead: float = 300.0,
+        poll_interval: Optional[float] = 60.0,
+        request_factory: Callable = google.auth.transport.requests.Request,
+        clock: Callable[[], datetime.datetime] = utcnow,
+    ):
+        self.factory = factory
+        self.refresh_ahead = datetime.timedelta(seconds=refresh_ahead)
+        self.poll_interval = poll_interval
+        self.request_factory = request_factory
+        self.clock = clock
+        self._entries = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+        forksafe.register(self._after_fork)
+
+    def get(self, scopes: Optional[Iterable[str]] = None) -> auth_credentials.Credentials:
+        """Get credentials for the scopes, with a valid token."""
+        key = frozenset(scopes or ())
+        entry = self._entries.get(key)
+
+        if entry is None:
+            with self._lock:
+                entry = self._entries.get(key)
+
+                if entry is None:
+                    entry = _Entry(self.factory(sorted(key) or None))
+                    self._entries[key] = entry
+
+            self._start_refresher()
+
+        if self._needs_refresh(entry.credentials):
+            self._refresh(entry)
+
+        return entry.credentials
+
+    def client(self, client_class: Callable, scopes: Optional[Iterable[str]] = None, **kwargs):
+        """Get an API client that uses the credentials for the scopes.
+
+        The client is created once for each combination of client class,
+        scopes and keyword arguments, so it re-uses its HTTP connections.
+        For example `cache.client(storage.Client, project="my-project")`.
+        """
+        credentials = self.get(scopes)
+        key = (client_class, frozenset(scopes or ()), tuple(sorted(kwargs.items())))
+        client = self._clients.get(key)
+
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+
+                if client is None:
+                    client = client_class(credentials=credentials, **kwargs)
+                    self._clients[key] = client
+
+        return client
+
+    def refresh_due(self) -> None:
+        """Refresh tokens that expire within `refresh_ahead` seconds."""
+        for entry in list(self._entries.values()):
+            if self._needs_refresh(entry.credentials, self.refresh_ahead):
+                try:
+                    self._refresh(entry, self.refresh_ahead)
+                except Exception:
+                    # The request path refreshes the token if it expires.
+                    logger.exception("Failed to refresh credentials")
+
+    def stop(self) -> None:
+        """Stop the background thread."""
+        self._stop.set()
+
+    def _needs_refresh(self, credentials, ahead=datetime.timedelta(0)) -> bool:
+        if not credentials.token:
+            return True
+
+        if credentials.expiry is None:
+            return False
+
+        return credentials.expiry - ahead <= self.clock()
+
+    def _refresh(self, entry, ahead=datetime.timedelta(0)) -> None:
+        # Only one thread refreshes the token, the others wait for it.
+        with entry.lock:
+            if self._needs_refresh(entry.credentials, ahead):
+                entry.credentials.refresh(self.request_factory())
+
+    def _start_refresher(self) -> None:
+        if self._refresher is not None or self.poll_interval is None:
+            return
+
+        with self._lock:
+            if self._refresher is None:
+                self._refresher = threading.Thread(target=self._run_refresher, daemon=True)
+                self._refresher.start()
+
+    def _after_fork(self) -> None:
+        # Threads do not survive a fork, and locks held by them are never
+        # released. Clients are re-created because they hold connections.
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._refresher = None
+        self._clients = {}
+
+        for entry in self._entries.values():
+            entry.lock = threading.Lock()
+
+    def _run_refresher(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            self.refresh_due()
@@ -0,0 +1,255 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Resumable cron jobs that process a datastore query in time-boxed chunks.
+
+The cron scheduler starts a run of the job. Each request processes the query
+until its time budget is spent, saves the query cursor and re-enqueues itself
+as a task to continue from the cursor.
+"""
+import datetime
+import logging
+import secrets
+import time
+from typing import Callable, Optional
+
+import flask
+from google.cloud import ndb
+
+from . import datastore
+from . import environ
+from . import tasks
+
+
+logger = logging.getLogger(__name__)
+
+
+class CronLease(ndb.Model):
+    """Datastore model for the progress of a chunked cron job.
+
+    The entity ID is the job name. A run of the job holds the lease until it
+    finishes, so overlapping cron runs do not duplicate work.
+    """
+
+    lease_id = ndb.StringProperty()
+    lease_expires = ndb.DateTimeProperty(indexed=False)
+    cursor = ndb.TextProperty()
+    done = ndb.BooleanProperty(default=True, indexed=False)
+    processed = ndb.IntegerProperty(default=0, indexed=False)
+    chunks = ndb.IntegerProperty(default=0, indexed=False)
+    elapsed = ndb.FloatProperty(default=0.0, indexed=False)
+    started = ndb.DateTimeProperty(indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+    def is_leased(self, now: datetime.datetime) -> bool:
+        """True if a run of the job holds an unexpired lease."""
+        return bool(self.lease_id) and self.lease_expires > now
+
+    def stats(self) -> dict:
+        """Progress and throughput of the current run."""
+        rate = self.processed / self.elapsed if self.elapsed else 0.0
+
+        return {
+            "name": self.key.id(),
+            "processed": self.processed,
+            "chunks": self.chunks,
+            "elapsed": self.elapsed,
+            "rate": rate,
+            "done": self.done,
+        }
+
+
+class ChunkedJob:
+    """A cron job that processes the results of a query in chunks.
+
+    :param str name: Unique name for the job, used as the lease entity ID.
+    :param query: Callable that returns the `ndb.Query` to process. The query
+        must return results in a stable order for the cursor to be useful.
+    :param process: Callable that is passed each page of entities.
+    :param int batch_size: Number of entities in each page.
+    :param float time_budget: Seconds to spend on each request.
+    :param float lease_duration: Seconds a run holds the lease without
+        saving progress. Defaults to twice the time budget.
+    :param enqueue: Callable used to enqueue the continuation task.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        query: Callable[[], ndb.Query],
+        process: Callable[[list], None],
+        batch_size: int = 100,
+        time_budget: float = 300.0,
+        lease_duration: Optional[float] = None,
+        enqueue: Callable = tasks.enqueue,
+    ):
+        self.name = name
+        self.query = query
+        self.process = process
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.lease_duration = lease_duration or 2 * time_budget
+        self.enqueue = enqueue
+
+    def start(self) -> Optional[str]:
+        """Acquire the lease for a new run, or resume an abandoned run.
+
+        :return: The lease ID, or None if another run holds the lease.
+        """
+
+        @ndb.transactional()
+        def _txn():
+            now = datetime.datetime.utcnow()
+            lease = CronLease.get_by_id(self.name) or CronLease(id=self.name)
+
+            if lease.is_leased(now):
+                return None
+
+            if lease.done:
+                # Start from the beginning of the query.
+                lease.cursor = None
+                lease.processed = 0
+                lease.chunks = 0
+                lease.elapsed = 0.0
+                lease.started = now
+            else:
+                # The previous run stopped before it finished, resume it.
+                logger.warning("Cron job %s: resuming from the last cursor", self.name)
+
+            lease.lease_id = secrets.token_urlsafe(16)
+            lease.lease_expires = now + datetime.timedelta(seconds=self.lease_duration)
+            lease.done = False
+            lease.put()
+
+            return lease.lease_id
+
+        return _txn()
+
+    def run_chunk(self, lease_id: str) -> Optional[CronLease]:
+        """Process pages of the query until the time budget is spent.
+
+        :return: The updated lease, or None if the lease is not held.
+        """
+        lease = CronLease.get_by_id(self.name)
+
+        if lease is None or lease.lease_id != lease_id or lease.done:
+            return None
+
+        query = self.query()
+        cursor = ndb.Cursor(urlsafe=lease.cursor) if lease.cursor else None
+        deadline = time.monotonic() + self.time_budget
+
+        while time.monotonic() < deadline:
+            start = time.monotonic()
+            results, cursor, more = query.fetch_page(self.batch_size, start_cursor=cursor)
+
+            if results:
+                self.process(results)
+
+            elapsed = time.monotonic() - start
+            lease = self._checkpoint(lease_id, cursor, len(results), elapsed, more)
+
+            if lease is None or lease.done:
+                break
+
+        return lease
+
+    def _checkpoint(self, lease_id, cursor, count, elapsed, more) -> Optional[CronLease]:
+        # Save progress, and extend the lease if this run still holds it.
+        @ndb.transactional()
+        def _txn():
+            lease = CronLease.get_by_id(self.name)
+
+            if lease is None or lease.lease_id != lease_id:
+                return None
+
+            now = datetime.datetime.utcnow()
+            lease.cursor = cursor.urlsafe().decode("ascii") if (more and cursor) else None
+            lease.processed += count
+            lease.chunks += 1
+            lease.elapsed += elapsed
+            lease.lease_expires = now + datetime.timedelta(seconds=self.lease_duration)
+
+            if not more:
+                lease.done = True
+                lease.lease_id = None
+
+            lease.put()
+
+            return lease
+
+        result = _txn()
+
+        if result is None:
+            logger.warning("Cron job %s: lost the lease, stopping", self.name)
+
+        return result
+
+    def run(self, lease_id: Optional[str] = None) -> Optional[dict]:
+        """Run a chunk of the job, and enqueue a task to continue it.
+
+        Call this from a request handler. With no lease ID a new run is
+        started. Tasks enqueued to continue the job include the lease ID.
+
+        :return: Progress of the run, or None if the job is already running.
+        """
+        with datastore.context():
+            lease_id = lease_id or self.start()
+
+            if lease_id is None:
+                logger.info("Cron job %s: already running", self.name)
+                return None
+
+            lease = self.run_chunk(lease_id)
+
+        if lease is None:
+            return None
+
+        stats = lease.stats()
+        logger.info(
+            "Cron job %s: processed %d entities in %d chunks (%.1f/s)%s",
+            self.name,
+            stats["processed"],
+            stats["chunks"],
+            stats["rate"],
+            ", done" if lease.done else "",
+        )
+
+        if not lease.done:
+            self.enqueue(flask.request.path, {"lease": lease_id})
+
+        return stats
+
+    def register(self, app: flask.Flask, rule: str) -> None:
+        """Add a request handler for the job to a `create_app` application.
+
+        The handler accepts GET requests from the cron scheduler and POST
+        requests from the tasks that continue the job. It is protected with
+        `securescaffold.tasks_only`, and allows HTTP (not HTTPS) requests.
+        """
+        endpoint = f"securescaffold_cron_{self.name}"
+
+        @environ.tasks_only
+        def view():
+            stats = self.run(flask.request.form.get("lease"))
+
+            return flask.jsonify(stats)
+
+        # Flask-SeaSurf identifies exempt views by module and name.
+        view.__name__ = endpoint
+
+        app.talisman(force_https=False)(view)
+        app.csrf.exempt(view)
+        app.add_url_rule(rule, endpoint, view, methods=["GET", "POST"])
@@ -0,0 +1,215 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Hash-based Content Security Policy for the app's templates.
+
+A policy that uses nonces makes every response different, so pages can't be
+cached and a new header is made for every request. Instead, `hash_templates`
+scans the app's Jinja templates for inline scripts and styles, and adds
+their SHA-256 hashes to the policy. Scripts and stylesheets loaded from a
+URL add the URL's origin, or "'self'" for the app's own URLs. The policy is
+the same for every response.
+
+`create_app` calls this when the "CSP_POLICY_HASH_TEMPLATES" setting is True.
+"""
+import base64
+import collections
+import hashlib
+import logging
+import re
+import urllib.parse
+from typing import Dict, List, Optional, Union
+
+import flask
+
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_EXTENSIONS = ("htm", "html", "j2", "jinja", "jinja2", "xhtml")
+# Script types that are run, and so are subject to the policy. Other types,
+# like "application/ld+json", are data blocks.
+SCRIPT_TYPES = ("", "application/javascript", "module", "text/javascript")
+
+ELEMENT_PATTERN = re.compile(r"<(script|style)\b([^>]*)>(.*?)</\1\s*>", re.IGNORECASE | re.DOTALL)
+LINK_PATTERN = re.compile(r"<link\b([^>]*)>", re.IGNORECASE)
+ATTR_PATTERN = re.compile(r"""\b([a-z-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+# Jinja syntax that changes the rendered text.
+JINJA_PATTERN = re.compile(r"{{|{%|{#")
+URL_FOR_PATTERN = re.compile(r"^{{\s*url_for\((?![^)]*_external)[^}]*}}$")
+
+Policy = Union[str, Dict[str, Union[str, List[str]]]]
+
+
+def hash_source(text: str) -> str:
+    """CSP hash source for the text of an inline script or style."""
+    # Jinja renders line endings as "\n".
+    data = text.replace("\r\n", "\n").encode("utf-8")
+    digest = base64.b64encode(hashlib.sha256(data).digest()).decode("ascii")
+
+    return f"'sha256-{digest}'"
+
+
+def scan_template(source: str, name: str = "<template>") -> Dict[str, set]:
+    """Find the sources used by a template's scripts and styles.
+
+    :return: A dict of directive name ("script-src" or "style-src") to a set
+        of CSP sources.
+    """
+    result = collections.defaultdict(set)
+
+    for match in ELEMENT_PATTERN.finditer(source):
+        element = match.group(1).lower()
+        attrs = parse_attrs(match.group(2))
+        text = match.group(3)
+        directive = f"{element}-src"
+
+        if element == "script" and attrs.get("type", "").lower() not in SCRIPT_TYPES:
+            continue
+
+        if element == "script" and "src" in attrs:
+            add_url_source(result[directive], attrs["src"], name)
+
+            # An external script with an integrity hash can be allowed by its
+            # hash (CSP level 3).
+            for value in attrs.get("integrity", "").split():
+                if value.startswith(("sha256-", "sha384-", "sha512-")):
+                    result[directive].add(f"'{value}'")
+
+        elif JINJA_PATTERN.search(text):
+            logger.warning("Inline <%s> in %s is not static and can't be hashed, use a nonce", element, name)
+        elif text.strip():
+            result[directive].add(hash_source(text))
+
+    for match in LINK_PATTERN.finditer(source):
+        attrs = parse_attrs(match.group(1))
+
+        if "stylesheet" in attrs.get("rel", "").lower().split() and "href" in attrs:
+            add_url_source(result["style-src"], attrs["href"], name)
+
+    return dict(result)
+
+
+def parse_attrs(text: str) -> Dict[str, str]:
+    attrs = {}
+
+    for match in ATTR_PATTERN.finditer(text):
+        value = next(group for group in match.groups()[1:] if group is not None)
+        attrs[match.group(1).lower()] = value
+
+    return attrs
+
+
+def add_url_source(sources: set, url: str, name: str) -> None:
+    url = url.strip()
+
+    if URL_FOR_PATTERN.match(url):
+        # `url_for()` makes a URL on this app.
+        sources.add("'self'")
+        return
+
+    if JINJA_PATTERN.search(url):
+        logger.warning("URL %r in %s is not static, add its origin to the policy", url, name)
+        return
+
+    parts = urllib.parse.urlsplit(url)
+
+    if parts.netloc:
+        scheme = parts.scheme or "https"
+        sources.add(f"{scheme}://{parts.netloc}")
+    elif parts.scheme in ("", "http", "https"):
+        sources.add("'self'")
+
+
+def scan_templates(app: flask.Flask) -> Dict[str, List[str]]:
+    """Find the sources used by the app's templates.
+
+    The templates are found with the app's Jinja loader, so blueprint
+    templates are included.
+
+    :return: A dict of directive name to a sorted list of CSP sources.
+    """
+    env = app.jinja_env
+    result = collections.defaultdict(set)
+
+    if env.loader is None:
+        return {}
+
+    for name in env.list_templates(extensions=TEMPLATE_EXTENSIONS):
+        source, _, _ = env.loader.get_source(env, name)
+
+        for directive, sources in scan_template(source, name).items():
+            result[directive].update(sources)
+
+    return {directive: sorted(sources) for directive, sources in sorted(result.items())}
+
+
+def add_sources(policy: Policy, sources: Optional[Dict[str, List[str]]]) -> Policy:
+    """Add sources to a policy, returning a new policy.
+
+    A directive missing from the policy starts with the "default-src"
+    sources, which is what the browser would have used for it.
+    """
+    if not sources:
+        return policy
+
+    policy = parse_policy(policy)
+
+    for directive, values in sources.items():
+        current = policy.get(directive, policy.get("default-src", ""))
+        current = current.split() if isinstance(current, str) else list(current)
+        # 'none' can't be combined with other sources.
+        current = [value for value in current if value != "'none'"]
+        current.extend(value for value in values if value not in current)
+        policy[directive] = " ".join(current)
+
+    return policy
+
+
+def parse_policy(policy: Policy) -> dict:
+    """Convert a policy to a dict of directive name to sources."""
+    if isinstance(policy, str):
+        result = {}
+
+        for directive in policy.split(";"):
+            name, _, value = directive.strip().partition(" ")
+
+            if name:
+                result[name] = value.strip()
+
+        return result
+
+    return dict(policy or {})
+
+
+def hash_templates(app: flask.Flask) -> Dict[str, List[str]]:
+    """Scan the app's templates, and add their sources to the policy.
+
+    The sources are saved in the "CSP_POLICY_SOURCES" setting, which
+    `securescaffold.factory.get_talisman_config` adds to "CSP_POLICY".
+    `create_app` calls this, and `prepare_app` calls it again to include
+    templates from blueprints registered after the app was created.
+    """
+    sources = scan_templates(app)
+    app.config["CSP_POLICY_SOURCES"] = sources
+
+    live_config = getattr(app, "live_config", None)
+    talisman = getattr(app, "talisman", None)
+
+    if live_config is not None:
+        live_config.update_base({"CSP_POLICY_SOURCES": sources})
+    elif talisman is not None:
+        talisman.content_security_policy = add_sources(app.config["CSP_POLICY"], sources)
+
+    return sources
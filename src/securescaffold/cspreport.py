@@ -0,0 +1,337 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Receive Content Security Policy violation reports.
+
+When the "CSP_REPORT_URL" setting is a path (for example "/_csp-report"),
+`create_app` adds a view at that path, exempt from CSRF protection, and uses
+it as "CSP_POLICY_REPORT_URI". Browsers can send a lot of reports (a bad
+deploy can break every page for every visitor), so the reports are counted
+in memory by (directive, blocked URI, document URI), and the counts are
+written in one batch at most "CSP_REPORT_FLUSH_INTERVAL" seconds after they
+were counted.
+
+Above "CSP_REPORT_MAX_RATE" reports a second, reports are sampled and the
+counts are scaled up, so each report costs little more than a random number.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+import flask
+from google.cloud import ndb
+
+from . import datastore
+from . import forksafe
+
+
+logger = logging.getLogger(__name__)
+
+# Larger requests are not parsed.
+MAX_REPORT_BYTES = 16 * 1024
+MAX_URI_LENGTH = 500
+
+ReportKey = Tuple[str, str, str]
+
+# Instances whose counts are written when the process exits.
+_instances = weakref.WeakSet()
+
+
+class CSPViolation(ndb.Model):
+    """Count of CSP violation reports, when "CSP_REPORT_STORE" is "datastore"."""
+
+    directive = ndb.StringProperty()
+    blocked_uri = ndb.StringProperty()
+    document_uri = ndb.StringProperty()
+    count = ndb.IntegerProperty(default=0)
+    first_seen = ndb.DateTimeProperty(auto_now_add=True)
+    last_seen = ndb.DateTimeProperty(auto_now=True)
+
+    @classmethod
+    def key_for(cls, key: ReportKey) -> ndb.Key:
+        digest = hashlib.sha256("\n".join(key).encode("utf-8")).hexdigest()
+
+        return ndb.Key(cls, digest)
+
+
+def parse_reports(data: bytes) -> Iterable[ReportKey]:
+    """Get (directive, blocked URI, document URI) for each report.
+
+    Reads both the "application/csp-report" format (`report-uri`) and the
+    Reporting API "application/reports+json" format (`report-to`). Anything
+    else is ignored.
+    """
+    try:
+        payload = json.loads(data)
+    except ValueError:
+        return []
+
+    if isinstance(payload, dict):
+        items = [payload.get("csp-report")]
+        names = ("effective-directive", "violated-directive", "blocked-uri", "document-uri")
+    elif isinstance(payload, list):
+        items = [
+            item.get("body") for item in payload if isinstance(item, dict) and item.get("type") == "csp-violation"
+        ]
+        names = ("effectiveDirective", "effectiveDirective", "blockedURL", "documentURL")
+    else:
+        return []
+
+    result = []
+
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+
+        directive = item.get(names[0]) or item.get(names[1]) or ""
+        # Older browsers send the whole directive ("script-src 'self'").
+        directive = str(directive).split(" ", 1)[0]
+        blocked_uri = str(item.get(names[2]) or "")[:MAX_URI_LENGTH]
+        document_uri = str(item.get(names[3]) or "").split("?", 1)[0][:MAX_URI_LENGTH]
+        result.append((directive, blocked_uri, document_uri))
+
+    return result
+
+
+class CSPReports:
+    """Bounded, sampled aggregation of CSP violation reports.
+
+    `create_app` adds an instance to the app as `app.csp_reports` when the
+    "CSP_REPORT_URL" setting is not None.
+
+    :param int max_keys: Maximum distinct reports counted between flushes.
+        Other reports are counted as dropped.
+    :param float max_rate: Reports a second before sampling starts.
+    :param float flush_interval: Seconds between writes of the counts.
+    :param str store: "log" or "datastore".
+    """
+
+    def __init__(
+        self,
+        app: Optional[flask.Flask] = None,
+        max_keys: int = 1000,
+        max_rate: float = 100,
+        flush_interval: float = 60,
+        store: str = "log",
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_keys = max_keys
+        self.max_rate = max_rate
+        self.flush_interval = flush_interval
+        self.store = store
+        self.clock = clock
+        self.counts: Dict[ReportKey, float] = {}
+        self.dropped = 0.0
+        self._lock = threading.Lock()
+        self._window = 0
+        self._window_count = 0
+        self._next_flush = clock() + flush_interval
+        self._flushing = False
+        self._timer = None
+        forksafe.register(self._after_fork)
+        _instances.add(self)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask) -> None:
+        config = app.config
+        self.max_keys = config.get("CSP_REPORT_MAX_KEYS", self.max_keys)
+        self.max_rate = config.get("CSP_REPORT_MAX_RATE", self.max_rate)
+        self.flush_interval = config.get("CSP_REPORT_FLUSH_INTERVAL", self.flush_interval)
+        self.store = config.get("CSP_REPORT_STORE", self.store)
+
+        if self.store not in ("log", "datastore"):
+            raise ValueError(f"Unknown CSP_REPORT_STORE: {self.store!r}")
+
+        app.add_url_rule(config["CSP_REPORT_URL"], "securescaffold_csp_report", self.receive, methods=["POST"])
+        csrf = getattr(app, "csrf", None)
+
+        if csrf is not None:
+            csrf.exempt(self.receive)
+
+        app.csp_reports = self
+
+    def receive(self) -> flask.Response:
+        """View function for the report URL."""
+        request = flask.request
+
+        if (request.content_length or 0) > MAX_REPORT_BYTES:
+            return flask.Response(status=413)
+
+        weight = self.sample()
+
+        if weight:
+            # Without a Content-Length (a chunked body) only read enough to
+            # tell the report is too large.
+            data = request.stream.read(MAX_REPORT_BYTES + 1)
+
+            if len(data) > MAX_REPORT_BYTES:
+                return flask.Response(status=413)
+
+            self.add(parse_reports(data), weight)
+
+        return flask.Response(status=204)
+
+    def sample(self) -> float:
+        """Decide whether to count a report.
+
+        :return: 0 to ignore the report, otherwise the number of reports it
+            stands for.
+        """
+        window = int(self.clock())
+
+        # Not locked, an approximate count is good enough here.
+        if window != self._window:
+            self._window = window
+            self._window_count = 0
+
+        self._window_count += 1
+
+        if self._window_count <= self.max_rate:
+            return 1.0
+
+        probability = self.max_rate / self._window_count
+
+        return 1.0 / probability if random.random() < probability else 0.0
+
+    def add(self, keys: Iterable[ReportKey], weight: float = 1.0) -> None:
+        """Count reports, and start a flush if it is time.
+
+        Otherwise a timer flushes the counts when it is time, so they are
+        written even if no more reports arrive.
+        """
+        flush = False
+
+        with self._lock:
+            for key in keys:
+                if key in self.counts:
+                    self.counts[key] += weight
+                elif len(self.counts) < self.max_keys:
+                    self.counts[key] = weight
+                else:
+                    self.dropped += weight
+
+            delay = self._next_flush - self.clock()
+
+            if not self._flushing:
+                if delay <= 0:
+                    self._start_flush()
+                    flush = True
+                elif self._timer is None:
+                    self._timer = threading.Timer(delay, self._flush_on_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+
+        if flush:
+            threading.Thread(target=self._flush_in_background, daemon=True).start()
+
+    def _start_flush(self) -> None:
+        # Called with the lock held.
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        self._flushing = True
+        self._next_flush = self.clock() + self.flush_interval
+
+    def _flush_on_timer(self) -> None:
+        with self._lock:
+            self._timer = None
+
+            if self._flushing:
+                return
+
+            self._start_flush()
+
+        self._flush_in_background()
+
+    def _flush_in_background(self) -> None:
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Failed to write CSP violation reports")
+        finally:
+            self._flushing = False
+
+    def flush(self) -> None:
+        """Write the counts, and start counting again."""
+        with self._lock:
+            counts, self.counts = self.counts, {}
+            dropped, self.dropped = self.dropped, 0.0
+
+        counts = {key: round(count) for key, count in counts.items()}
+
+        if not counts and not dropped:
+            return
+
+        if self.store == "datastore":
+            self._write_datastore(counts)
+        else:
+            self._write_log(counts)
+
+        if dropped:
+            logger.warning("Dropped %d CSP violation reports, over %d distinct reports", dropped, self.max_keys)
+
+    def _write_log(self, counts: Dict[ReportKey, int]) -> None:
+        reports = [
+            {"directive": key[0], "blocked_uri": key[1], "document_uri": key[2], "count": count}
+            for key, count in sorted(counts.items(), key=lambda item: -item[1])
+        ]
+        # One log entry for the batch.
+        logger.warning("CSP violation reports: %s", json.dumps(reports))
+
+    def _write_datastore(self, counts: Dict[ReportKey, int]) -> None:
+        keys = list(counts)
+
+        # Counts from different instances can race, the totals are
+        # approximate.
+        with datastore.context():
+            entities = ndb.get_multi([CSPViolation.key_for(key) for key in keys])
+            updated = []
+
+            for key, entity in zip(keys, entities):
+                if entity is None:
+                    entity = CSPViolation(
+                        key=CSPViolation.key_for(key), directive=key[0], blocked_uri=key[1], document_uri=key[2]
+                    )
+
+                entity.count = (entity.count or 0) + counts[key]
+                updated.append(entity)
+
+            ndb.put_multi(updated)
+
+    def _after_fork(self) -> None:
+        # Reports counted in the parent are written by the parent.
+        self._lock = threading.Lock()
+        self.counts = {}
+        self.dropped = 0.0
+        self._flushing = False
+        self._timer = None
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    for reports in list(_instances):
+        try:
+            reports.flush()
+        except Exception:
+            logger.exception("Failed to write CSP violation reports")
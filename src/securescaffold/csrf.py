@@ -0,0 +1,80 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import flask
+import flask_seasurf
+from werkzeug.exceptions import Forbidden
+
+
+CSRF_MODE_FORM = "form"
+CSRF_MODE_HEADER = "header"
+
+
+class SeaSurf(flask_seasurf.SeaSurf):
+    """Flask-SeaSurf, with an option to only read the token from a header.
+
+    Flask-SeaSurf looks for the CSRF token in the request's form data, then
+    JSON data, then the "X-CSRFToken" header. Reading the form data parses
+    (and spools) the entire request body, even if the request is rejected.
+
+    Set "CSRF_MODE" to "header" and the token is only read from the header
+    (named by the "CSRF_HEADER_NAME" setting). Requests are validated without
+    touching the body, and views can read uploads from `request.stream`.
+    """
+
+    def init_app(self, app):
+        super().init_app(app)
+        self._csrf_mode = app.config.get("CSRF_MODE", CSRF_MODE_FORM)
+
+        if self._csrf_mode not in (CSRF_MODE_FORM, CSRF_MODE_HEADER):
+            raise ValueError(f"Unknown CSRF_MODE: {self._csrf_mode!r}")
+
+        return self
+
+    def validate(self):
+        if self._csrf_mode != CSRF_MODE_HEADER:
+            return super().validate()
+
+        if not flask.has_request_context():
+            raise Forbidden(description=flask_seasurf.REASON_NO_REQUEST)
+
+        # Tell _after_request to still set the CSRF token cookie.
+        flask.g.csrf_validation_checked = True
+
+        server_csrf_token = flask.session.get(self._csrf_name, None)
+        request_csrf_token = flask.request.headers.get(self._csrf_header_name, "")
+
+        if not self._safe_str_cmp(request_csrf_token, server_csrf_token):
+            self._forbid(flask_seasurf.REASON_BAD_TOKEN)
+
+        if flask.request.is_secure and self._check_referer:
+            self._validate_referer()
+
+    def _validate_referer(self):
+        # The same strict referer checking as Flask-SeaSurf for HTTPS.
+        request = flask.request
+        referer = request.headers.get("Referer")
+
+        if referer is None:
+            self._forbid(flask_seasurf.REASON_NO_REFERER)
+
+        allowed_referer = request.headers.get("Origin") or request.url_root
+
+        if not flask_seasurf._same_origin(referer, allowed_referer):
+            self._forbid(flask_seasurf.REASON_BAD_REFERER.format(referer, allowed_referer))
+
+    def _forbid(self, reason):
+        flask.current_app.logger.warning(f"Forbidden ({reason}): {flask.request.path}")
+
+        raise Forbidden(description=reason)
@@ -0,0 +1,243 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import contextlib
+from typing import Callable, Iterable, List, Optional
+
+import flask
+from google.cloud import ndb
+from google.cloud.ndb import context as ndb_context
+
+from . import forksafe
+
+
+# The most entities the datastore accepts in one commit.
+MAX_BATCH_SIZE = 500
+
+_client = None
+
+
+def get_client() -> ndb.Client:
+    """Get the NDB client shared by the scaffold's helpers.
+
+    Creating a client opens a new gRPC channel, so the client is created once
+    and re-used.
+    """
+    global _client
+
+    if _client is None:
+        _client = ndb.Client()
+
+    return _client
+
+
+def _reset_client() -> None:
+    # gRPC channels are not fork-safe, the child process creates a new client.
+    global _client
+
+    _client = None
+
+
+forksafe.register(_reset_client)
+
+
+@contextlib.contextmanager
+def context(client: Optional[ndb.Client] = None):
+    """Use the current NDB context, or create a new one.
+
+    NDB refuses to create a context when one already exists for the thread.
+    This lets the scaffold's helpers work in views that already have an NDB
+    context, as well as in views that do not.
+    """
+    current = ndb_context.get_context(False)
+
+    if current is not None:
+        yield current
+        return
+
+    client = client or get_client()
+
+    with client.context() as new_context:
+        yield new_context
+
+
+def init_request_context(app: flask.Flask) -> None:
+    """Run each request in an NDB context.
+
+    NDB contexts belong to a thread, so with threaded workers each request
+    thread needs its own context. `create_app` calls this when the
+    "NDB_REQUEST_CONTEXT" setting is True.
+    """
+
+    @app.before_request
+    def _enter_ndb_context():
+        stack = contextlib.ExitStack()
+        stack.enter_context(context())
+        flask.g._securescaffold_ndb_context = stack
+
+    @app.teardown_request
+    def _exit_ndb_context(exc=None):
+        stack = flask.g.pop("_securescaffold_ndb_context", None)
+
+        if stack is not None:
+            stack.close()
+
+
+class LoadResult:
+    """An entity that will be read with other keys, when it is needed."""
+
+    __slots__ = ("loader", "key")
+
+    def __init__(self, loader: "Loader", key: ndb.Key):
+        self.loader = loader
+        self.key = key
+
+    def result(self) -> Optional[ndb.Model]:
+        """Read the entity, and all the other keys waiting to be read."""
+        cache = self.loader.cache
+
+        if self.key not in cache:
+            # The key may have been cleared from the cache since it was read.
+            self.loader._pending[self.key] = None
+            self.loader.dispatch()
+
+        return cache[self.key]
+
+
+class Loader:
+    """Batches and caches datastore reads for one request.
+
+    `load(key)` does not read the entity. The keys are collected, and the
+    first time one of the results is needed they are all read with one
+    `get_multi`. Each key is read at most once per request.
+
+        loader = datastore.get_loader()
+        author = loader.load(post.author)
+        comments = [loader.load(key) for key in post.comment_keys]
+        # One round trip for the author and all the comments.
+        author.result()
+
+    Use `get_loader()` to get the loader for the current request.
+    """
+
+    def __init__(self):
+        self.cache = {}
+        self._pending = {}
+
+    def load(self, key: ndb.Key) -> LoadResult:
+        if key not in self.cache:
+            # A dict keeps the keys in order, without duplicates.
+            self._pending[key] = None
+
+        return LoadResult(self, key)
+
+    def get(self, key: ndb.Key) -> Optional[ndb.Model]:
+        return self.load(key).result()
+
+    def get_multi(self, keys: Iterable[ndb.Key]) -> List[Optional[ndb.Model]]:
+        results = [self.load(key) for key in keys]
+        self.dispatch()
+
+        return [result.result() for result in results]
+
+    def prime(self, key: ndb.Key, entity: Optional[ndb.Model]) -> None:
+        """Set the cached entity for a key, after writing or deleting it."""
+        self._pending.pop(key, None)
+        self.cache[key] = entity
+
+    def clear(self, key: Optional[ndb.Key] = None) -> None:
+        """Forget a cached entity, or all of them."""
+        if key is None:
+            self.cache.clear()
+        else:
+            self.cache.pop(key, None)
+
+    def dispatch(self) -> None:
+        """Read all the keys waiting to be read."""
+        keys = list(self._pending)
+        self._pending.clear()
+
+        if not keys:
+            return
+
+        with context():
+            entities = ndb.get_multi(keys)
+
+        self.cache.update(zip(keys, entities))
+
+
+def get_loader() -> Loader:
+    """Get the `Loader` for the current request."""
+    loader = flask.g.get("_securescaffold_loader")
+
+    if loader is None:
+        loader = flask.g._securescaffold_loader = Loader()
+
+    return loader
+
+
+def put_multi(entities: Iterable[ndb.Model], chunk_size: int = MAX_BATCH_SIZE, max_parallel: int = 4) -> List[ndb.Key]:
+    """Write any number of entities, in chunks written in parallel.
+
+    :param int chunk_size: Entities in each write, at most 500.
+    :param int max_parallel: Chunks written at the same time.
+    :return: The keys of the entities.
+    """
+    entities = list(entities)
+    keys = _in_chunks(ndb.put_multi_async, entities, chunk_size, max_parallel)
+    loader = _request_loader()
+
+    if loader is not None:
+        for key, entity in zip(keys, entities):
+            loader.prime(key, entity)
+
+    return keys
+
+
+def delete_multi(keys: Iterable[ndb.Key], chunk_size: int = MAX_BATCH_SIZE, max_parallel: int = 4) -> None:
+    """Delete any number of entities, in chunks deleted in parallel."""
+    keys = list(keys)
+    _in_chunks(ndb.delete_multi_async, keys, chunk_size, max_parallel)
+    loader = _request_loader()
+
+    if loader is not None:
+        for key in keys:
+            loader.prime(key, None)
+
+
+def _in_chunks(func: Callable, items: list, chunk_size: int, max_parallel: int) -> list:
+    chunk_size = min(chunk_size, MAX_BATCH_SIZE)
+    results = []
+    in_flight = collections.deque()
+
+    with context():
+        for start in range(0, len(items), chunk_size):
+            # Wait for the oldest chunk before starting another.
+            if len(in_flight) >= max_parallel:
+                results.extend(future.result() for future in in_flight.popleft())
+
+            in_flight.append(func(items[start:start + chunk_size]))
+
+        while in_flight:
+            results.extend(future.result() for future in in_flight.popleft())
+
+    return results
+
+
+def _request_loader() -> Optional[Loader]:
+    if flask.has_app_context():
+        return flask.g.get("_securescaffold_loader")
+
+    return None
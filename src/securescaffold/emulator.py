@@ -12,11 +12,41 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
+import collections
+import contextlib
+import hashlib
+import json
 import os
 import re
+import shutil
+import signal
+import socket
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 import urllib.parse
 import urllib.request
+from typing import Callable, List, Optional, Union
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# Written in a snapshot directory, to tell if the fixture script changed.
+SNAPSHOT_INFO = "securescaffold-snapshot.json"
+
+
+def free_port(host: str = "localhost") -> int:
+    """Find a port that is free to listen on."""
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+
+        return sock.getsockname()[1]
 
 
 class DatastoreEmulator:
@@ -24,11 +54,19 @@ class DatastoreEmulator:
 
     Requires the gcloud command be on the $PATH. Your project must NOT use
     this code when running on production App Engine.
+
+    `start()` waits until the emulator answers HTTP requests, for up to
+    `timeout` seconds. Use `start(wait=False)` then `wait_until_ready()` to
+    start the emulator in the background. The emulator's output is read by a
+    background thread, and the last lines are kept in `output` to help
+    diagnose failures.
     """
 
     default_project = "test"
     # Work around a bug where NDB cannot connect to "::1".
     default_host_port = "localhost"
+    default_timeout = 60.0
+    output_lines = 200
     startup_pattern = re.compile(r"\[datastore\] API endpoint: (.*)")
 
     def __init__(
@@ -40,6 +78,7 @@ class DatastoreEmulator:
         project=None,
         quiet=True,
         environ=os.environ,
+        timeout=None,
     ):
         self.consistency = consistency
         self.data_dir = data_dir
@@ -48,11 +87,21 @@ class DatastoreEmulator:
         self.project = project or self.default_project
         self.quiet = quiet
         self.environ = environ
+        self.timeout = self.default_timeout if timeout is None else timeout
+        self.output = collections.deque(maxlen=self.output_lines)
         self._proc = None
         self._env = {}
+        self._started = threading.Event()
+        self._reader = None
+        self._temp_dir = None
+
+    @property
+    def env(self) -> dict:
+        """Environment variables for connecting to the emulator."""
+        return dict(self._env)
 
-    def start(self):
-        """Start an emulator instance."""
+    def args(self) -> List[str]:
+        """The gcloud command to start the emulator."""
         args = [
             "gcloud",
             "beta",
@@ -84,17 +133,139 @@ class DatastoreEmulator:
                     flag = "--" + flag_name
                     args.extend([flag, str(value)])
 
-        self._proc = subprocess.Popen(args, stderr=subprocess.PIPE, text=True)
-        self._env = self._parse_startup(self._proc.stderr, self.project)
+        return args
+
+    def start(self, wait=True):
+        """Start an emulator instance.
+
+        :param bool wait: Wait until the emulator is ready. If False, call
+            `wait_until_ready()` before using the emulator.
+        """
+        self._env = {}
+        self._started.clear()
+        self.output.clear()
+        # The emulator's output goes to one pipe, which is always read, so a
+        # chatty emulator can't fill the pipe and block.
+        self._proc = subprocess.Popen(
+            self.args(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            # gcloud starts the emulator as a child process. A new session
+            # means stop() can signal both of them.
+            start_new_session=hasattr(os, "setsid"),
+        )
+        self._reader = threading.Thread(target=self._read_output, args=(self._proc.stdout,), daemon=True)
+        self._reader.start()
+
+        if wait:
+            self.wait_until_ready()
+
+    def wait_until_ready(self, timeout=None):
+        """Wait until the emulator answers HTTP requests.
+
+        :raises RuntimeError: If the emulator exits or is not ready before
+            the timeout. The emulator is stopped.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        try:
+            if not self._started.wait(timeout):
+                raise RuntimeError(f"Timed out after {timeout}s starting the datastore emulator")
+
+            if not self._env:
+                raise RuntimeError("Failed to start the datastore emulator")
+
+            while not self._is_ready(max(0.1, deadline - time.monotonic())):
+                if self._proc.poll() is not None:
+                    raise RuntimeError("The datastore emulator exited")
+
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"Timed out after {timeout}s waiting for the datastore emulator")
+
+                time.sleep(0.05)
+        except RuntimeError as err:
+            self.stop()
+            output = "".join(self.output)
+            raise RuntimeError(f"{err}. Output:\n{output}") from None
 
         if self.environ is not None:
             self.env_init(self.environ)
 
-    def stop(self):
-        """Stop the running emulator instance."""
-        shutdown_url = self._env["DATASTORE_HOST"] + "/shutdown"
-        req = urllib.request.Request(shutdown_url, method="POST")
-        urllib.request.urlopen(req)
+    def stop(self, timeout=10.0):
+        """Stop the running emulator instance, and wait for it to exit.
+
+        Asks the emulator to shut down, then terminates and finally kills
+        the process if it does not exit within the timeout.
+        """
+        if self._proc is None:
+            return
+
+        # SIGKILL does not exist on Windows.
+        escalation = [signal.SIGTERM, getattr(signal, "SIGKILL", signal.SIGTERM)]
+
+        if self._env and self._proc.poll() is None:
+            shutdown_url = self._env["DATASTORE_HOST"] + "/shutdown"
+            req = urllib.request.Request(shutdown_url, method="POST")
+
+            try:
+                urllib.request.urlopen(req, timeout=timeout).close()
+                escalation.insert(0, None)
+            except OSError:
+                pass
+
+        for sig in escalation:
+            if sig is not None:
+                self._signal(sig)
+
+            try:
+                self._proc.wait(timeout)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+
+        self._reader.join(timeout)
+        self._proc.stdout.close()
+        self._proc = None
+        self._env = {}
+
+        if self._temp_dir is not None:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+            self._temp_dir = None
+
+    def _signal(self, sig) -> None:
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(self._proc.pid, sig)
+            else:
+                self._proc.send_signal(sig)
+        except ProcessLookupError:
+            pass
+
+    def _is_ready(self, timeout: float) -> bool:
+        try:
+            with urllib.request.urlopen(self._env["DATASTORE_HOST"] + "/", timeout=timeout) as response:
+                return response.status == 200
+        except OSError:
+            return False
+
+    def _read_output(self, fh) -> None:
+        # Reads until the emulator exits. Things that can happen at startup:
+        # - Success: "[datastore] API endpoint http://..."
+        # - Failure: "ERROR: (gcloud) ..."
+        for line in fh:
+            self.output.append(line)
+
+            if not self._started.is_set():
+                match = self.startup_pattern.match(line)
+
+                if match:
+                    self._env = self._startup_env(match.group(1), self.project)
+                    self._started.set()
+
+        # The emulator exited. Wake up anyone waiting for it to start.
+        self._started.set()
 
     def env_init(self, environ) -> None:
         """Add info about the emulator to the process environment."""
@@ -102,24 +273,24 @@ class DatastoreEmulator:
 
     @classmethod
     def _parse_startup(cls, fh, project: str):
-        # Reading startup has the side-effect of blocking until the emulator
-        # is ready for connections. Things that can happen:
-        # - Success: "[datastore] API endpoint http://..."
-        # - Failure: "ERROR: (gcloud) ..."
+        # Blocks until the emulator prints its API endpoint.
         for line in fh:
             match = cls.startup_pattern.match(line)
 
             if match:
-                url = match.group(1)
-                env = cls._parse_env_url(url)
-                env["DATASTORE_DATASET"] = project
-                env["DATASTORE_PROJECT_ID"] = project
-                env["GOOGLE_CLOUD_PROJECT"] = project
-
-                return env
+                return cls._startup_env(match.group(1), project)
         else:
             raise RuntimeError("Failed to start the datastore emulator")
 
+    @classmethod
+    def _startup_env(cls, url: str, project: str) -> dict:
+        env = cls._parse_env_url(url)
+        env["DATASTORE_DATASET"] = project
+        env["DATASTORE_PROJECT_ID"] = project
+        env["GOOGLE_CLOUD_PROJECT"] = project
+
+        return env
+
     @classmethod
     def _parse_env_url(cls, url: str) -> dict:
         # url will be like "http://localhost:8081".
@@ -145,10 +316,254 @@ class DatastoreEmulator:
 
 
 class DatastoreEmulatorForTests(DatastoreEmulator):
+    """Emulator with strong consistency, which does not write to disk.
+
+    :param str snapshot: A directory made by `build_snapshot()`. Each time
+        the emulator starts, it starts with a copy of the snapshot's data,
+        in a temporary directory. The snapshot is not changed.
+    """
+
     default_project = "in-memory-test"
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, snapshot=None, **kwargs):
+        if snapshot is not None:
+            if kwargs.get("data_dir") is not None:
+                raise ValueError("Use either snapshot or data_dir, not both")
+
+            # The emulator only loads data from disk when it stores to disk.
+            kwargs["store_on_disk"] = True
+
         kwargs.setdefault("consistency", "1.0")
         kwargs.setdefault("store_on_disk", False)
 
         super().__init__(*args, **kwargs)
+        self.snapshot = snapshot
+
+    def start(self, wait=True):
+        if self.snapshot is not None:
+            if self._temp_dir is None:
+                self._temp_dir = tempfile.mkdtemp(prefix="datastore-emulator-")
+                self.data_dir = self._temp_dir
+
+            try:
+                self._restore_snapshot()
+            except Exception:
+                shutil.rmtree(self._temp_dir, ignore_errors=True)
+                self._temp_dir = None
+                raise
+
+        super().start(wait)
+
+    def _restore_snapshot(self) -> None:
+        with snapshot_lock(self.snapshot, exclusive=False):
+            info = read_snapshot_info(self.snapshot)
+
+            # Entities belong to a project, another project's data would be
+            # invisible to the tests.
+            if info.get("project", self.project) != self.project:
+                project = info["project"]
+                raise RuntimeError(f"Snapshot {self.snapshot} is for project {project!r}, not {self.project!r}")
+
+            clone_snapshot(self.snapshot, self._temp_dir)
+
+
+@contextlib.contextmanager
+def snapshot_lock(path: str, exclusive: bool = True):
+    """Lock a snapshot, with a lock file next to its directory.
+
+    Builders take an exclusive lock, and emulators starting from the
+    snapshot take a shared lock, so they never see a half-replaced
+    snapshot. Without `fcntl` (on Windows) nothing is locked.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    lock_path = os.path.abspath(path).rstrip(os.sep) + ".lock"
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+
+    with open(lock_path, "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def read_snapshot_info(path: str) -> dict:
+    """The info written by `build_snapshot`, or {} if there is none."""
+    try:
+        with open(os.path.join(path, SNAPSHOT_INFO)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def clone_snapshot(snapshot: str, data_dir: str) -> None:
+    """Copy a snapshot's files into an emulator data directory.
+
+    On file systems that support it (Btrfs, XFS) the files are cloned
+    copy-on-write, which is fast however large the snapshot is. Otherwise
+    they are copied.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+
+    if sys.platform.startswith("linux") and shutil.which("cp"):
+        args = ["cp", "-a", "--reflink=auto", os.path.join(snapshot, "."), data_dir]
+
+        if subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+            return
+
+    for name in os.listdir(snapshot):
+        src = os.path.join(snapshot, name)
+        dst = os.path.join(data_dir, name)
+
+        if os.path.isdir(src):
+            shutil.rmtree(dst, ignore_errors=True)
+            shutil.copytree(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+
+def _fixture_hash(fixture: str) -> str:
+    with open(fixture, "rb") as fh:
+        return hashlib.sha256(fh.read()).hexdigest()
+
+
+def snapshot_is_current(path: str, fixture: str) -> bool:
+    """True if the snapshot was built from the current fixture script."""
+    return read_snapshot_info(path).get("fixture_hash") == _fixture_hash(fixture)
+
+
+def build_snapshot(
+    path: str,
+    fixture: Union[str, Callable[[DatastoreEmulator], None]],
+    rebuild: bool = False,
+    cls=DatastoreEmulatorForTests,
+    **kwargs,
+) -> bool:
+    """Load fixture data into a new emulator, and save its data directory.
+
+    Start `DatastoreEmulatorForTests(snapshot=path)` to start an emulator
+    with the data, instead of writing it in each test.
+
+    :param fixture: The path of a Python script, which is run with the
+        emulator's environment variables so it can use `ndb.Client()`, or a
+        function that is called with the running emulator.
+    :param bool rebuild: Build the snapshot even if the fixture script has
+        not changed since it was last built.
+    :param cls: The emulator class. Use the same project as the emulator
+        that starts from the snapshot.
+    :return: True if the snapshot was built, False if it was up to date.
+    """
+    is_script = not callable(fixture)
+
+    if is_script and not rebuild and snapshot_is_current(path, fixture):
+        return False
+
+    # Only one process builds the snapshot. The others wait, and then find
+    # it is up to date.
+    with snapshot_lock(path):
+        if is_script and not rebuild and snapshot_is_current(path, fixture):
+            return False
+
+        _build_snapshot(os.path.abspath(path), fixture, is_script, cls, kwargs)
+
+    return True
+
+
+def _build_snapshot(path: str, fixture, is_script: bool, cls, kwargs: dict) -> None:
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    # Build next to the snapshot, then swap it in, so a failed build does
+    # not leave a half-written snapshot.
+    data_dir = tempfile.mkdtemp(prefix=".snapshot-", dir=parent)
+    kwargs.update(data_dir=data_dir, store_on_disk=True, environ=None)
+    emulator = cls(**kwargs)
+
+    try:
+        with emulator:
+            if is_script:
+                env = dict(os.environ, **emulator.env)
+                subprocess.run([sys.executable, fixture], env=env, check=True)
+            else:
+                fixture(emulator)
+
+        info = {"fixture_hash": _fixture_hash(fixture) if is_script else None, "project": emulator.project}
+
+        with open(os.path.join(data_dir, SNAPSHOT_INFO), "w") as fh:
+            json.dump(info, fh)
+
+        # Move the old snapshot aside, and delete it after the new one is in
+        # place.
+        old_dir = None
+
+        if os.path.exists(path):
+            old_dir = data_dir + "-old"
+            os.rename(path, old_dir)
+
+        os.rename(data_dir, path)
+    except BaseException:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        raise
+
+    if old_dir is not None:
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def start_emulators(count: int, cls=DatastoreEmulatorForTests, **kwargs) -> list:
+    """Start several emulators in parallel, for example one for each worker.
+
+    Each emulator gets its own port and data directory, and does not change
+    the process environment. Use each emulator's `env` to connect to it, and
+    call `stop()` on each when finished.
+    """
+    kwargs.setdefault("environ", None)
+    emulators = []
+
+    try:
+        for _ in range(count):
+            emulator = cls(**kwargs)
+
+            if kwargs.get("host_port") is None:
+                emulator.host_port = f"{emulator.host_port}:{free_port()}"
+
+            if kwargs.get("data_dir") is None:
+                emulator._temp_dir = tempfile.mkdtemp(prefix="datastore-emulator-")
+                emulator.data_dir = emulator._temp_dir
+
+            emulators.append(emulator)
+            emulator.start(wait=False)
+
+        for emulator in emulators:
+            emulator.wait_until_ready()
+    except Exception:
+        for emulator in emulators:
+            emulator.stop()
+
+        raise
+
+    return emulators
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Build a snapshot from the command line.
+
+        python -m securescaffold.emulator snapshot fixtures.py .datastore-snapshot
+    """
+    parser = argparse.ArgumentParser(prog="python -m securescaffold.emulator")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    snapshot = subparsers.add_parser("snapshot", help="Build an emulator snapshot from a fixture script.")
+    snapshot.add_argument("fixture", help="Python script that writes the fixture data")
+    snapshot.add_argument("output", help="Snapshot directory")
+    snapshot.add_argument("--project", default=DatastoreEmulatorForTests.default_project)
+    snapshot.add_argument("--rebuild", action="store_true", help="Build even if the fixture has not changed")
+    args = parser.parse_args(argv)
+
+    built = build_snapshot(args.output, args.fixture, rebuild=args.rebuild, project=args.project)
+    print(f"Built {args.output}" if built else f"{args.output} is up to date")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,11 +15,20 @@
 import functools
 
 import flask
+from werkzeug.exceptions import Forbidden
 
 
 X_APPENGINE_QUEUENAME = "X-Appengine-Queuename"
 X_APPENGINE_USER_IS_ADMIN = "X-Appengine-User-Is-Admin"
 
+# The same headers in a WSGI environ.
+ENVIRON_QUEUENAME = "HTTP_X_APPENGINE_QUEUENAME"
+ENVIRON_USER_IS_ADMIN = "HTTP_X_APPENGINE_USER_IS_ADMIN"
+
+# Roles required by the decorators, used by AccessMiddleware.
+ROLE_ADMIN = "admin"
+ROLE_TASKS = "tasks"
+
 
 def admin_only(func):
     """Checks the request is from an App Engine administrator."""
@@ -33,6 +42,8 @@ def admin_only(func):
 
         flask.abort(403)
 
+    _wrapper.securescaffold_role = ROLE_ADMIN
+
     return _wrapper
 
 
@@ -51,6 +62,8 @@ def tasks_only(func):
 
         flask.abort(403)
 
+    _wrapper.securescaffold_role = ROLE_TASKS
+
     return _wrapper
 
 
@@ -76,5 +89,95 @@ def is_tasks_or_admin_request(request) -> bool:
     return is_tasks_request(request) or is_admin_request(request)
 
 
+def is_allowed_environ(environ, role) -> bool:
+    """True if the WSGI environ is for a request allowed for the role."""
+    if environ.get(ENVIRON_USER_IS_ADMIN) == "1":
+        return True
+
+    return role == ROLE_TASKS and bool(environ.get(ENVIRON_QUEUENAME))
+
+
+def protected_paths(app: flask.Flask) -> dict:
+    """Find the URLs of views decorated with `admin_only` or `tasks_only`.
+
+    Only rules without variable parts are included. A path can have views
+    for different methods, so each method is checked separately.
+
+    :return: A dict of (URL path, method) to role.
+    """
+    result = {}
+
+    for rule in app.url_map.iter_rules():
+        if rule.arguments:
+            continue
+
+        view = app.view_functions.get(rule.endpoint)
+        role = getattr(view, "securescaffold_role", None)
+
+        for method in rule.methods or ():
+            # The first rule for a path and method is the one Flask uses.
+            result.setdefault((rule.rule, method), role)
+
+    return {key: role for key, role in result.items() if role}
+
+
+class AccessMiddleware:
+    """WSGI middleware that rejects unauthorized admin and tasks requests.
+
+    Requests for the URLs of views decorated with `admin_only` or
+    `tasks_only`, and for URLs starting with one of the "ADMIN_ONLY_PREFIXES"
+    or "TASKS_ONLY_PREFIXES" settings, get a 403 response without running
+    Flask's request handling. The decorators still check the request, this
+    only makes it cheap to reject.
+
+    The URLs are found on the first request, after all views are registered.
+    """
+
+    def __init__(self, wsgi_app, app: flask.Flask):
+        self.wsgi_app = wsgi_app
+        self.app = app
+        self._paths = None
+        self._prefixes = ()
+
+        forbidden = Forbidden().get_response()
+        self._status = forbidden.status
+        self._body = forbidden.get_data()
+        self._headers = [
+            ("Content-Type", forbidden.content_type),
+            ("Content-Length", str(len(self._body))),
+            ("Content-Security-Policy", "default-src 'none'"),
+            ("X-Content-Type-Options", "nosniff"),
+        ]
+
+    def __call__(self, environ, start_response):
+        if self._paths is None:
+            self.compile()
+
+        path = environ.get("PATH_INFO", "")
+        role = self._paths.get((path, environ.get("REQUEST_METHOD", "GET")))
+
+        if role is None:
+            for prefix, prefix_role in self._prefixes:
+                if path.startswith(prefix):
+                    role = prefix_role
+                    break
+
+        if role is None or is_allowed_environ(environ, role):
+            return self.wsgi_app(environ, start_response)
+
+        start_response(self._status, self._headers)
+
+        return [self._body]
+
+    def compile(self) -> None:
+        """Find the protected URLs from the app's views and config."""
+        config = self.app.config
+        prefixes = [(p, ROLE_ADMIN) for p in config.get("ADMIN_ONLY_PREFIXES", ())]
+        prefixes += [(p, ROLE_TASKS) for p in config.get("TASKS_ONLY_PREFIXES", ())]
+
+        self._prefixes = tuple(prefixes)
+        self._paths = protected_paths(self.app)
+
+
 is_cron_request = is_tasks_request
 cron_only = tasks_only
@@ -15,13 +15,25 @@
 import json
 import os
 import secrets
-from typing import Optional
+from typing import Iterable, Optional
 
 import flask
-import flask_seasurf
 import flask_talisman
 from google.cloud import ndb
 
+from . import background
+from . import caching
+from . import csp
+from . import cspreport
+from . import csrf
+from . import datastore
+from . import environ
+from . import liveconfig
+from . import logs
+from . import outbound
+from . import ratelimit
+from . import sessions
+
 
 class AppConfig(ndb.Model):
     """Datastore model for storing app-wide configuration.
@@ -34,6 +46,9 @@ class AppConfig(ndb.Model):
     SINGLETON_ID = "config"
 
     secret_key = ndb.StringProperty()
+    # Settings that override the app's configuration, see LiveConfig.
+    settings = ndb.JsonProperty()
+    version = ndb.IntegerProperty(default=0)
 
     @classmethod
     def singleton(cls) -> "AppConfig":
@@ -52,25 +67,129 @@ class AppConfig(ndb.Model):
 
         return config
 
+    @classmethod
+    def update_settings(cls, values: Optional[dict] = None, remove: Iterable[str] = ()) -> int:
+        """Change the settings, and return the new version number.
+
+        Apps using `securescaffold.liveconfig.LiveConfig` pick up the change
+        the next time they check the version.
+        """
+
+        @ndb.transactional()
+        def _update():
+            obj = cls.get_by_id(cls.SINGLETON_ID) or cls(id=cls.SINGLETON_ID, **cls.initial_config())
+            settings = dict(obj.settings or {})
+            settings.update(values or {})
+
+            for name in remove:
+                settings.pop(name, None)
+
+            obj.settings = settings
+            obj.version = (obj.version or 0) + 1
+            ndb.put_multi([obj, AppConfigVersion(id=cls.SINGLETON_ID, version=obj.version)])
+
+            return obj.version
+
+        return _update()
+
+
+class AppConfigVersion(ndb.Model):
+    """The version of the settings in `AppConfig`.
+
+    This small entity is read to check for changes, instead of reading all
+    the settings.
+    """
+
+    version = ndb.IntegerProperty(default=0)
+
 
 def create_app(*args, **kwargs) -> flask.Flask:
     """Create a Flask app with secure default behaviours.
 
+    The app is safe to create before forking worker processes (for example
+    with `gunicorn --preload`). Clients, connection pools and background
+    threads are created lazily, and re-created in each worker after a fork.
+
     :return: A Flask application.
     :rtype: Flask
     """
     app = flask.Flask(*args, **kwargs)
     configure_app(app)
 
+    if app.config["LOGGING_JSON"]:
+        logs.StructuredLogging(app)
+
+    # Templates compiled by `securescaffold-build templates`.
+    if app.config["JINJA_BYTECODE_CACHE"]:
+        directory = os.path.join(app.root_path, app.config["JINJA_BYTECODE_CACHE"])
+        app.jinja_options = {**app.jinja_options, "bytecode_cache": caching.TemplateBytecodeCache(directory)}
+
+    sessions.init_app(app)
+
+    # The render cache must be added before flask-talisman, see RenderCache.
+    caching.RenderCache(app)
+
+    # Hashes of the templates' inline scripts and styles, for the CSP.
+    if app.config["CSP_POLICY_HASH_TEMPLATES"]:
+        csp.hash_templates(app)
+
+    if app.config["CSP_REPORT_URL"] and not app.config["CSP_POLICY_REPORT_URI"]:
+        app.config["CSP_POLICY_REPORT_URI"] = app.config["CSP_REPORT_URL"]
+
     # Both these extensions can be used as view decorators. Bit worried that
     # this circular reference will cause memory leaks.
     talisman_kwargs = get_talisman_config(app.config)
     app.talisman = flask_talisman.Talisman(app, **talisman_kwargs)
-    app.csrf = flask_seasurf.SeaSurf(app)
+    app.csrf = csrf.SeaSurf(app)
+
+    # Work that runs after the response is sent, as `app.background`.
+    background.BackgroundWork(app)
+
+    # Receives CSP violation reports, exempt from CSRF protection.
+    if app.config["CSP_REPORT_URL"]:
+        cspreport.CSPReports(app)
+
+    # Settings that can be changed in the datastore without a redeploy.
+    if app.config["LIVE_CONFIG_TTL"]:
+        liveconfig.LiveConfig(app, ttl=app.config["LIVE_CONFIG_TTL"])
+
+    if app.config["NDB_REQUEST_CONTEXT"]:
+        datastore.init_request_context(app)
+
+    # Throttling for the "RATE_LIMIT" setting and the `rate_limit` decorator.
+    ratelimit.RateLimiter(app)
+
+    # Pooled sessions for outbound HTTP requests, as `app.http`.
+    outbound.HTTPSessions(app)
+
+    # Reject unauthorized requests for admin and tasks URLs before routing.
+    app.wsgi_app = environ.AccessMiddleware(app.wsgi_app, app)
+    app.extensions["securescaffold.access"] = app.wsgi_app
 
     return app
 
 
+def prepare_app(app: flask.Flask) -> None:
+    """Do the work that would otherwise happen on the first request.
+
+    Call this after all the routes are defined. With `gunicorn --preload`
+    call it before the workers are forked, so the compiled routes and
+    templates environment are shared by the workers instead of being built
+    again in each worker.
+    """
+    app.url_map.update()
+    app.jinja_env
+
+    # Include templates from blueprints registered after create_app.
+    if app.config.get("CSP_POLICY_HASH_TEMPLATES"):
+        csp.hash_templates(app)
+
+    middleware = app.extensions.get("securescaffold.access")
+
+    if middleware is not None:
+        middleware.compile()
+
+
 def configure_app(app: flask.Flask) -> None:
     """Read configuration and create a SECRET_KEY.
 
@@ -93,11 +212,17 @@ def configure_app(app: flask.Flask) -> None:
 
 
 def get_config_from_datastore() -> AppConfig:
-    # This happens at application startup, so we use a new NDB context.
+    # This happens at application startup, which with `gunicorn --preload` is
+    # in the master process before it forks. A gRPC channel (and its threads)
+    # must not be shared with the workers, so the read uses its own client,
+    # which is closed afterwards.
     client = ndb.Client()
 
-    with client.context():
-        obj = AppConfig.singleton()
+    try:
+        with datastore.context(client):
+            obj = AppConfig.singleton()
+    finally:
+        client.stub.close()
 
     return obj
 
@@ -113,5 +238,9 @@ def get_talisman_config(config: dict) -> dict:
     }
 
     result = {kwarg: config[setting] for setting, kwarg in names.items()}
+    # Sources found in the templates by securescaffold.csp.
+    result["content_security_policy"] = csp.add_sources(
+        result["content_security_policy"], config.get("CSP_POLICY_SOURCES")
+    )
 
     return result
@@ -0,0 +1,69 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Re-create per-process resources after the process forks.
+
+With `gunicorn --preload` the app is created once and the worker processes
+are forked from it. Configuration and routes can be shared by the workers,
+but gRPC channels, connection pools, locks and background threads cannot.
+Objects that hold those register a callback here, which runs in the child
+process after a fork so they are re-created lazily.
+"""
+import os
+import threading
+import weakref
+from typing import Callable
+
+
+_callbacks = []
+_lock = threading.Lock()
+
+
+def register(callback: Callable[[], None]) -> None:
+    """Call a function in the child process after a fork.
+
+    Bound methods are held with a weak reference, so registering an object's
+    method does not keep the object alive.
+    """
+    if hasattr(callback, "__self__"):
+        ref = weakref.WeakMethod(callback)
+    else:
+        ref = lambda: callback  # noqa: E731
+
+    with _lock:
+        # Drop references to objects that no longer exist.
+        _callbacks[:] = [r for r in _callbacks if r() is not None]
+        _callbacks.append(ref)
+
+
+def after_fork_in_child() -> None:
+    """Run the registered callbacks. Called automatically after a fork."""
+    global _callbacks, _lock
+
+    # A lock held by another thread at the time of the fork is never released
+    # in the child, so start again with a new lock.
+    _lock = threading.Lock()
+    refs = [ref for ref in _callbacks if ref() is not None]
+    _callbacks = refs
+
+    for ref in refs:
+        callback = ref()
+
+        if callback is not None:
+            callback()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=after_fork_in_child)
@@ -0,0 +1,200 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Settings that can be changed without a redeploy.
+
+Settings saved with `AppConfig.update_settings` override the app's
+configuration. Each instance checks a small version entity every
+"LIVE_CONFIG_TTL" seconds, in a background thread, and when the version
+changes it reads the settings and swaps in a new snapshot.
+
+Read settings with `securescaffold.liveconfig.get_config()`, which returns
+a read-only mapping. A request sees the same snapshot from start to finish.
+The flask-talisman (CSP) options are updated when the snapshot changes.
+Other extensions read their settings at startup, and are not updated.
+"""
+import logging
+import threading
+import time
+import types
+from typing import Callable, Mapping, Optional
+
+import flask
+from google.cloud import ndb
+
+from . import datastore
+from . import factory
+from . import forksafe
+
+
+logger = logging.getLogger(__name__)
+
+# flask-talisman option names that are the same as its attribute names.
+TALISMAN_ATTRIBUTES = (
+    "content_security_policy",
+    "content_security_policy_nonce_in",
+    "content_security_policy_report_only",
+    "content_security_policy_report_uri",
+)
+
+
+class LiveConfig:
+    """Snapshots of the app configuration, with overrides from the datastore.
+
+    `create_app` adds an instance to the app as `app.live_config` when the
+    "LIVE_CONFIG_TTL" setting is not None.
+
+    :param float ttl: Seconds between checks for a new version.
+    """
+
+    def __init__(
+        self, app: Optional[flask.Flask] = None, ttl: float = 30.0, clock: Callable[[], float] = time.monotonic
+    ):
+        self.ttl = ttl
+        self.clock = clock
+        self.version = None
+        self.snapshot = types.MappingProxyType({})
+        self._base = {}
+        self._settings = {}
+        self._next_check = 0.0
+        self._checking = False
+        self.app = None
+        forksafe.register(self._after_fork)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask) -> None:
+        self.app = app
+        self._base = dict(app.config)
+        self.snapshot = types.MappingProxyType(self._base)
+        app.live_config = self
+        # Runs before the other extensions' before-request functions, which
+        # may return a response early (like flask-talisman's HTTPS redirect).
+        app.before_request_funcs.setdefault(None, []).insert(0, self._before_request)
+
+        # Start with the current settings. With `gunicorn --preload` this is
+        # in the master process, so like `factory.get_config_from_datastore`
+        # the read uses its own client, which is closed afterwards.
+        client = ndb.Client()
+
+        try:
+            self.refresh(client)
+        finally:
+            client.stub.close()
+
+    def refresh(self, client: Optional[ndb.Client] = None) -> bool:
+        """Read the version, and the settings if they changed.
+
+        :param client: The NDB client to read with, by default the one
+            shared by the scaffold's helpers.
+        :return: True if there is a new snapshot.
+        """
+        self._next_check = self.clock() + self.ttl
+        version = self._fetch_version(client)
+
+        if version == self.version:
+            return False
+
+        version, settings = self._fetch_settings(client)
+        self._apply(version, settings)
+
+        return True
+
+    def update_base(self, values: dict) -> None:
+        """Change settings that are not stored in the datastore.
+
+        The datastore settings still override these.
+        """
+        self._base.update(values)
+        self._apply(self.version, self._settings)
+
+    def _before_request(self) -> None:
+        # Pin the snapshot for this request. Checking for a new version
+        # happens in the background, so requests never wait for it.
+        flask.g._securescaffold_config = self.snapshot
+
+        if self.clock() >= self._next_check and not self._checking:
+            self._checking = True
+            self._next_check = self.clock() + self.ttl
+            thread = threading.Thread(target=self._refresh_in_background, daemon=True)
+            thread.start()
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            # Keep the current snapshot, and try again after the TTL.
+            logger.exception("Failed to refresh the app configuration")
+        finally:
+            self._checking = False
+
+    def _after_fork(self) -> None:
+        # A check running in the parent's background thread does not exist in
+        # the child process.
+        self._checking = False
+
+    def _fetch_version(self, client: Optional[ndb.Client] = None) -> int:
+        with datastore.context(client):
+            obj = factory.AppConfigVersion.get_by_id(factory.AppConfig.SINGLETON_ID)
+
+        return obj.version if obj else 0
+
+    def _fetch_settings(self, client: Optional[ndb.Client] = None) -> tuple:
+        with datastore.context(client):
+            obj = factory.AppConfig.get_by_id(factory.AppConfig.SINGLETON_ID)
+
+        if obj is None:
+            return 0, {}
+
+        return obj.version or 0, obj.settings or {}
+
+    def _apply(self, version: int, settings: dict) -> None:
+        snapshot = types.MappingProxyType({**self._base, **settings})
+        talisman = getattr(self.app, "talisman", None)
+
+        if talisman is not None:
+            options = factory.get_talisman_config(snapshot)
+            options["content_security_policy_nonce_in"] = options["content_security_policy_nonce_in"] or []
+            # One dict update, so the options change together.
+            talisman.__dict__.update({name: options[name] for name in TALISMAN_ATTRIBUTES})
+
+        # Replacing the attribute is atomic, requests see either the old or
+        # the new snapshot.
+        self.snapshot = snapshot
+        self.version = version
+        self._settings = settings
+
+        if settings:
+            logger.info("App configuration version %s: %s", version, sorted(settings))
+
+
+def get_config() -> Mapping:
+    """Get the app configuration for the current request.
+
+    Returns the live configuration snapshot if the app has one, otherwise
+    the app's configuration.
+    """
+    snapshot = flask.g.get("_securescaffold_config")
+
+    if snapshot is not None:
+        return snapshot
+
+    live_config = getattr(flask.current_app, "live_config", None)
+
+    if live_config is not None:
+        return live_config.snapshot
+
+    return flask.current_app.config
@@ -0,0 +1,281 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Structured logging for Cloud Logging, without blocking request threads.
+
+When the "LOGGING_JSON" setting is True, `create_app` replaces the root
+logger's handlers. Each record is written to stdout as one line of JSON that
+Cloud Logging reads, with the severity, the request's trace (so the logs are
+grouped with the request in the Logs Explorer), the request path and the
+signed-in user's ID.
+
+Request threads put records on a bounded queue, and a background thread
+writes them. When the queue is over half full, records below WARNING are
+dropped, and when it is full all records are dropped, so a slow stdout never
+blocks a request. The number of dropped records is logged. The queue is
+written out when the process exits.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from typing import Optional
+
+import flask
+
+from . import forksafe
+from .contrib.appengine import users
+
+
+TRACE_HEADER = "X-Cloud-Trace-Context"
+TRACEPARENT_HEADER = "traceparent"
+TRACE_FIELD = "logging.googleapis.com/trace"
+SPAN_FIELD = "logging.googleapis.com/spanId"
+SAMPLED_FIELD = "logging.googleapis.com/trace_sampled"
+
+_installed = None
+_lock = threading.Lock()
+
+
+def request_context() -> dict:
+    """Fields for log records about the current request.
+
+    These are read once for each request, and kept on `flask.g`.
+    """
+    fields = flask.g.get("_securescaffold_log_context")
+
+    if fields is not None:
+        return fields
+
+    request = flask.request
+    fields = {"path": request.path}
+    project = os.environ.get("GOOGLE_CLOUD_PROJECT")
+    trace_id, span_id, sampled = parse_trace(request.headers)
+
+    if trace_id:
+        fields[TRACE_FIELD] = f"projects/{project}/traces/{trace_id}" if project else trace_id
+        fields[SAMPLED_FIELD] = sampled
+
+        if span_id:
+            fields[SPAN_FIELD] = span_id
+
+    if request.headers.get(users.USER_AUTH_DOMAIN_HEADER):
+        user = users.get_current_user()
+
+        if user is not None and user.user_id():
+            fields["user_id"] = user.user_id()
+
+    flask.g._securescaffold_log_context = fields
+
+    return fields
+
+
+def parse_trace(headers) -> tuple:
+    """Get (trace ID, span ID, sampled) from the request headers."""
+    value = headers.get(TRACE_HEADER)
+
+    if value:
+        # "TRACE_ID/SPAN_ID;o=1"
+        trace, _, options = value.partition(";")
+        trace_id, _, span_id = trace.partition("/")
+
+        return trace_id, span_id, options == "o=1"
+
+    value = headers.get(TRACEPARENT_HEADER)
+
+    if value:
+        # W3C "00-TRACE_ID-SPAN_ID-FLAGS"
+        parts = value.split("-")
+
+        if len(parts) == 4:
+            return parts[1], parts[2], parts[3] == "01"
+
+    return None, None, False
+
+
+class RequestContextFilter(logging.Filter):
+    """Adds the request's fields to records logged during a request.
+
+    This runs on the thread that logged the record, before it is queued.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if flask.has_request_context():
+            try:
+                record.securescaffold_fields = request_context()
+            except Exception:
+                # Never lose a record because the request is odd.
+                record.securescaffold_fields = {}
+
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one line of JSON for Cloud Logging."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        seconds = int(record.created)
+        entry = {
+            "severity": record.levelname,
+            "message": message,
+            "logger": record.name,
+            "timestamp": {"seconds": seconds, "nanos": int((record.created - seconds) * 1e9)},
+        }
+        entry.update(getattr(record, "securescaffold_fields", {}))
+
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Puts records on a bounded queue, and drops them instead of waiting.
+
+    :param int high_water: Queue size above which records below WARNING
+        are dropped.
+    """
+
+    def __init__(self, log_queue: queue.Queue, high_water: Optional[int] = None):
+        super().__init__(log_queue)
+        self.high_water = high_water if high_water is not None else log_queue.maxsize // 2
+        self.dropped = 0
+        self.addFilter(RequestContextFilter())
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if record.levelno < logging.WARNING and self.queue.qsize() >= self.high_water:
+            self.dropped += 1
+            return
+
+        try:
+            if self.dropped:
+                self._enqueue_dropped()
+
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _enqueue_dropped(self) -> None:
+        dropped, self.dropped = self.dropped, 0
+        message = "Dropped %d log records, the log queue was full"
+        record = logging.LogRecord(__name__, logging.WARNING, __file__, 0, message, (dropped,), None)
+
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += dropped
+
+
+class QueueListener(logging.handlers.QueueListener):
+    """QueueListener that waits for space on the queue when it is stopped."""
+
+    def enqueue_sentinel(self) -> None:
+        # The default uses put_nowait(), which fails when the queue is full.
+        self.queue.put(self._sentinel, timeout=10)
+
+
+class StructuredLogging:
+    """JSON logging through a queue, installed on the root logger.
+
+    `create_app` adds an instance to the app as
+    `app.extensions["securescaffold.logs"]` when the "LOGGING_JSON" setting
+    is True.
+
+    :param int queue_size: Maximum records waiting to be written.
+    """
+
+    def __init__(self, app: Optional[flask.Flask] = None, queue_size: int = 10000, stream=None):
+        self.queue_size = queue_size
+        self.stream = stream
+        self.level = logging.INFO
+        self.handler = None
+        self.listener = None
+        forksafe.register(self._after_fork)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask) -> None:
+        self.queue_size = app.config.get("LOGGING_QUEUE_SIZE", self.queue_size)
+        self.level = app.config.get("LOGGING_LEVEL", self.level)
+        self.install()
+        app.extensions["securescaffold.logs"] = self
+
+    def install(self) -> None:
+        """Replace the root logger's handlers, and start writing records."""
+        global _installed
+
+        with _lock:
+            if _installed is not None and _installed is not self:
+                _installed.uninstall()
+
+            self.stop()
+            self._start()
+            root = logging.getLogger()
+
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+
+            root.addHandler(self.handler)
+            root.setLevel(self.level)
+            _installed = self
+
+    def uninstall(self) -> None:
+        """Remove the handler, and write the records on the queue."""
+        if self.handler is not None:
+            logging.getLogger().removeHandler(self.handler)
+
+        self.stop()
+
+    def _start(self) -> None:
+        log_queue = queue.Queue(self.queue_size)
+        stream_handler = logging.StreamHandler(self.stream or sys.stdout)
+        stream_handler.setFormatter(JSONFormatter())
+        old_handler = self.handler
+        self.handler = DroppingQueueHandler(log_queue)
+        self.listener = QueueListener(log_queue, stream_handler)
+        self.listener.start()
+
+        if old_handler is not None:
+            root = logging.getLogger()
+
+            if old_handler in root.handlers:
+                root.removeHandler(old_handler)
+                root.addHandler(self.handler)
+
+    def stop(self) -> None:
+        """Write the records on the queue, and stop the background thread."""
+        listener, self.listener = self.listener, None
+
+        if listener is not None:
+            try:
+                listener.stop()
+            except queue.Full:
+                # The background thread is stuck, give up on the records.
+                pass
+
+    def _after_fork(self) -> None:
+        # The parent's background thread does not exist in the child, so start
+        # again with a new queue and thread.
+        if self.listener is not None:
+            self._start()
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    if _installed is not None:
+        _installed.stop()
@@ -0,0 +1,168 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Pooled, keep-alive HTTP sessions for outbound requests.
+
+`create_app` adds an `HTTPSessions` instance to the app as `app.http`. All
+the sessions it creates share one connection pool, so outbound requests
+re-use connections instead of opening a new TCP / TLS connection each time.
+"""
+import random
+import threading
+import urllib.parse
+from typing import Optional
+
+import flask
+import google.auth.transport.requests
+import requests
+import requests.adapters
+from urllib3.util.retry import Retry
+
+from . import forksafe
+
+
+class JitterRetry(Retry):
+    """Retry with "full jitter", a random backoff up to the normal backoff."""
+
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
+
+
+class PooledHTTPAdapter(requests.adapters.HTTPAdapter):
+    """HTTPAdapter with a default timeout and a per-host concurrency limit.
+
+    :param float timeout: Used when a request does not set a timeout.
+    :param int per_host_limit: Maximum concurrent requests to each host, or
+        None for no limit.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, per_host_limit: Optional[int] = None, **kwargs):
+        self.timeout = timeout
+        self.per_host_limit = per_host_limit
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+
+        if not self.per_host_limit:
+            return super().send(request, **kwargs)
+
+        with self._semaphore(urllib.parse.urlsplit(request.url).netloc):
+            return super().send(request, **kwargs)
+
+    def _semaphore(self, host: str) -> threading.BoundedSemaphore:
+        semaphore = self._semaphores.get(host)
+
+        if semaphore is None:
+            with self._semaphores_lock:
+                semaphore = self._semaphores.setdefault(host, threading.BoundedSemaphore(self.per_host_limit))
+
+        return semaphore
+
+
+class HTTPSessions:
+    """App-scoped factory for HTTP sessions that share a connection pool.
+
+    A `requests.Session` is not safe to share between threads, so each thread
+    gets its own session. The sessions share one `PooledHTTPAdapter`, which
+    is thread-safe, and so share connections.
+
+    The pools are configured with the "HTTP_*" settings.
+    """
+
+    def __init__(self, app: Optional[flask.Flask] = None):
+        self.adapter = None
+        self._config = {}
+        self._local = threading.local()
+        forksafe.register(self._after_fork)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask) -> None:
+        names = [
+            "HTTP_BACKOFF_FACTOR",
+            "HTTP_PER_HOST_LIMIT",
+            "HTTP_POOL_CONNECTIONS",
+            "HTTP_POOL_MAXSIZE",
+            "HTTP_RETRIES",
+            "HTTP_TIMEOUT",
+        ]
+        self._config = {name: app.config[name] for name in names if name in app.config}
+        self.adapter = self._create_adapter()
+        app.http = self
+
+    def _create_adapter(self) -> PooledHTTPAdapter:
+        config = self._config
+        retries = JitterRetry(
+            total=config.get("HTTP_RETRIES", 3),
+            backoff_factor=config.get("HTTP_BACKOFF_FACTOR", 0.5),
+            status_forcelist=(429, 500, 502, 503, 504),
+            raise_on_status=False,
+        )
+
+        return PooledHTTPAdapter(
+            timeout=config.get("HTTP_TIMEOUT", 30),
+            per_host_limit=config.get("HTTP_PER_HOST_LIMIT"),
+            pool_connections=config.get("HTTP_POOL_CONNECTIONS", 10),
+            pool_maxsize=config.get("HTTP_POOL_MAXSIZE", 10),
+            max_retries=retries,
+        )
+
+    def _after_fork(self) -> None:
+        # Connections in the pool are shared with the parent process, so the
+        # child process starts with an empty pool.
+        if self.adapter is not None:
+            self.adapter = self._create_adapter()
+
+        self._local = threading.local()
+
+    def mount(self, session: requests.Session) -> requests.Session:
+        """Use the shared connection pool for a session."""
+        session.mount("https://", self.adapter)
+        session.mount("http://", self.adapter)
+
+        return session
+
+    def session(self) -> requests.Session:
+        """Get the session for the current thread."""
+        session = getattr(self._local, "session", None)
+
+        if session is None:
+            session = self.mount(requests.Session())
+            self._local.session = session
+
+        return session
+
+    def auth_request(self) -> google.auth.transport.requests.Request:
+        """Get a google-auth transport request that uses the shared pool.
+
+        Use this to refresh credentials, instead of creating a
+        `google.auth.transport.requests.Request()` with a new session.
+        """
+        return google.auth.transport.requests.Request(session=self.session())
+
+    def authorized_session(self, credentials) -> google.auth.transport.requests.AuthorizedSession:
+        """Create a session that adds the credentials to requests."""
+        session = google.auth.transport.requests.AuthorizedSession(credentials, auth_request=self.auth_request())
+
+        return self.mount(session)
+
+    def close(self) -> None:
+        """Close the connections in the pool."""
+        self.adapter.close()
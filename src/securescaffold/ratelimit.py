@@ -0,0 +1,370 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Rate limiting by user or client IP address.
+
+    from securescaffold.ratelimit import rate_limit
+
+    @app.route("/search")
+    @rate_limit("10/minute")
+    def search():
+        ...
+
+The "RATE_LIMIT" setting applies a limit to every request, and the decorator
+adds a tighter limit to a view. Requests are counted by the signed-in
+user's ID (see `securescaffold.contrib.appengine.users`), or by the client IP
+address for anonymous requests. Requests from admins and the Cron / Tasks
+scheduler are not limited.
+
+Each instance checks requests against an in-process token bucket, without a
+lock. When "RATE_LIMIT_REDIS_URL" is set, instances also add their counts to
+a shared Redis (for example Memorystore) counter every
+"RATE_LIMIT_SYNC_INTERVAL" seconds, in a background thread, and a client
+over the limit across all instances is rejected until the end of the
+window. Counts are approximate: a client can go a little over the limit
+between syncs, or when two threads update the same bucket.
+"""
+import functools
+import heapq
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import flask
+
+from . import environ
+from . import forksafe
+from .contrib.appengine import users
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_NAME = "securescaffold.ratelimit"
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+X_APPENGINE_USER_IP = "X-Appengine-User-Ip"
+
+BucketKey = Tuple[str, str]
+
+
+class Limit(NamedTuple):
+    """A number of requests in a period of seconds."""
+
+    count: int
+    period: int
+
+    @classmethod
+    def parse(cls, value: str) -> "Limit":
+        """Parse a limit like "10/minute"."""
+        count, _, period = value.partition("/")
+
+        try:
+            return cls(int(count), PERIODS[period.strip()])
+        except (KeyError, ValueError):
+            raise ValueError(f"Invalid rate limit: {value!r}") from None
+
+
+class MemoryStore:
+    """Counters in this process, for tests and single-instance apps."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def increment(self, items: List[Tuple[str, int, int]]) -> List[int]:
+        """Add to counters, and return the new values.
+
+        :param items: (counter name, amount, seconds before it expires).
+        """
+        now = self.clock()
+        result = []
+
+        with self._lock:
+            for name, amount, ttl in items:
+                count, expires = self._counts.get(name, (0, 0))
+
+                if expires <= now:
+                    count, expires = 0, now + ttl
+
+                self._counts[name] = (count + amount, expires)
+                result.append(count + amount)
+
+            if len(self._counts) > 10000:
+                self._counts = {name: value for name, value in self._counts.items() if value[1] > now}
+
+        return result
+
+
+class RedisStore:
+    """Counters in Redis, shared by all instances.
+
+    :param client: A `redis.Redis` client, or anything with the same
+        `pipeline()` interface.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisStore":
+        if redis is None:
+            raise RuntimeError("RATE_LIMIT_REDIS_URL requires the redis library")
+
+        return cls(redis.Redis.from_url(url, socket_timeout=1))
+
+    def increment(self, items: List[Tuple[str, int, int]]) -> List[int]:
+        # One round trip for the batch.
+        pipe = self.client.pipeline(transaction=False)
+
+        for name, amount, ttl in items:
+            pipe.incrby(name, amount)
+            pipe.expire(name, ttl)
+
+        results = pipe.execute()
+
+        return [int(value) for value in results[::2]]
+
+
+class RateLimiter:
+    """In-process token buckets, optionally synced with a shared store.
+
+    `create_app` adds an instance to the app as
+    `app.extensions["securescaffold.ratelimit"]`.
+
+    :param store: A `RedisStore` or `MemoryStore`, or None to only limit
+        requests in this process.
+    :param float sync_interval: Seconds between updates of the store.
+    :param int max_keys: Maximum buckets kept in memory.
+    """
+
+    def __init__(
+        self,
+        app: Optional[flask.Flask] = None,
+        store=None,
+        sync_interval: float = 1.0,
+        max_keys: int = 100000,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time,
+    ):
+        self.store = store
+        self.sync_interval = sync_interval
+        self.max_keys = max_keys
+        self.clock = clock
+        self.wall_clock = wall_clock
+        self.default_limit = None
+        self._body = b""
+        self._headers = {}
+        self._buckets: Dict[BucketKey, Tuple[float, float]] = {}
+        self._blocked: Dict[BucketKey, float] = {}
+        self._pending: Dict[BucketKey, Tuple[Limit, int]] = {}
+        self._next_sync = 0.0
+        self._syncing = False
+        self._max_period = 0
+        self.set_response()
+        forksafe.register(self._after_fork)
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: flask.Flask) -> None:
+        config = app.config
+        self.sync_interval = config.get("RATE_LIMIT_SYNC_INTERVAL", self.sync_interval)
+
+        if config.get("RATE_LIMIT_REDIS_URL"):
+            self.store = RedisStore.from_url(config["RATE_LIMIT_REDIS_URL"])
+
+        if config.get("RATE_LIMIT"):
+            self.default_limit = Limit.parse(config["RATE_LIMIT"])
+            # Runs before the other extensions' before-request functions, so
+            # rejected requests skip the CSRF checks and session loading.
+            app.before_request_funcs.setdefault(None, []).insert(0, self._before_request)
+
+        app.extensions[EXTENSION_NAME] = self
+
+    def set_response(self, body: str = "Too many requests, try again later.\n") -> None:
+        """Set the body of the 429 response for rejected requests.
+
+        The body and headers are made once, not for each rejected request.
+        """
+        self._body = body.encode("utf-8")
+        self._headers = {}
+
+    def reject(self, limit: Limit) -> flask.Response:
+        """A 429 response for a request over the limit."""
+        headers = self._headers.get(limit)
+
+        if headers is None:
+            headers = self._headers[limit] = [("Retry-After", str(limit.period))]
+
+        return flask.Response(self._body, status=429, headers=headers, mimetype="text/plain")
+
+    def hit(self, scope: str, key: str, limit: Limit) -> bool:
+        """Count a request, and return True if it is allowed."""
+        bucket_key = (scope, key)
+        now = self.clock()
+        blocked_until = self._blocked.get(bucket_key)
+
+        if blocked_until is not None:
+            if now < blocked_until:
+                return False
+
+            self._blocked.pop(bucket_key, None)
+
+        # Read and replace a tuple instead of locking. Two threads updating
+        # the same bucket at once can let an extra request through.
+        tokens, last = self._buckets.get(bucket_key, (limit.count, now))
+        tokens = min(limit.count, tokens + (now - last) * limit.count / limit.period)
+
+        if tokens < 1:
+            self._buckets[bucket_key] = (tokens, now)
+            return False
+
+        if bucket_key not in self._buckets:
+            self._max_period = max(self._max_period, limit.period)
+
+            if len(self._buckets) >= self.max_keys:
+                self._prune(now)
+
+        self._buckets[bucket_key] = (tokens - 1, now)
+
+        if self.store is not None:
+            pending = self._pending.get(bucket_key)
+            self._pending[bucket_key] = (limit, pending[1] + 1 if pending else 1)
+
+            if now >= self._next_sync and not self._syncing:
+                self._syncing = True
+                self._next_sync = now + self.sync_interval
+                threading.Thread(target=self._sync_in_background, daemon=True).start()
+
+        return True
+
+    def _prune(self, now: float) -> None:
+        # A bucket not used for its period is full again, so it can go.
+        period = self._max_period
+        self._buckets = {key: value for key, value in self._buckets.items() if now - value[1] < period}
+
+        if len(self._buckets) >= self.max_keys:
+            # Keep the buckets used most recently. Dropping a bucket only
+            # resets its count, so evict more than one to prune less often.
+            keep = self.max_keys * 3 // 4
+            newest = heapq.nlargest(keep, self._buckets.items(), key=lambda item: item[1][1])
+            self._buckets = dict(newest)
+
+    def _sync_in_background(self) -> None:
+        try:
+            self.sync()
+        except Exception:
+            # Keep limiting in this process, and try again next time.
+            logger.exception("Failed to sync rate limit counters")
+        finally:
+            self._syncing = False
+
+    def sync(self) -> None:
+        """Add this process's counts to the store, and block clients over the limit."""
+        pending, self._pending = self._pending, {}
+
+        if not pending or self.store is None:
+            return
+
+        now = self.clock()
+        wall = self.wall_clock()
+        keys = list(pending)
+        items = []
+
+        for scope, key in keys:
+            limit, count = pending[(scope, key)]
+            window = int(wall // limit.period)
+            items.append((f"ratelimit:{scope}:{key}:{window}", count, limit.period))
+
+        totals = self.store.increment(items)
+
+        for bucket_key, total in zip(keys, totals):
+            limit = pending[bucket_key][0]
+
+            if total > limit.count:
+                # Blocked until the end of the store's window.
+                self._blocked[bucket_key] = now + limit.period - (wall % limit.period)
+
+    def _before_request(self) -> Optional[flask.Response]:
+        request = flask.request
+
+        if request.endpoint == "static" or environ.is_tasks_or_admin_request(request):
+            return None
+
+        if not self.hit("*", client_key(), self.default_limit):
+            return self.reject(self.default_limit)
+
+        return None
+
+    def _after_fork(self) -> None:
+        # Counts not yet synced belong to the parent process.
+        self._pending = {}
+        self._syncing = False
+        self._next_sync = 0.0
+
+
+def client_key() -> str:
+    """The signed-in user's ID, or the client's IP address."""
+    request = flask.request
+
+    if request.headers.get(users.USER_AUTH_DOMAIN_HEADER):
+        user = users.get_current_user()
+
+        if user is not None and user.user_id():
+            return "user:" + user.user_id()
+
+    # App Engine sets this header, and removes it from the client's request.
+    address = request.headers.get(X_APPENGINE_USER_IP) or request.remote_addr
+
+    return f"ip:{address}"
+
+
+def rate_limit(limit: str, key: Optional[Callable[[], str]] = None, scope: Optional[str] = None):
+    """Limit the requests to a view, for each user or client IP address.
+
+    :param str limit: For example "10/minute". The periods are "second",
+        "minute", "hour" and "day".
+    :param key: Function that returns the key to count requests by, the
+        default is `client_key`.
+    :param str scope: Name for the counters, the default is the view's
+        name. Views with the same scope share a limit.
+    """
+    parsed = Limit.parse(limit)
+    key = key or client_key
+
+    def decorator(func):
+        name = scope or f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def _wrapper(*args, **kwargs):
+            limiter = flask.current_app.extensions.get(EXTENSION_NAME)
+
+            if limiter is None:
+                limiter = RateLimiter(flask.current_app)
+
+            if not environ.is_tasks_or_admin_request(flask.request) and not limiter.hit(name, key(), parsed):
+                return limiter.reject(parsed)
+
+            return func(*args, **kwargs)
+
+        return _wrapper
+
+    return decorator
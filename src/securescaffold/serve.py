@@ -0,0 +1,144 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Run an app with gunicorn, with workers sized for the App Engine instance.
+
+Requires gunicorn, which you can install with
+`pip install securescaffold[serve]`. Use it as the entrypoint in app.yaml:
+
+    entrypoint: securescaffold-serve main:app
+
+The number of workers is picked from the instance's memory limit (App Engine
+sets "GAE_MEMORY_MB"), or from the number of CPUs when running elsewhere.
+Workers use threads by default. NDB contexts belong to a thread, so set
+NDB_REQUEST_CONTEXT = True to give each request thread its own context.
+"""
+import argparse
+import os
+from typing import Optional
+
+try:
+    import gunicorn.app.base
+    import gunicorn.util
+except ImportError:
+    gunicorn = None
+
+from . import factory
+
+
+# Workers for each instance class, keyed by the memory limit in MB.
+# https://cloud.google.com/appengine/docs/standard/python3/runtime#entrypoint_best_practices
+INSTANCE_WORKERS = [
+    (384, 2),  # F1, B1
+    (768, 4),  # F2, B2
+    (1536, 8),  # F4, B4
+    (3072, 8),  # F4_1G, B4_1G, B8
+]
+DEFAULT_THREADS = 8
+
+
+def worker_config(environ: Optional[dict] = None, cpu_count: Optional[int] = None) -> dict:
+    """Get the number of workers and threads for this instance.
+
+    :param dict environ: Environment variables, defaults to `os.environ`.
+    :param int cpu_count: Number of CPUs, defaults to `os.cpu_count()`.
+    :return: A dict with "workers" and "threads".
+    """
+    environ = os.environ if environ is None else environ
+    memory_mb = environ.get("GAE_MEMORY_MB")
+
+    if memory_mb:
+        memory_mb = int(memory_mb)
+        # The largest class that fits in the memory limit, or the smallest.
+        workers = INSTANCE_WORKERS[0][1]
+
+        for limit, count in INSTANCE_WORKERS:
+            if memory_mb >= limit:
+                workers = count
+    else:
+        workers = 2 * (cpu_count or os.cpu_count() or 1) + 1
+
+    return {"workers": workers, "threads": DEFAULT_THREADS}
+
+
+def gunicorn_options(args: argparse.Namespace, environ: Optional[dict] = None) -> dict:
+    """Convert command line arguments to gunicorn settings."""
+    environ = os.environ if environ is None else environ
+    config = worker_config(environ)
+    workers = args.workers or config["workers"]
+    threads = args.threads or config["threads"]
+
+    options = {
+        "bind": args.bind or ":" + environ.get("PORT", "8080"),
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "gthread" if threads > 1 else "sync",
+        "preload_app": args.preload,
+        "timeout": args.timeout,
+        "loglevel": args.log_level,
+    }
+
+    return options
+
+
+if gunicorn is not None:
+
+    class Application(gunicorn.app.base.BaseApplication):
+        """Gunicorn application for a WSGI app module, like "main:app"."""
+
+        def __init__(self, app_uri: str, options: dict):
+            self.app_uri = app_uri
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for name, value in self.options.items():
+                self.cfg.set(name, value)
+
+            self.cfg.set("when_ready", when_ready)
+
+        def load(self):
+            return gunicorn.util.import_app(self.app_uri)
+
+
+def when_ready(server) -> None:
+    # With preload, compile the routes before the workers are forked.
+    if server.cfg.preload_app:
+        app = server.app.wsgi()
+
+        if hasattr(app, "url_map"):
+            factory.prepare_app(app)
+
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description="Run a WSGI app with gunicorn.")
+    parser.add_argument("app", nargs="?", default="main:app", help='The WSGI app, default "main:app"')
+    parser.add_argument("--bind", help='Address to listen on, default ":$PORT"')
+    parser.add_argument("--workers", type=int, help="Number of worker processes")
+    parser.add_argument("--threads", type=int, help="Number of threads for each worker, 1 for sync workers")
+    parser.add_argument("--no-preload", dest="preload", action="store_false",
+                        help="Load the app in each worker, instead of before forking the workers")
+    parser.add_argument("--timeout", type=int, default=0, help="Worker timeout in seconds, default none")
+    parser.add_argument("--log-level", default="info", help='Gunicorn log level, default "info"')
+    args = parser.parse_args(argv)
+
+    if gunicorn is None:
+        parser.error("serving requires gunicorn, install it with `pip install securescaffold[serve]`")
+
+    Application(args.app, gunicorn_options(args)).run()
+
+
+if __name__ == "__main__":
+    main()
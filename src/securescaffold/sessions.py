@@ -0,0 +1,380 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Server-side sessions stored in the datastore.
+
+Flask's default sessions store everything in a signed cookie, which is sent
+with every request and verified each time. With "SESSION_STORE" set to
+"datastore" the cookie only holds a random session ID, and the session data
+is stored in a `Session` entity.
+
+- The entity is only read when the view (or an extension) uses
+  `flask.session`, and recently read sessions are cached in memory.
+- The entity is only written when the session was changed. Like Flask's
+  sessions, changes to mutable values (like appending to a list) are not
+  noticed, so set `session.modified = True` after those.
+- Flask-SeaSurf's CSRF token is not stored in the entity. It is kept in a
+  second, signed cookie, so CSRF checks do not read or write the datastore.
+- A session ID that is not in the datastore is replaced with a new one, and
+  `regenerate()` gives a session a new ID (call it when a user logs in).
+"""
+import collections
+import datetime
+import re
+import secrets
+import threading
+import time
+from typing import Callable, Optional
+
+import flask
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from google.cloud import ndb
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from . import datastore
+from . import forksafe
+
+
+SESSION_STORE_COOKIE = "cookie"
+SESSION_STORE_DATASTORE = "datastore"
+
+# Session IDs from `secrets.token_urlsafe(32)`. Anything else in the cookie
+# is ignored without a datastore lookup.
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{43}$")
+
+# The CSRF token is stored in a signed cookie with this suffix on the session
+# cookie's name.
+CSRF_COOKIE_SUFFIX = "-csrf"
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class Session(ndb.Model):
+    """Datastore model for session data. The entity ID is the session ID.
+
+    Expired sessions are ignored, delete them with a cron job that queries
+    `Session.expires`.
+    """
+
+    data = ndb.TextProperty()
+    expires = ndb.DateTimeProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
+
+
+class DatastoreSession(SessionMixin):
+    """Session data that is loaded the first time it is used.
+
+    The CSRF token (the `csrf_key` item) is kept apart from the data, and
+    using it does not load the session.
+    """
+
+    def __init__(
+        self,
+        sid: str,
+        load: Optional[Callable[[str], Optional[dict]]] = None,
+        csrf_key: Optional[str] = None,
+        csrf_token: Optional[str] = None,
+    ):
+        self.sid = sid
+        self.new = load is None
+        self.modified = False
+        self.accessed = False
+        self.csrf_key = csrf_key
+        self.csrf_token = csrf_token
+        self.csrf_modified = False
+        self.old_sid = None
+        self._load = load
+        self._data = None
+
+    @property
+    def data(self) -> dict:
+        self.accessed = True
+
+        if self._data is None:
+            data = self._load(self.sid) if self._load else None
+
+            if data is None:
+                # Never store data under a session ID chosen by the client.
+                self._data = {}
+
+                if not self.new:
+                    self.sid = new_session_id()
+                    self.new = True
+            else:
+                self._data = data
+
+        return self._data
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    def regenerate(self) -> None:
+        """Move the session data to a new session ID.
+
+        Call this when a user logs in, so an ID known before the login (for
+        example, one set by an attacker) is not valid after it.
+        """
+        data = self.data
+
+        if not self.new and self.old_sid is None:
+            self.old_sid = self.sid
+
+        self.sid = new_session_id()
+        self.new = True
+        self._data = data
+        self.modified = True
+
+    def __getitem__(self, key):
+        if key is not None and key == self.csrf_key:
+            self.accessed = True
+
+            if self.csrf_token is None:
+                raise KeyError(key)
+
+            return self.csrf_token
+
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if key is not None and key == self.csrf_key:
+            self.csrf_token = value
+            self.csrf_modified = True
+            return
+
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        if key is not None and key == self.csrf_key:
+            if self.csrf_token is None:
+                raise KeyError(key)
+
+            self.csrf_token = None
+            self.csrf_modified = True
+            return
+
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+        self.modified = True
+
+
+class DatastoreSessionInterface(SessionInterface):
+    """Flask session interface that stores sessions in the datastore.
+
+    `create_app` uses this when the "SESSION_STORE" setting is "datastore".
+
+    :param int cache_size: Number of sessions to cache in memory.
+    :param float cache_ttl: Seconds before a cached session is read again
+        from the datastore. Another instance may have changed it.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, cache_size: int = 1024, cache_ttl: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.clock = clock
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        forksafe.register(self._after_fork)
+
+    def open_session(self, app: flask.Flask, request: flask.Request) -> DatastoreSession:
+        csrf_key = app.config.get("CSRF_COOKIE_NAME", "_csrf_token")
+        csrf_token = self._read_csrf_cookie(app, request)
+        sid = request.cookies.get(self.get_cookie_name(app))
+
+        if sid and SESSION_ID_PATTERN.match(sid):
+            return DatastoreSession(sid, self.load, csrf_key=csrf_key, csrf_token=csrf_token)
+
+        return DatastoreSession(new_session_id(), csrf_key=csrf_key, csrf_token=csrf_token)
+
+    def save_session(self, app: flask.Flask, session: DatastoreSession, response: flask.Response) -> None:
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if session.csrf_modified:
+            self._save_csrf_cookie(app, session, response)
+
+        if not session.modified:
+            return
+
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.old_sid is not None:
+            self.delete(session.old_sid)
+
+        if not session:
+            if not session.new:
+                self.delete(session.sid)
+
+            if not session.new or session.old_sid is not None:
+                response.delete_cookie(name, domain=domain, path=path)
+
+            return
+
+        expires = utcnow() + app.permanent_session_lifetime
+        self.store(session.sid, dict(session), expires)
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def get_csrf_serializer(self, app: flask.Flask) -> Optional[URLSafeTimedSerializer]:
+        if not app.secret_key:
+            return None
+
+        return URLSafeTimedSerializer(app.secret_key, salt="securescaffold-session-csrf")
+
+    def _read_csrf_cookie(self, app: flask.Flask, request: flask.Request) -> Optional[str]:
+        value = request.cookies.get(self.get_cookie_name(app) + CSRF_COOKIE_SUFFIX)
+        serializer = self.get_csrf_serializer(app)
+
+        if not value or serializer is None:
+            return None
+
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+
+        try:
+            return serializer.loads(value, max_age=max_age)
+        except BadSignature:
+            return None
+
+    def _save_csrf_cookie(self, app: flask.Flask, session: DatastoreSession, response: flask.Response) -> None:
+        name = self.get_cookie_name(app) + CSRF_COOKIE_SUFFIX
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        serializer = self.get_csrf_serializer(app)
+
+        if session.csrf_token is None or serializer is None:
+            response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # A browser session cookie. Its expiry depends on the session data,
+        # which would mean loading it.
+        response.set_cookie(
+            name,
+            serializer.dumps(session.csrf_token),
+            httponly=True,
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+    def load(self, sid: str) -> Optional[dict]:
+        """Read session data from the cache, or the datastore.
+
+        :return: The data, or None if there is no such session.
+        """
+        now = self.clock()
+
+        with self._lock:
+            entry = self._cache.get(sid)
+
+            if entry is not None:
+                serialized, expires, cached_at = entry
+
+                if now - cached_at < self.cache_ttl and expires > utcnow():
+                    self._cache.move_to_end(sid)
+                    # Each request gets its own copy of the data.
+                    return self.serializer.loads(serialized)
+
+        with datastore.context():
+            obj = Session.get_by_id(sid)
+
+        if obj is None or obj.expires <= utcnow():
+            return None
+
+        self._cache_put(sid, obj.data, obj.expires)
+
+        return self.serializer.loads(obj.data)
+
+    def store(self, sid: str, data: dict, expires: datetime.datetime) -> None:
+        """Write session data to the datastore and the cache."""
+        serialized = self.serializer.dumps(data)
+
+        with datastore.context():
+            Session(id=sid, data=serialized, expires=expires).put()
+
+        self._cache_put(sid, serialized, expires)
+
+    def delete(self, sid: str) -> None:
+        with datastore.context():
+            ndb.Key(Session, sid).delete()
+
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    def _cache_put(self, sid: str, serialized: str, expires: datetime.datetime) -> None:
+        with self._lock:
+            self._cache[sid] = (serialized, expires, self.clock())
+            self._cache.move_to_end(sid)
+
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+
+
+def init_app(app: flask.Flask) -> None:
+    """Use the session store from the "SESSION_STORE" setting."""
+    store = app.config.get("SESSION_STORE", SESSION_STORE_COOKIE)
+
+    if store == SESSION_STORE_DATASTORE:
+        app.session_interface = DatastoreSessionInterface(
+            cache_size=app.config.get("SESSION_CACHE_SIZE", 1024),
+            cache_ttl=app.config.get("SESSION_CACHE_TTL", 30.0),
+        )
+    elif store != SESSION_STORE_COOKIE:
+        raise ValueError(f"Unknown SESSION_STORE: {store!r}")
+
+
+def regenerate() -> None:
+    """Give the current session a new ID, keeping its data.
+
+    Call this when a user logs in. Sessions stored in a cookie are always
+    replaced when they change, so this does nothing for those.
+    """
+    session = flask.session
+
+    if isinstance(session, DatastoreSession):
+        session.regenerate()
@@ -22,8 +22,85 @@ CSP_POLICY = flask_talisman.GOOGLE_CSP_POLICY
 CSP_POLICY_NONCE_IN = None
 CSP_POLICY_REPORT_URI = None
 CSP_POLICY_REPORT_ONLY = None
+# Add hashes of the templates' inline scripts and styles to CSP_POLICY (see
+# securescaffold.csp), so pages don't need a nonce. CSP_POLICY_SOURCES has the
+# sources found in the templates, or you can set them yourself.
+CSP_POLICY_HASH_TEMPLATES = False
+CSP_POLICY_SOURCES = None
+
+# A path (for example "/_csp-report") to receive CSP violation reports with
+# securescaffold.cspreport. It is used as CSP_POLICY_REPORT_URI, if that is
+# not set. Counts are written to "log" or "datastore" in batches.
+CSP_REPORT_URL = None
+CSP_REPORT_STORE = "log"
+CSP_REPORT_FLUSH_INTERVAL = 60
+CSP_REPORT_MAX_KEYS = 1000
+CSP_REPORT_MAX_RATE = 100
+
+# Directory (relative to the app's root path) of templates compiled with
+# `securescaffold-build templates`, or None to compile templates on first use.
+JINJA_BYTECODE_CACHE = None
 
 # These control flask-seasurf.
 CSRF_COOKIE_SECURE = True
 CSRF_COOKIE_HTTPONLY = True
 CSRF_COOKIE_TIMEOUT = datetime.timedelta(days=1)
+# "form" reads the token from the form, JSON or X-CSRFToken header. "header"
+# only reads the header, so requests are validated without reading the body.
+CSRF_MODE = "form"
+
+# These control enqueueing tasks with securescaffold.tasks.
+TASKS_QUEUE = "default"
+TASKS_LOCATION = None
+
+# The pool for securescaffold.background.run_after_response. When it is full,
+# deferrable functions are enqueued as tasks for BACKGROUND_TASKS_URL (a path
+# like "/_background", or None to run them on the request thread instead).
+BACKGROUND_MAX_WORKERS = 4
+BACKGROUND_MAX_PENDING = 100
+BACKGROUND_TASKS_URL = None
+BACKGROUND_DRAIN_TIMEOUT = 10
+
+# "cookie" for Flask's signed cookie sessions, or "datastore" for sessions
+# stored in the datastore with securescaffold.sessions.
+SESSION_STORE = "cookie"
+SESSION_CACHE_SIZE = 1024
+SESSION_CACHE_TTL = 30
+
+# Seconds between checks for settings changed in the datastore (see
+# securescaffold.liveconfig), or None to only read settings at startup.
+LIVE_CONFIG_TTL = None
+
+# Run each request in an NDB context, for views that use the datastore. Use
+# this with threaded workers, because NDB contexts belong to a thread.
+NDB_REQUEST_CONTEXT = False
+
+# Limit every request with securescaffold.ratelimit, for example "100/minute",
+# counted by user ID or client IP. Set RATE_LIMIT_REDIS_URL to share the
+# counts between instances.
+RATE_LIMIT = None
+RATE_LIMIT_REDIS_URL = None
+RATE_LIMIT_SYNC_INTERVAL = 1.0
+
+# Write logs as JSON for Cloud Logging, with the request's trace, path and
+# user ID, from a background thread (see securescaffold.logs). Records are
+# dropped when more than LOGGING_QUEUE_SIZE are waiting.
+LOGGING_JSON = False
+LOGGING_LEVEL = "INFO"
+LOGGING_QUEUE_SIZE = 10000
+
+# Verify IAP's signed header in securescaffold.contrib.appengine.users.
+IAP_AUDIENCE = None
+
+# URL prefixes rejected by securescaffold.environ.AccessMiddleware unless the
+# request is from an admin (or from the Cron / Tasks scheduler).
+ADMIN_ONLY_PREFIXES = ()
+TASKS_ONLY_PREFIXES = ()
+
+# These control outbound HTTP sessions created with `app.http`.
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 10
+HTTP_PER_HOST_LIMIT = None
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_TIMEOUT = 30
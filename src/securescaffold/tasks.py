@@ -0,0 +1,88 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Enqueue App Engine tasks with Cloud Tasks.
+
+Requires the google-cloud-tasks library, which you can install with
+`pip install securescaffold[tasks]`.
+"""
+import os
+import urllib.parse
+from typing import Optional
+
+import flask
+
+from . import forksafe
+
+try:
+    from google.cloud import tasks_v2
+except ImportError:
+    tasks_v2 = None
+
+
+_client = None
+
+
+def get_client():
+    """Get a Cloud Tasks client, created once and re-used."""
+    global _client
+
+    if tasks_v2 is None:
+        raise RuntimeError("Enqueueing tasks requires the google-cloud-tasks library")
+
+    if _client is None:
+        _client = tasks_v2.CloudTasksClient()
+
+    return _client
+
+
+def _reset_client() -> None:
+    # gRPC channels are not fork-safe, the child process creates a new client.
+    global _client
+
+    _client = None
+
+
+forksafe.register(_reset_client)
+
+
+def enqueue(relative_uri: str, params: Optional[dict] = None, queue: Optional[str] = None) -> None:
+    """Enqueue a task that POSTs form-encoded params to a URL of this app.
+
+    The queue name and location are read from the "TASKS_QUEUE" and
+    "TASKS_LOCATION" settings. The request handler for the task should be
+    decorated with `securescaffold.tasks_only`.
+    """
+    config = flask.current_app.config
+    location = config.get("TASKS_LOCATION")
+
+    if not location:
+        raise RuntimeError('Enqueueing tasks requires the "TASKS_LOCATION" setting, like "us-central1"')
+
+    client = get_client()
+    project = os.environ["GOOGLE_CLOUD_PROJECT"]
+    queue = queue or config["TASKS_QUEUE"]
+    parent = client.queue_path(project, location, queue)
+    body = urllib.parse.urlencode(params or {}).encode("utf-8")
+
+    task = {
+        "app_engine_http_request": {
+            "http_method": tasks_v2.HttpMethod.POST,
+            "relative_uri": relative_uri,
+            "headers": {"Content-Type": "application/x-www-form-urlencoded"},
+            "body": body,
+        }
+    }
+    client.create_task(parent=parent, task=task)
@@ -0,0 +1,37 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from google.cloud import ndb
+
+from securescaffold import emulator
+
+
+@pytest.fixture(scope="session")
+def datastore():
+    """Start and stop the datastore emulator."""
+    with emulator.DatastoreEmulatorForTests():
+        yield
+
+
+@pytest.fixture(scope="function")
+def ndb_client(datastore):
+    client = ndb.Client()
+
+    yield client
+
+    # Now delete all entities.
+    with client.context():
+        for key in ndb.Query().iter(keys_only=True):
+            key.delete_async()
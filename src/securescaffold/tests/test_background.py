@@ -0,0 +1,166 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+from unittest import mock
+
+import flask
+import pytest
+from google.auth import credentials as auth_credentials
+from google.cloud import ndb
+from google.cloud.ndb import context as ndb_context
+
+import securescaffold
+from securescaffold import background
+from securescaffold import datastore
+
+
+calls = []
+
+
+@background.deferrable
+def record(value):
+    calls.append(value)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    client = ndb.Client(project="test", credentials=auth_credentials.AnonymousCredentials())
+    monkeypatch.setattr(datastore, "_client", client)
+    settings = tmp_path / "settings.py"
+    settings.write_text('SECRET_KEY = "test"\nBACKGROUND_TASKS_URL = "/_background"\nBACKGROUND_MAX_WORKERS = 1\n')
+    monkeypatch.setenv("FLASK_SETTINGS_FILENAME", str(settings))
+    calls.clear()
+    app = securescaffold.create_app(__name__)
+
+    yield app
+
+    app.background.drain(5)
+
+
+def test_runs_after_response(app):
+    seen = {}
+
+    def work(value):
+        seen["value"] = value
+        seen["thread"] = threading.current_thread().name
+        seen["app"] = flask.current_app._get_current_object()
+        seen["ndb"] = ndb_context.get_context(False) is not None
+
+    @app.route("/")
+    def index():
+        background.run_after_response(work, 42)
+        assert seen == {}
+        return "ok"
+
+    response = app.test_client().get("/", base_url="https://localhost")
+    response.close()
+
+    assert response.get_data(as_text=True) == "ok"
+    assert app.background.drain(5)
+    assert seen == {"value": 42, "thread": "securescaffold-background-0", "app": app, "ndb": True}
+
+
+def test_failures_are_logged(app, caplog):
+    def fail():
+        raise ValueError("oops")
+
+    with app.app_context():
+        background.run_after_response(fail)
+
+    assert app.background.drain(5)
+    assert "oops" in caplog.text
+
+
+def test_submit_plain_function(app, caplog):
+    def fail():
+        raise ValueError("oops")
+
+    release = threading.Event()
+    fill_pool(app, release)
+
+    # The pool is full, so this runs (and fails) on this thread.
+    with app.app_context():
+        app.background.submit(fail)
+
+    release.set()
+    assert app.background.drain(5)
+    assert "running %r on the request thread" % fail in caplog.text
+    assert "Background work %r failed" % fail in caplog.text
+
+
+def fill_pool(app, release):
+    """Block the only worker, and fill the queue."""
+    app.background.max_pending = 1
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    with app.app_context():
+        app.background.submit(background.functools.partial(block))
+        started.wait(5)
+        app.background.submit(background.functools.partial(release.wait, 5))
+
+
+def test_full_pool_runs_on_request_thread(app):
+    release = threading.Event()
+    threads = []
+    fill_pool(app, release)
+
+    with app.app_context():
+        app.background.run_after_response(lambda: threads.append(threading.current_thread()))
+
+    assert threads == [threading.current_thread()]
+    release.set()
+
+
+def test_full_pool_enqueues_deferrable_functions(app):
+    release = threading.Event()
+    fill_pool(app, release)
+
+    with app.app_context(), mock.patch("securescaffold.tasks.enqueue") as enqueue:
+        app.background.run_after_response(record, "deferred")
+
+    release.set()
+    payload = json.dumps([["deferred"], {}])
+    enqueue.assert_called_once_with("/_background", {"name": f"{__name__}.record", "payload": payload})
+    assert calls == []
+
+    # The task runs the function.
+    client = app.test_client()
+    data = {"name": f"{__name__}.record", "payload": payload}
+    headers = {"X-Appengine-Queuename": "default"}
+    response = client.post("/_background", data=data, headers=headers, base_url="https://localhost")
+
+    assert response.status_code == 204
+    assert calls == ["deferred"]
+
+
+def test_task_url_is_tasks_only(app):
+    response = app.test_client().post("/_background", data={"name": "x"}, base_url="https://localhost")
+
+    assert response.status_code == 403
+
+
+def test_drain_timeout(app):
+    release = threading.Event()
+
+    with app.app_context():
+        app.background.run_after_response(release.wait, 5)
+
+    assert not app.background.drain(0.05)
+    release.set()
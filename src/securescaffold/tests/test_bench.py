@@ -0,0 +1,77 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+import werkzeug.serving
+
+from securescaffold import bench
+
+
+@pytest.fixture(scope="module")
+def app():
+    return bench.demo_app()
+
+
+def test_make_requests_is_reproducible():
+    first = bench.make_requests(100, seed=1)
+    second = bench.make_requests(100, seed=1)
+
+    assert first == second
+    assert {request.kind for request in first} == set(bench.DEFAULT_MIX)
+
+
+def test_make_requests_mix():
+    result = bench.make_requests(10, mix={"static": 1})
+
+    assert [request.path for request in result] == ["/static/app.js"] * 10
+
+
+def test_run_in_process(app):
+    request_list = bench.make_requests(200)
+
+    report = bench.run(lambda: bench.WSGIDriver(app), request_list, concurrency=2)
+
+    assert len(report.results) == 200
+    assert report.errors == []
+    summary = report.summary()
+    assert summary["all"]["count"] == 200
+    assert summary["forbidden"]["p50"] <= summary["forbidden"]["p99"]
+    assert "req/s" in report.format()
+
+
+def test_run_over_http(app):
+    server = werkzeug.serving.make_server(
+        "127.0.0.1", 0, app, threaded=True, request_handler=bench.QuietRequestHandler
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        url = f"http://127.0.0.1:{server.port}"
+        report = bench.run(lambda: bench.HTTPDriver(url), bench.make_requests(50))
+    finally:
+        server.shutdown()
+
+    assert len(report.results) == 50
+    assert report.errors == []
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert bench.percentile(values, 50) == 50
+    assert bench.percentile(values, 99) == 99
+    assert bench.percentile([], 50) == 0.0
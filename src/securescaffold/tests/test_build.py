@@ -0,0 +1,228 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gzip
+import json
+from unittest import mock
+
+import flask
+import pytest
+import yaml
+
+from securescaffold import build
+from securescaffold import caching
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def test_build_assets(tmp_path):
+    source = tmp_path / "dist"
+    output = tmp_path / "build"
+    write(source / "main.js", "console.log('hello');\n" * 10)
+    write(source / "main.css", "body { color: red; }\n")
+    write(
+        source / "index.html",
+        '<link rel="stylesheet" href="/main.css">\n<script src="/main.js"></script>\n'
+        '<script src="https://example.com/x.js"></script>\n',
+    )
+    write(source / "2" / "index.html", '<script src="../main.js"></script>\n')
+
+    manifest = build.build_assets(str(source), str(output))
+
+    js = manifest["/main.js"]
+    assert js["path"].startswith("/main.") and js["path"].endswith(".js")
+    assert js["integrity"].startswith("sha384-")
+    assert (output / js["path"][1:]).exists()
+    # The original name still works, for URLs that aren't rewritten.
+    assert (output / "main.js").read_bytes() == (source / "main.js").read_bytes()
+
+    html = (output / "index.html").read_text()
+    assert f'<script src="{js["path"]}" integrity="{js["integrity"]}"></script>' in html
+    assert manifest["/main.css"]["path"] in html
+    assert '<script src="https://example.com/x.js"></script>' in html
+
+    nested = (output / "2" / "index.html").read_text()
+    assert f'src="..{js["path"]}"' in nested
+
+    data = gzip.decompress((output / (js["path"][1:] + ".gz")).read_bytes())
+    assert data == (source / "main.js").read_bytes()
+    # The manifest is not in the directory that is served.
+    assert json.loads((tmp_path / "build.manifest.json").read_text()) == manifest
+    assert not any(path.name.startswith("manifest") for path in output.iterdir())
+
+
+def test_build_assets_rewrites_stylesheets_and_images(tmp_path):
+    source = tmp_path / "dist"
+    output = tmp_path / "build"
+    write(source / "fonts" / "a.woff2", "font")
+    write(source / "img" / "logo.png", "png")
+    write(source / "img" / "logo-2x.png", "png 2x")
+    write(source / "base.css", "body { color: red; }\n")
+    write(
+        source / "css" / "main.css",
+        '@import "../base.css";\n'
+        '@font-face { src: url("../fonts/a.woff2?v=1#x") format("woff2"); }\n'
+        ".logo { background: url(/img/logo.png); }\n"
+        ".x { background: url(data:image/png;base64,AAAA); }\n",
+    )
+    write(
+        source / "index.html",
+        '<link rel="stylesheet" href="css/main.css">\n'
+        '<img src="img/logo.png" srcset="img/logo.png 1x, img/logo-2x.png 2x" alt="">\n',
+    )
+
+    manifest = build.build_assets(str(source), str(output))
+
+    font = manifest["/fonts/a.woff2"]["path"]
+    logo = manifest["/img/logo.png"]["path"]
+    logo_2x = manifest["/img/logo-2x.png"]["path"]
+    base = manifest["/base.css"]["path"]
+    main = manifest["/css/main.css"]["path"]
+    css = (output / main[1:]).read_text()
+    assert f'@import "..{base}";' in css
+    assert f'url("..{font}?v=1#x")' in css
+    assert f"url({logo})" in css
+    assert "url(data:image/png;base64,AAAA)" in css
+    assert (output / "css" / "main.css").read_text() == css
+
+    html = (output / "index.html").read_text()
+    assert f'href="{main[1:]}" integrity="{manifest["/css/main.css"]["integrity"]}"' in html
+    assert f'<img src="{logo[1:]}" srcset="{logo[1:]} 1x, {logo_2x[1:]} 2x" alt="">' in html
+
+    # The stylesheet's name changes when a font it uses changes.
+    write(source / "fonts" / "a.woff2", "new font")
+    assert build.build_assets(str(source), str(output))["/css/main.css"]["path"] != main
+
+
+def test_build_assets_hash_changes_with_content(tmp_path):
+    source = tmp_path / "dist"
+    write(source / "main.js", "one")
+    first = build.build_assets(str(source), str(tmp_path / "build"))
+    write(source / "main.js", "two")
+    second = build.build_assets(str(source), str(tmp_path / "build"))
+
+    assert first["/main.js"]["path"] != second["/main.js"]["path"]
+
+
+def test_build_app_yaml():
+    headers = {"X-Frame-Options": "DENY"}
+    app_yaml = {
+        "runtime": "python37",
+        "handlers": [
+            {"url": "/static/", "static_dir": "dist", "secure": "always", "http_headers": headers},
+            {"url": "/.*", "script": "auto"},
+        ],
+    }
+
+    config = build.build_app_yaml(app_yaml, "dist", "build", html_expiration="5m")
+    hashed, static, script = config["handlers"]
+
+    assert config["runtime"] == "python37"
+    assert hashed["url"] == f"/static/({build.HASHED_NAME_PATTERN})$"
+    assert hashed["static_files"] == r"build/\1"
+    assert hashed["expiration"] == "365d"
+    assert static == {
+        "url": "/static/",
+        "static_dir": "build",
+        "secure": "always",
+        "http_headers": headers,
+        "expiration": "5m",
+    }
+    assert hashed["http_headers"] == headers and hashed["secure"] == "always"
+    # The catch-all script handler stays last.
+    assert script == {"url": "/.*", "script": "auto"}
+    # The handlers don't share values, which PyYAML would write as aliases.
+    assert "&id" not in yaml.safe_dump(config)
+
+
+def test_build_app_yaml_keeps_order_and_settings():
+    app_yaml = {
+        "handlers": [
+            {"url": "/$", "script": "auto"},
+            {
+                "url": "/(.*/)?$",
+                "static_files": r"dist/\1index.html",
+                "upload": "dist/.*index.html",
+                "application_readable": True,
+                "login": "admin",
+            },
+            {"url": "/other", "static_dir": "other"},
+            {"url": "/.*", "static_dir": "dist", "expiration": "1h", "redirect_http_response_code": 301},
+        ],
+    }
+
+    handlers = build.build_app_yaml(app_yaml, "dist", "build")["handlers"]
+
+    assert handlers[0] == {"url": "/$", "script": "auto"}
+    assert handlers[1] == {
+        "url": "/(.*/)?$",
+        "static_files": r"build/\1index.html",
+        "upload": "build/.*index.html",
+        "application_readable": True,
+        "login": "admin",
+        "expiration": "10m",
+    }
+    # Not built, so not changed.
+    assert handlers[2] == {"url": "/other", "static_dir": "other"}
+    assert handlers[3]["url"] == f"/({build.HASHED_NAME_PATTERN})$"
+    assert handlers[3]["redirect_http_response_code"] == 301
+    assert handlers[4] == {"url": "/.*", "static_dir": "build", "expiration": "1h", "redirect_http_response_code": 301}
+
+
+def test_main(tmp_path, monkeypatch):
+    write(tmp_path / "dist" / "index.html", "<p>Hello</p>")
+    write(tmp_path / "app.yaml", "runtime: python37\nhandlers:\n- url: /\n  static_dir: dist\n")
+    monkeypatch.chdir(tmp_path)
+
+    build.main(["assets"])
+
+    assert (tmp_path / "build" / "index.html").exists()
+    config = yaml.safe_load((tmp_path / "app.build.yaml").read_text())
+    assert config["handlers"][-1]["static_dir"] == "build"
+
+
+def test_compile_templates(tmp_path, monkeypatch):
+    write(tmp_path / "templates" / "page.html", "<p>{{ message }}</p>")
+    write(tmp_path / "templates" / "emails" / "welcome.txt", "Hello {{ name }}")
+    write(tmp_path / ".jinja-cache" / "stale.cache", "old")
+    monkeypatch.chdir(tmp_path)
+
+    build.main(["templates"])
+
+    files = sorted(path.name for path in (tmp_path / ".jinja-cache").iterdir())
+    assert len(files) == 2 and "stale.cache" not in files
+
+    # An app in another directory loads the compiled templates.
+    other = tmp_path / "deployed"
+    (tmp_path / "templates").rename(other)
+    app = flask.Flask("test", template_folder=str(other))
+    cache = caching.TemplateBytecodeCache(str(tmp_path / ".jinja-cache"))
+    app.jinja_options = {"bytecode_cache": cache}
+
+    with mock.patch.object(app.jinja_env, "compile", wraps=app.jinja_env.compile) as compile:
+        with app.app_context():
+            assert flask.render_template("page.html", message="hi") == "<p>hi</p>"
+
+    assert not compile.called
+
+
+def test_compile_templates_syntax_error(tmp_path, monkeypatch):
+    write(tmp_path / "templates" / "broken.html", "{% if %}")
+    monkeypatch.chdir(tmp_path)
+
+    with pytest.raises(SystemExit, match="broken.html:1"):
+        build.main(["templates"])
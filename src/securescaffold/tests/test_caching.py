@@ -0,0 +1,184 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+from unittest import mock
+
+import flask
+import flask_talisman
+import jinja2
+
+from securescaffold import caching
+from securescaffold import csrf
+from securescaffold import factory
+
+
+TEMPLATES = {
+    "page.html": '<script nonce="{{ csp_nonce() }}">{{ message }}</script>',
+    "form.html": "{{ csrf_token() }}",
+}
+
+
+def make_app():
+    app = flask.Flask("test")
+    app.config["SECRET_KEY"] = "test"
+    app.jinja_loader = jinja2.DictLoader(TEMPLATES)
+    caching.RenderCache(app)
+
+    config = {
+        "CSP_POLICY": {"script-src": ""},
+        "CSP_POLICY_NONCE_IN": ["script-src"],
+        "CSP_POLICY_REPORT_ONLY": None,
+        "CSP_POLICY_REPORT_URI": None,
+    }
+    talisman_kwargs = factory.get_talisman_config(config)
+    app.talisman = flask_talisman.Talisman(app, force_https=False, **talisman_kwargs)
+    app.csrf = csrf.SeaSurf(app)
+
+    @app.route("/")
+    def page():
+        message = flask.request.args.get("message", "hello")
+
+        return caching.render_template("page.html", message=message)
+
+    @app.route("/form")
+    def form():
+        return caching.render_template("form.html")
+
+    @app.route("/token-first")
+    def token_first():
+        # The view asks for the token before rendering the form.
+        app.csrf._get_token()
+
+        return caching.render_template("form.html")
+
+    return app
+
+
+def test_render_substitutes_nonce():
+    client = make_app().test_client()
+
+    for _ in range(2):
+        response = client.get("/")
+        nonce = re.search(r'nonce="(.*)"', response.get_data(as_text=True)).group(1)
+
+        assert response.status_code == 200
+        assert f"'nonce-{nonce}'" in response.headers["Content-Security-Policy"]
+        assert response.headers["ETag"].startswith('W/"')
+        assert caching.NONCE_PLACEHOLDER not in nonce
+
+
+def test_render_etag_ignores_nonce():
+    client = make_app().test_client()
+
+    first = client.get("/")
+    second = client.get("/")
+    other = client.get("/?message=bye")
+
+    assert first.get_data() != second.get_data()
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert first.headers["ETag"] != other.headers["ETag"]
+
+
+def test_conditional_get_does_not_render():
+    app = make_app()
+    client = app.test_client()
+    etag = client.get("/").headers["ETag"]
+
+    with mock.patch("flask.render_template") as render_template:
+        response = client.get("/", headers={"If-None-Match": etag})
+
+    assert not render_template.called
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    # The cached page keeps the policy (and nonce) it was sent with.
+    assert "Content-Security-Policy" not in response.headers
+    assert response.headers["X-Content-Type-Options"] == "nosniff"
+
+
+def test_render_does_not_cache_csrf_token():
+    app = make_app()
+    client = app.test_client()
+
+    client.get("/form")
+    client.get("/form")
+
+    assert app.render_cache._cache == {}
+
+
+def test_render_does_not_cache_csrf_token_requested_before_render():
+    app = make_app()
+
+    first = app.test_client().get("/token-first")
+    second = app.test_client().get("/token-first")
+
+    assert app.render_cache._cache == {}
+    assert first.get_data() != second.get_data()
+    assert "_csrf_token" in second.headers["Set-Cookie"]
+
+
+def test_render_cache_is_bounded():
+    app = make_app()
+    app.render_cache.maxsize = 2
+    client = app.test_client()
+
+    for message in ["a", "b", "c"]:
+        client.get("/", query_string={"message": message})
+
+    assert len(app.render_cache._cache) == 2
+
+
+def test_file_cache_renders_once(tmp_path):
+    path = tmp_path / "README.md"
+    path.write_text("# Hello")
+    render = mock.MagicMock(side_effect=lambda text: text.upper())
+    cache = caching.FileCache(render)
+
+    assert cache.get(str(path)) == "# HELLO"
+    assert cache.get(str(path)) == "# HELLO"
+    assert render.call_count == 1
+
+
+def test_file_cache_renders_again_when_file_changes(tmp_path):
+    path = tmp_path / "README.md"
+    path.write_text("# Hello")
+    cache = caching.FileCache(lambda text: text.upper())
+    version = cache.version(str(path))
+
+    assert cache.get(str(path)) == "# HELLO"
+
+    path.write_text("# Goodbye")
+
+    assert cache.get(str(path)) == "# GOODBYE"
+    assert cache.version(str(path)) != version
+
+
+def test_bytecode_cache_falls_back_to_compiling(tmp_path):
+    cache = caching.TemplateBytecodeCache(str(tmp_path))
+    env = jinja2.Environment(loader=jinja2.DictLoader(TEMPLATES), bytecode_cache=cache)
+
+    # Missing from the cache, then a damaged file.
+    assert env.get_template("form.html")
+    (cache_file,) = tmp_path.iterdir()
+    cache_file.write_bytes(b"damaged")
+    env.cache.clear()
+    assert env.get_template("form.html")
+
+
+def test_bytecode_cache_cannot_write(tmp_path):
+    # Like App Engine's read-only filesystem.
+    cache = caching.TemplateBytecodeCache(str(tmp_path / "missing"))
+    env = jinja2.Environment(loader=jinja2.DictLoader({"page.html": "hello"}), bytecode_cache=cache)
+
+    assert env.get_template("page.html").render() == "hello"
@@ -0,0 +1,116 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import threading
+import time
+from unittest import mock
+
+from google.auth import credentials as auth_credentials
+
+from securescaffold import credentials
+
+
+NOW = datetime.datetime(2020, 1, 1, 12, 0, 0)
+clock = [NOW]
+
+
+class FakeCredentials(auth_credentials.Credentials):
+    def __init__(self, scopes):
+        super().__init__()
+        self.scopes = scopes
+        self.refresh_count = 0
+
+    def refresh(self, request):
+        # Slow enough for other threads to pile up.
+        time.sleep(0.01)
+        self.refresh_count += 1
+        self.token = f"token-{self.refresh_count}"
+        self.expiry = clock[0] + datetime.timedelta(hours=1)
+
+
+def make_cache(**kwargs):
+    clock[0] = NOW
+    kwargs.setdefault("poll_interval", None)
+    kwargs.setdefault("clock", lambda: clock[0])
+
+    return credentials.CredentialsCache(FakeCredentials, request_factory=mock.Mock, **kwargs)
+
+
+def test_get_caches_by_scopes():
+    cache = make_cache()
+
+    creds = cache.get(["b", "a"])
+
+    assert creds.scopes == ["a", "b"]
+    assert creds.token == "token-1"
+    assert cache.get(["a", "b"]) is creds
+    assert cache.get() is not creds
+    assert creds.refresh_count == 1
+
+
+def test_get_refreshes_once_when_expired():
+    cache = make_cache()
+    creds = cache.get()
+    clock[0] += datetime.timedelta(hours=2)
+
+    threads = [threading.Thread(target=cache.get) for _ in range(10)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert creds.refresh_count == 2
+
+
+def test_refresh_due_refreshes_before_expiry():
+    cache = make_cache(refresh_ahead=300)
+    creds = cache.get()
+
+    clock[0] += datetime.timedelta(minutes=50)
+    cache.refresh_due()
+    assert creds.refresh_count == 1
+
+    clock[0] += datetime.timedelta(minutes=6)
+    cache.refresh_due()
+    assert creds.refresh_count == 2
+
+
+def test_background_thread_refreshes():
+    cache = make_cache(poll_interval=0.01, refresh_ahead=7200)
+    creds = cache.get()
+
+    try:
+        for _ in range(100):
+            if creds.refresh_count > 1:
+                break
+
+            time.sleep(0.01)
+    finally:
+        cache.stop()
+
+    assert creds.refresh_count > 1
+
+
+def test_client_is_reused():
+    cache = make_cache()
+    client_class = mock.Mock(side_effect=lambda **kwargs: mock.Mock())
+
+    client = cache.client(client_class, project="test")
+
+    assert cache.client(client_class, project="test") is client
+    assert cache.client(client_class, scopes=["a"], project="test") is not client
+    client_class.assert_any_call(credentials=cache.get(), project="test")
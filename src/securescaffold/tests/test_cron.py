@@ -0,0 +1,137 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+
+from google.cloud import ndb
+
+import securescaffold
+from securescaffold import cron
+
+
+class Widget(ndb.Model):
+    number = ndb.IntegerProperty()
+
+
+def make_job(seen, enqueued, **kwargs):
+    kwargs.setdefault("batch_size", 2)
+
+    return cron.ChunkedJob(
+        "widgets",
+        query=lambda: Widget.query().order(Widget.number),
+        process=lambda entities: seen.extend(e.number for e in entities),
+        enqueue=lambda url, params: enqueued.append((url, params)),
+        **kwargs,
+    )
+
+
+def put_widgets(ndb_client, count):
+    with ndb_client.context():
+        ndb.put_multi([Widget(number=i) for i in range(count)])
+
+
+def test_run_processes_all_entities(ndb_client):
+    put_widgets(ndb_client, 5)
+    seen, enqueued = [], []
+    job = make_job(seen, enqueued)
+    app = securescaffold.create_app("test")
+
+    with app.test_request_context("/cron"):
+        stats = job.run()
+
+    assert seen == [0, 1, 2, 3, 4]
+    assert stats["processed"] == 5
+    assert stats["chunks"] == 3
+    assert stats["done"]
+    assert enqueued == []
+
+
+def test_run_enqueues_continuation_when_time_budget_spent(ndb_client):
+    put_widgets(ndb_client, 5)
+    seen, enqueued = [], []
+    job = make_job(seen, enqueued, time_budget=0.0)
+    app = securescaffold.create_app("test")
+
+    with app.test_request_context("/cron"):
+        stats = job.run()
+
+    assert not stats["done"]
+    assert seen == []
+    assert len(enqueued) == 1
+
+    url, params = enqueued[0]
+
+    with app.test_request_context(url):
+        job.time_budget = 60.0
+        stats = job.run(params["lease"])
+
+    assert seen == [0, 1, 2, 3, 4]
+    assert stats["done"]
+
+
+def test_overlapping_run_is_skipped(ndb_client):
+    seen, enqueued = [], []
+    job = make_job(seen, enqueued)
+
+    with ndb_client.context():
+        lease_id = job.start()
+        assert lease_id
+        assert job.start() is None
+
+
+def test_expired_lease_resumes_from_cursor(ndb_client):
+    put_widgets(ndb_client, 4)
+    seen, enqueued = [], []
+    job = make_job(seen, enqueued, time_budget=60.0)
+
+    with ndb_client.context():
+        lease_id = job.start()
+        # Process the first page, then pretend the run died.
+        results, cursor, more = Widget.query().order(Widget.number).fetch_page(2)
+        job._checkpoint(lease_id, cursor, len(results), 1.0, more)
+
+        lease = cron.CronLease.get_by_id("widgets")
+        lease.lease_expires = datetime.datetime.utcnow() - datetime.timedelta(seconds=1)
+        lease.put()
+
+        new_lease_id = job.start()
+        lease = job.run_chunk(new_lease_id)
+
+        # The old run can no longer save progress.
+        assert job.run_chunk(lease_id) is None
+
+    assert new_lease_id != lease_id
+    assert seen == [2, 3]
+    assert lease.processed == 4
+    assert lease.done
+
+
+def test_register_requires_tasks_or_admin(ndb_client):
+    seen, enqueued = [], []
+    job = make_job(seen, enqueued)
+    app = securescaffold.create_app("test")
+    job.register(app, "/cron/widgets")
+    client = app.test_client()
+
+    response = client.get("/cron/widgets")
+    assert response.status_code == 403
+
+    headers = {"X-Appengine-Queuename": "__cron"}
+    response = client.get("/cron/widgets", headers=headers)
+    assert response.status_code == 200
+    assert response.json["done"]
+
+    # Tasks POST the lease ID, without a CSRF token.
+    response = client.post("/cron/widgets", headers=headers, data={"lease": "nope"})
+    assert response.status_code == 200
@@ -0,0 +1,105 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import hashlib
+
+import flask
+import flask_talisman
+import jinja2
+
+from securescaffold import csp
+from securescaffold import factory
+
+
+INLINE_SCRIPT = "\n  window.app = {};\n"
+TEMPLATES = {
+    "page.html": (
+        f"<script>{INLINE_SCRIPT}</script>\n"
+        "<style>body { color: red; }</style>\n"
+        '<script src="https://www.example.com/lib.js"></script>\n'
+        '<script src="{{ url_for(\'static\', filename=\'main.js\') }}"></script>\n'
+        '<link rel="stylesheet" href="/static/main.css">\n'
+        '<script type="application/ld+json">{"@type": "Thing"}</script>\n'
+        "<p>{{ message }}</p>\n"
+    ),
+    "dynamic.html": '<script>window.user = "{{ user }}";</script>',
+}
+
+
+def sha256(text):
+    return "'sha256-" + base64.b64encode(hashlib.sha256(text.encode()).digest()).decode() + "'"
+
+
+def make_app():
+    app = flask.Flask("test")
+    app.jinja_loader = jinja2.DictLoader(TEMPLATES)
+    app.config["CSP_POLICY"] = {"default-src": "'none'"}
+
+    return app
+
+
+def test_scan_template():
+    result = csp.scan_template(TEMPLATES["page.html"])
+
+    assert result["script-src"] == {sha256(INLINE_SCRIPT), "https://www.example.com", "'self'"}
+    assert result["style-src"] == {sha256("body { color: red; }"), "'self'"}
+
+
+def test_scan_template_skips_dynamic_inline_scripts(caplog):
+    result = csp.scan_template(TEMPLATES["dynamic.html"], "dynamic.html")
+
+    assert result == {}
+    assert "dynamic.html" in caplog.text
+
+
+def test_scan_template_external_script_integrity():
+    result = csp.scan_template('<script src="/a.js" integrity="sha384-abc"></script>')
+
+    assert result["script-src"] == {"'self'", "'sha384-abc'"}
+
+
+def test_add_sources():
+    sources = {"script-src": ["'sha256-abc'"], "style-src": ["'self'"]}
+
+    result = csp.add_sources("default-src 'self'; style-src 'none'", sources)
+
+    assert result == {
+        "default-src": "'self'",
+        "script-src": "'self' 'sha256-abc'",
+        "style-src": "'self'",
+    }
+    assert csp.add_sources({"a": "b"}, None) == {"a": "b"}
+
+
+def test_hash_templates_sets_policy():
+    app = make_app()
+    csp.hash_templates(app)
+    app.config.update(CSP_POLICY_NONCE_IN=None, CSP_POLICY_REPORT_ONLY=None, CSP_POLICY_REPORT_URI=None)
+    talisman_kwargs = factory.get_talisman_config(app.config)
+    flask_talisman.Talisman(app, force_https=False, **talisman_kwargs)
+
+    @app.route("/")
+    def page():
+        return flask.render_template("page.html", message="hello")
+
+    with app.test_client() as client:
+        response = client.get("/")
+        policy = response.headers["Content-Security-Policy"]
+
+    # The hash matches the rendered script, and is the same for every request.
+    assert sha256(INLINE_SCRIPT) in policy
+    assert f"<script>{INLINE_SCRIPT}</script>" in response.get_data(as_text=True)
+    assert "nonce" not in policy
+    assert app.config["CSP_POLICY_SOURCES"]["style-src"] == sorted([sha256("body { color: red; }"), "'self'"])
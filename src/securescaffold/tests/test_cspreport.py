@@ -0,0 +1,219 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gc
+import io
+import json
+import logging
+import weakref
+from unittest import mock
+
+import pytest
+from google.auth import credentials as auth_credentials
+from google.cloud import ndb
+
+import securescaffold
+from securescaffold import cspreport
+from securescaffold import datastore
+
+
+def csp_report(directive="script-src-elem", blocked="https://evil.example/x.js", document="https://app.example/?q=1"):
+    return {
+        "csp-report": {
+            "effective-directive": directive,
+            "blocked-uri": blocked,
+            "document-uri": document,
+        }
+    }
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    settings = tmp_path / "settings.py"
+    settings.write_text('SECRET_KEY = "test"\nCSP_REPORT_URL = "/_csp-report"\n')
+    monkeypatch.setenv("FLASK_SETTINGS_FILENAME", str(settings))
+
+    return securescaffold.create_app(__name__)
+
+
+def post(client, payload, content_type="application/csp-report"):
+    return client.post(
+        "/_csp-report", data=json.dumps(payload), content_type=content_type, base_url="https://localhost"
+    )
+
+
+def test_report_endpoint(app):
+    client = app.test_client()
+
+    # No CSRF token is needed.
+    response = post(client, csp_report())
+    post(client, csp_report())
+
+    assert response.status_code == 204
+    key = ("script-src-elem", "https://evil.example/x.js", "https://app.example/")
+    assert app.csp_reports.counts == {key: 2}
+
+
+def test_report_too_large(app):
+    client = app.test_client()
+    payload = csp_report(blocked="https://evil.example/" + "x" * cspreport.MAX_REPORT_BYTES)
+
+    response = post(client, payload)
+
+    assert response.status_code == 413
+    assert app.csp_reports.counts == {}
+
+
+def test_chunked_report_is_limited(app):
+    client = app.test_client()
+    body = json.dumps(csp_report(blocked="https://evil.example/" + "x" * cspreport.MAX_REPORT_BYTES))
+    headers = {"Transfer-Encoding": "chunked", "Content-Type": "application/csp-report"}
+
+    # Servers like gunicorn set "wsgi.input_terminated" for chunked bodies.
+    response = client.post(
+        "/_csp-report",
+        input_stream=io.BytesIO(body.encode("utf-8")),
+        headers=headers,
+        environ_base={"wsgi.input_terminated": True},
+        base_url="https://localhost",
+    )
+
+    assert response.status_code == 413
+    assert app.csp_reports.counts == {}
+
+
+def test_report_uri_is_added_to_policy(app):
+    response = app.test_client().get("/nope", base_url="https://localhost")
+
+    assert "report-uri /_csp-report" in response.headers["Content-Security-Policy"]
+
+
+def test_parse_reports():
+    reporting_api = [
+        {"type": "csp-violation", "body": {"effectiveDirective": "img-src", "blockedURL": "data", "documentURL": "/"}},
+        {"type": "deprecation", "body": {}},
+    ]
+    old_browser = csp_report(directive=None)
+    old_browser["csp-report"]["violated-directive"] = "style-src 'self'"
+
+    assert cspreport.parse_reports(json.dumps(reporting_api).encode()) == [("img-src", "data", "/")]
+    assert cspreport.parse_reports(json.dumps(old_browser).encode())[0][0] == "style-src"
+    assert cspreport.parse_reports(b"not json") == []
+    assert cspreport.parse_reports(b"[1, 2]") == []
+
+
+def test_counts_are_bounded():
+    reports = cspreport.CSPReports(max_keys=2, flush_interval=60, clock=lambda: 0.0)
+
+    reports.add([("a", "", ""), ("b", "", ""), ("c", "", ""), ("a", "", "")])
+
+    assert reports.counts == {("a", "", ""): 2, ("b", "", ""): 1}
+    assert reports.dropped == 1
+
+
+def test_sampling_under_load():
+    reports = cspreport.CSPReports(max_rate=10, clock=lambda: 5.0)
+
+    weights = [reports.sample() for _ in range(10)]
+    assert weights == [1.0] * 10
+
+    with mock.patch("random.random", return_value=0.0):
+        assert reports.sample() == pytest.approx(11 / 10)
+
+    with mock.patch("random.random", return_value=0.99):
+        assert reports.sample() == 0.0
+
+
+def test_flush_to_log(caplog):
+    now = [0.0]
+    reports = cspreport.CSPReports(flush_interval=60, clock=lambda: now[0])
+    reports.add([("a", "b", "c")] * 3)
+
+    with caplog.at_level(logging.WARNING, logger=cspreport.__name__):
+        reports.flush()
+
+    assert reports.counts == {}
+    assert len(caplog.records) == 1
+    logged = caplog.records[0].getMessage()
+    assert '"count": 3' in logged and '"directive": "a"' in logged
+
+
+def test_flush_starts_after_interval():
+    now = [0.0]
+    reports = cspreport.CSPReports(flush_interval=60, clock=lambda: now[0])
+
+    with mock.patch("threading.Thread") as thread, mock.patch("threading.Timer"):
+        reports.add([("a", "b", "c")])
+        assert not thread.called
+
+        now[0] = 61.0
+        reports.add([("a", "b", "c")])
+        reports.add([("a", "b", "c")])
+
+    # One flush in the background, until it finishes.
+    assert thread.call_count == 1
+    assert thread.call_args.kwargs["target"] == reports._flush_in_background
+
+
+def test_flush_to_datastore(monkeypatch):
+    client = ndb.Client(project="test", credentials=auth_credentials.AnonymousCredentials())
+    monkeypatch.setattr(datastore, "_client", client)
+    reports = cspreport.CSPReports(store="datastore")
+    reports.add([("a", "b", "c"), ("d", "e", "f")])
+
+    with client.context():
+        existing = cspreport.CSPViolation(key=cspreport.CSPViolation.key_for(("a", "b", "c")), count=5)
+
+    with mock.patch("google.cloud.ndb.get_multi", return_value=[existing, None]), mock.patch(
+        "google.cloud.ndb.put_multi"
+    ) as put_multi:
+        reports.flush()
+
+    entities = put_multi.call_args[0][0]
+    assert [entity.count for entity in entities] == [6, 1]
+    assert entities[1].directive == "d"
+
+
+def test_flush_on_timer():
+    now = [0.0]
+    reports = cspreport.CSPReports(flush_interval=60, clock=lambda: now[0])
+
+    with mock.patch("threading.Timer") as timer:
+        reports.add([("a", "b", "c")])
+        reports.add([("a", "b", "c")])
+
+    # One timer, for when the interval ends.
+    assert timer.call_count == 1
+    delay, callback = timer.call_args[0]
+    assert delay == 60
+
+    now[0] = 60.0
+
+    with mock.patch.object(reports, "flush") as flush:
+        callback()
+
+    assert flush.called
+    assert reports._timer is None
+    assert reports._next_flush == 120.0
+
+
+def test_flush_at_exit_does_not_keep_instances():
+    reports = cspreport.CSPReports()
+    ref = weakref.ref(reports)
+    assert reports in cspreport._instances
+
+    del reports
+    gc.collect()
+
+    assert ref() is None
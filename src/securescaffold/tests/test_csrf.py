@@ -0,0 +1,107 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+from unittest import mock
+
+import flask
+import pytest
+
+from securescaffold import csrf
+
+
+def make_app(mode):
+    app = flask.Flask("test")
+    app.config["SECRET_KEY"] = "test"
+    app.config["CSRF_MODE"] = mode
+    app.csrf = csrf.SeaSurf(app)
+
+    @app.route("/upload", methods=["GET", "POST"])
+    def upload():
+        if flask.request.method == "GET":
+            return flask.render_template_string("{{ csrf_token() }}")
+
+        return str(len(flask.request.stream.read()))
+
+    return app
+
+
+def get_token(client, **kwargs):
+    return client.get("/upload", **kwargs).get_data(as_text=True)
+
+
+def upload_data(token=None):
+    data = {"file": (io.BytesIO(b"x" * 1024), "file.txt")}
+
+    if token:
+        data["_csrf_token"] = token
+
+    return data
+
+
+def test_form_mode_reads_token_from_form():
+    client = make_app("form").test_client()
+    token = get_token(client)
+
+    response = client.post("/upload", data=upload_data(token))
+
+    assert response.status_code == 200
+
+
+def test_header_mode_rejects_without_reading_body():
+    client = make_app("header").test_client()
+    token = get_token(client)
+
+    with mock.patch.object(flask.Request, "_load_form_data") as load_form_data:
+        # A token in the form is ignored.
+        response = client.post("/upload", data=upload_data(token))
+        assert response.status_code == 403
+
+        response = client.post("/upload", data=upload_data(), headers={"X-CSRFToken": "wrong"})
+        assert response.status_code == 403
+
+    assert not load_form_data.called
+
+
+def test_header_mode_streams_upload():
+    client = make_app("header").test_client()
+    token = get_token(client)
+
+    response = client.post(
+        "/upload",
+        data=b"y" * 4096,
+        content_type="application/octet-stream",
+        headers={"X-CSRFToken": token},
+    )
+
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == "4096"
+
+
+def test_header_mode_checks_referer_for_https():
+    client = make_app("header").test_client()
+    token = get_token(client, base_url="https://example.com")
+    kwargs = {"data": b"", "base_url": "https://example.com"}
+
+    response = client.post("/upload", headers={"X-CSRFToken": token}, **kwargs)
+    assert response.status_code == 403
+
+    headers = {"X-CSRFToken": token, "Referer": "https://example.com/upload"}
+    response = client.post("/upload", headers=headers, **kwargs)
+    assert response.status_code == 200
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        make_app("cookie")
@@ -0,0 +1,171 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import flask
+from google.auth import credentials as auth_credentials
+from google.cloud import ndb
+from google.cloud.ndb import context as ndb_context
+
+from securescaffold import datastore
+
+
+def test_init_request_context(monkeypatch):
+    # Creating a context does not connect to the datastore.
+    client = ndb.Client(project="test", credentials=auth_credentials.AnonymousCredentials())
+    monkeypatch.setattr(datastore, "_client", client)
+
+    app = flask.Flask(__name__)
+    datastore.init_request_context(app)
+
+    @app.route("/")
+    def view():
+        return {"context": ndb_context.get_context(False) is not None}
+
+    # Each request thread gets its own context.
+    results = []
+    client = app.test_client()
+    threads = [threading.Thread(target=lambda: results.append(client.get("/").json)) for _ in range(4)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert results == [{"context": True}] * 4
+    assert ndb_context.get_context(False) is None
+
+
+class Model(ndb.Model):
+    pass
+
+
+class FakeFuture:
+    def __init__(self, value, on_result):
+        self.value = value
+        self.on_result = on_result
+
+    def result(self):
+        self.on_result()
+        return self.value
+
+
+def fake_client(monkeypatch):
+    client = ndb.Client(project="test", credentials=auth_credentials.AnonymousCredentials())
+    monkeypatch.setattr(datastore, "_client", client)
+
+    return client
+
+
+def test_loader_batches_and_caches_reads(monkeypatch):
+    client = fake_client(monkeypatch)
+    calls = []
+
+    def get_multi(keys):
+        calls.append(keys)
+        return [Model(key=key) for key in keys]
+
+    monkeypatch.setattr(ndb, "get_multi", get_multi)
+    app = flask.Flask(__name__)
+
+    with client.context(), app.test_request_context():
+        loader = datastore.get_loader()
+        assert datastore.get_loader() is loader
+
+        a = loader.load(ndb.Key(Model, "a"))
+        b = loader.load(ndb.Key(Model, "b"))
+        b_again = loader.load(ndb.Key(Model, "b"))
+        assert calls == []
+
+        assert a.result().key.id() == "a"
+        assert b_again.result() is b.result()
+        assert loader.get(ndb.Key(Model, "a")) is a.result()
+        assert [e.key.id() for e in loader.get_multi([ndb.Key(Model, "c"), ndb.Key(Model, "a")])] == ["c", "a"]
+
+        # One read for a and b, one for c.
+        assert calls == [[ndb.Key(Model, "a"), ndb.Key(Model, "b")], [ndb.Key(Model, "c")]]
+
+
+def test_loader_reads_cleared_key_again(monkeypatch):
+    client = fake_client(monkeypatch)
+    calls = []
+
+    def get_multi(keys):
+        calls.append(keys)
+        return [Model(key=key) for key in keys]
+
+    monkeypatch.setattr(ndb, "get_multi", get_multi)
+    app = flask.Flask(__name__)
+
+    with client.context(), app.test_request_context():
+        loader = datastore.get_loader()
+        key = ndb.Key(Model, "a")
+        result = loader.load(key)
+        first = result.result()
+
+        loader.clear(key)
+        assert result.result() is not first
+
+        loader.clear()
+        assert result.result().key == key
+        assert calls == [[key], [key], [key]]
+
+
+def test_put_multi_in_chunks(monkeypatch):
+    client = fake_client(monkeypatch)
+    outstanding = set()
+    chunks = []
+
+    def put_multi_async(entities):
+        # Never more than max_parallel chunks at once.
+        assert len(outstanding) < 2
+        chunk = len(chunks)
+        chunks.append(len(entities))
+        outstanding.add(chunk)
+
+        return [FakeFuture(entity.key, lambda: outstanding.discard(chunk)) for entity in entities]
+
+    monkeypatch.setattr(ndb, "put_multi_async", put_multi_async)
+    app = flask.Flask(__name__)
+
+    with client.context(), app.test_request_context():
+        entities = [Model(key=ndb.Key(Model, i)) for i in range(1, 12)]
+        loader = datastore.get_loader()
+        keys = datastore.put_multi(entities, chunk_size=3, max_parallel=2)
+
+        assert keys == [entity.key for entity in entities]
+        # Written entities are cached for the rest of the request.
+        assert loader.get(ndb.Key(Model, 5)) is entities[4]
+
+    assert chunks == [3, 3, 3, 2]
+    assert outstanding == set()
+
+
+def test_delete_multi_in_chunks(monkeypatch):
+    client = fake_client(monkeypatch)
+    chunks = []
+
+    def delete_multi_async(keys):
+        chunks.append(list(keys))
+        return [FakeFuture(None, lambda: None) for _ in keys]
+
+    monkeypatch.setattr(ndb, "delete_multi_async", delete_multi_async)
+
+    with client.context():
+        keys = [ndb.Key(Model, i) for i in range(1, 1002)]
+        datastore.delete_multi(keys)
+
+    assert [len(chunk) for chunk in chunks] == [500, 500, 1]
@@ -0,0 +1,328 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from securescaffold import emulator
+
+
+# Stands in for `gcloud beta emulators datastore start`. The mode is set with
+# the FAKE_GCLOUD_MODE environment variable.
+FAKE_GCLOUD = """\
+import http.server
+import os
+import signal
+import sys
+import threading
+import time
+
+mode = os.environ.get("FAKE_GCLOUD_MODE", "ok")
+args = sys.argv[1:]
+host, _, port = args[args.index("--host-port") + 1].partition(":")
+# Like the emulator, data is loaded at startup and saved at shutdown.
+db_path = None
+data = b""
+
+if "--store-on-disk" in args:
+    db_path = os.path.join(args[args.index("--data-dir") + 1], "WEB-INF", "appengine-generated", "local_db.bin")
+
+    if os.path.exists(db_path):
+        with open(db_path, "rb") as fh:
+            data = fh.read()
+
+if mode == "stall":
+    time.sleep(60)
+    sys.exit(0)
+
+if mode == "fail":
+    print("ERROR: (gcloud) Something went wrong", file=sys.stderr)
+    sys.exit(1)
+
+if mode == "ignore-term":
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/data":
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        if mode == "chatty":
+            for _ in range(1000):
+                print("[datastore] Lots of logging, " * 4, file=sys.stderr)
+
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"Ok")
+
+    def do_POST(self):
+        global data
+
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+        if self.path == "/data":
+            data += self.rfile.read(int(self.headers["Content-Length"]))
+            return
+
+        if db_path:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+
+            with open(db_path, "wb") as fh:
+                fh.write(data)
+
+        if mode != "ignore-term":
+            threading.Thread(target=server.shutdown).start()
+
+    def log_message(self, *args):
+        pass
+
+
+server = http.server.HTTPServer((host, int(port or 0)), Handler)
+print(f"[datastore] API endpoint: http://{host}:{server.server_port}", file=sys.stderr, flush=True)
+server.serve_forever()
+"""
+
+
+@pytest.fixture
+def fake_gcloud(tmp_path, monkeypatch):
+    path = tmp_path / "gcloud"
+    path.write_text(f"#!{sys.executable}\n" + FAKE_GCLOUD)
+    path.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tmp_path) + os.pathsep + os.environ["PATH"])
+
+    def set_mode(mode):
+        monkeypatch.setenv("FAKE_GCLOUD_MODE", mode)
+
+    return set_mode
+
+
+# Writes fixture data with the emulator's environment variables.
+FIXTURE = """\
+import os
+import urllib.request
+
+req = urllib.request.Request(os.environ["DATASTORE_HOST"] + "/data", data=b"fixture", method="POST")
+urllib.request.urlopen(req, timeout=5).close()
+"""
+
+
+def get(emulator_env, path="/"):
+    with urllib.request.urlopen(emulator_env["DATASTORE_HOST"] + path, timeout=5) as response:
+        return response.read()
+
+
+def post_data(emulator_env, data):
+    req = urllib.request.Request(emulator_env["DATASTORE_HOST"] + "/data", data=data, method="POST")
+    urllib.request.urlopen(req, timeout=5).close()
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="Requires a POSIX shell")
+class TestDatastoreEmulator:
+    def test_start_and_stop(self, fake_gcloud):
+        fake_gcloud("ok")
+        environ = {}
+        obj = emulator.DatastoreEmulatorForTests(environ=environ, timeout=10)
+
+        with obj:
+            assert environ["DATASTORE_PROJECT_ID"] == "in-memory-test"
+            assert get(environ) == b"Ok"
+            proc = obj._proc
+
+        assert proc.returncode is not None
+        assert obj._proc is None
+
+    def test_start_timeout(self, fake_gcloud):
+        fake_gcloud("stall")
+        obj = emulator.DatastoreEmulatorForTests(environ=None, timeout=0.5)
+        start = time.monotonic()
+
+        with pytest.raises(RuntimeError, match="Timed out"):
+            obj.start()
+
+        assert time.monotonic() - start < 15
+        assert obj._proc is None
+
+    def test_start_failure_includes_output(self, fake_gcloud):
+        fake_gcloud("fail")
+        obj = emulator.DatastoreEmulatorForTests(environ=None, timeout=10)
+
+        with pytest.raises(RuntimeError, match="Something went wrong"):
+            obj.start()
+
+    def test_output_is_drained(self, fake_gcloud):
+        # Each request logs more than fits in a pipe buffer.
+        fake_gcloud("chatty")
+
+        with emulator.DatastoreEmulatorForTests(environ=None, timeout=10) as obj:
+            for _ in range(5):
+                assert get(obj.env) == b"Ok"
+
+        assert len(obj.output) == obj.output_lines
+
+    def test_stop_kills_unresponsive_emulator(self, fake_gcloud):
+        fake_gcloud("ignore-term")
+        obj = emulator.DatastoreEmulatorForTests(environ=None, timeout=10)
+        obj.start()
+        proc = obj._proc
+
+        obj.stop(timeout=0.5)
+
+        assert proc.returncode is not None
+
+    def test_start_emulators(self, fake_gcloud):
+        fake_gcloud("ok")
+        emulators = emulator.start_emulators(2, timeout=10)
+
+        try:
+            hosts = {obj.env["DATASTORE_HOST"] for obj in emulators}
+            assert len(hosts) == 2
+            assert all(os.path.isdir(obj.data_dir) for obj in emulators)
+
+            for obj in emulators:
+                assert get(obj.env) == b"Ok"
+        finally:
+            for obj in emulators:
+                obj.stop()
+
+        assert not any(os.path.exists(obj.data_dir) for obj in emulators)
+
+    def test_build_snapshot(self, fake_gcloud, tmp_path):
+        fake_gcloud("ok")
+        fixture = tmp_path / "fixture.py"
+        fixture.write_text(FIXTURE)
+        snapshot = tmp_path / "snapshot"
+
+        assert emulator.build_snapshot(str(snapshot), str(fixture), timeout=10)
+
+        db_path = snapshot / "WEB-INF" / "appengine-generated" / "local_db.bin"
+        assert db_path.read_bytes() == b"fixture"
+        assert emulator.snapshot_is_current(str(snapshot), str(fixture))
+        # Not rebuilt until the fixture changes.
+        assert not emulator.build_snapshot(str(snapshot), str(fixture), timeout=10)
+
+        fixture.write_text(FIXTURE.replace("fixture", "changed"))
+
+        assert not emulator.snapshot_is_current(str(snapshot), str(fixture))
+        assert emulator.build_snapshot(str(snapshot), str(fixture), timeout=10)
+        assert db_path.read_bytes() == b"changed"
+        assert [p.name for p in tmp_path.iterdir() if p.name.startswith(".snapshot-")] == []
+
+    def test_build_snapshot_failure_keeps_old_snapshot(self, fake_gcloud, tmp_path):
+        fake_gcloud("ok")
+        snapshot = tmp_path / "snapshot"
+        emulator.build_snapshot(str(snapshot), lambda obj: post_data(obj.env, b"old"), timeout=10)
+
+        def fixture(obj):
+            raise ValueError("Bad fixture")
+
+        with pytest.raises(ValueError):
+            emulator.build_snapshot(str(snapshot), fixture, timeout=10)
+
+        assert (snapshot / "WEB-INF" / "appengine-generated" / "local_db.bin").read_bytes() == b"old"
+        assert [p.name for p in tmp_path.iterdir() if p.name.startswith(".snapshot-")] == []
+
+    def test_start_from_snapshot(self, fake_gcloud, tmp_path):
+        fake_gcloud("ok")
+        snapshot = tmp_path / "snapshot"
+        emulator.build_snapshot(str(snapshot), lambda obj: post_data(obj.env, b"fixture"), timeout=10)
+        obj = emulator.DatastoreEmulatorForTests(environ=None, timeout=10, snapshot=str(snapshot))
+
+        for _ in range(2):
+            # Each start begins with the snapshot's data.
+            with obj:
+                assert get(obj.env, "/data") == b"fixture"
+                post_data(obj.env, b" and more")
+                data_dir = obj.data_dir
+
+            assert not os.path.exists(data_dir)
+
+        assert (snapshot / "WEB-INF" / "appengine-generated" / "local_db.bin").read_bytes() == b"fixture"
+
+    def test_start_emulators_from_snapshot(self, fake_gcloud, tmp_path):
+        fake_gcloud("ok")
+        snapshot = tmp_path / "snapshot"
+        emulator.build_snapshot(str(snapshot), lambda obj: post_data(obj.env, b"fixture"), timeout=10)
+        emulators = emulator.start_emulators(2, timeout=10, snapshot=str(snapshot))
+
+        try:
+            assert [get(obj.env, "/data") for obj in emulators] == [b"fixture", b"fixture"]
+        finally:
+            for obj in emulators:
+                obj.stop()
+
+    def test_start_from_snapshot_for_other_project(self, fake_gcloud, tmp_path):
+        fake_gcloud("ok")
+        snapshot = tmp_path / "snapshot"
+        emulator.build_snapshot(str(snapshot), lambda obj: None, timeout=10, project="other")
+        obj = emulator.DatastoreEmulatorForTests(environ=None, timeout=10, snapshot=str(snapshot))
+
+        with pytest.raises(RuntimeError, match="'other'"):
+            obj.start()
+
+        assert obj._proc is None
+        assert obj._temp_dir is None
+
+    @pytest.mark.skipif(emulator.fcntl is None, reason="Requires fcntl")
+    def test_concurrent_builds(self, fake_gcloud, tmp_path):
+        fake_gcloud("ok")
+        fixture = tmp_path / "fixture.py"
+        runs = tmp_path / "runs.txt"
+        fixture.write_text(FIXTURE + f"\nwith open({str(runs)!r}, 'a') as fh:\n    fh.write('run\\n')\n")
+        snapshot = tmp_path / "snapshot"
+        results = []
+
+        def build():
+            results.append(emulator.build_snapshot(str(snapshot), str(fixture), timeout=10))
+
+        threads = [threading.Thread(target=build) for _ in range(3)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        assert sorted(results) == [False, False, True]
+        assert runs.read_text() == "run\n"
+
+    def test_snapshot_and_data_dir(self, tmp_path):
+        with pytest.raises(ValueError):
+            emulator.DatastoreEmulatorForTests(snapshot=str(tmp_path), data_dir=str(tmp_path))
+
+
+def test_clone_snapshot(tmp_path):
+    snapshot = tmp_path / "snapshot"
+    (snapshot / "WEB-INF").mkdir(parents=True)
+    (snapshot / "WEB-INF" / "local_db.bin").write_bytes(b"data")
+    (snapshot / "env.yaml").write_text("project: test")
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+
+    emulator.clone_snapshot(str(snapshot), str(data_dir))
+
+    assert (data_dir / "WEB-INF" / "local_db.bin").read_bytes() == b"data"
+    assert (data_dir / "env.yaml").read_text() == "project: test"
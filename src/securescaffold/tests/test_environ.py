@@ -12,9 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from unittest import mock
+
 import flask
 
 import securescaffold
+from securescaffold import environ
 
 
 def test_tasks_only_allowed():
@@ -65,3 +68,73 @@ def test_admin_only_not_allowed():
     response = app.test_client().get("/", headers=headers)
 
     assert response.status_code == 403
+
+
+def middleware_app():
+    app = flask.Flask("test")
+    app.add_url_rule("/admin", "admin", securescaffold.admin_only(lambda: "admin"))
+    app.add_url_rule("/tasks", "tasks", securescaffold.tasks_only(lambda: "tasks"))
+    app.add_url_rule("/public", "public", lambda: "public")
+    app.config["TASKS_ONLY_PREFIXES"] = ["/_ah/queue/"]
+    app.wsgi_app = environ.AccessMiddleware(app.wsgi_app, app)
+
+    return app
+
+
+def test_protected_paths():
+    app = middleware_app()
+    app.add_url_rule("/admin/<name>", "admin_name", securescaffold.admin_only(lambda name: ""))
+
+    result = environ.protected_paths(app)
+
+    assert result == {
+        ("/admin", "GET"): environ.ROLE_ADMIN,
+        ("/admin", "HEAD"): environ.ROLE_ADMIN,
+        ("/admin", "OPTIONS"): environ.ROLE_ADMIN,
+        ("/tasks", "GET"): environ.ROLE_TASKS,
+        ("/tasks", "HEAD"): environ.ROLE_TASKS,
+        ("/tasks", "OPTIONS"): environ.ROLE_TASKS,
+    }
+
+
+def test_access_middleware_checks_method():
+    app = middleware_app()
+    app.add_url_rule("/item", "item", lambda: "item")
+    app.add_url_rule("/item", "edit_item", securescaffold.admin_only(lambda: "edited"), methods=["POST"])
+    client = app.test_client()
+
+    assert client.get("/item").status_code == 200
+    assert client.post("/item").status_code == 403
+    assert client.post("/item", headers=[("X-Appengine-User-Is-Admin", "1")]).status_code == 200
+
+
+def test_access_middleware_rejects_before_routing():
+    app = middleware_app()
+    client = app.test_client()
+
+    with mock.patch.object(app, "full_dispatch_request") as dispatch:
+        for path in ["/admin", "/tasks", "/_ah/queue/foo"]:
+            response = client.get(path, headers=[("X-Appengine-User-Is-Admin", "0")])
+            assert response.status_code == 403
+
+        response = client.get("/admin", headers=[("X-Appengine-Queuename", "__cron")])
+        assert response.status_code == 403
+
+    assert not dispatch.called
+
+
+def test_access_middleware_allows_authorized_requests():
+    app = middleware_app()
+    client = app.test_client()
+
+    response = client.get("/admin", headers=[("X-Appengine-User-Is-Admin", "1")])
+    assert response.get_data(as_text=True) == "admin"
+
+    response = client.get("/tasks", headers=[("X-Appengine-Queuename", "__cron")])
+    assert response.get_data(as_text=True) == "tasks"
+
+    response = client.get("/public")
+    assert response.get_data(as_text=True) == "public"
+
+    response = client.get("/_ah/queue/foo", headers=[("X-Appengine-Queuename", "default")])
+    assert response.status_code == 404
@@ -14,31 +14,9 @@
 
 from unittest import mock
 
-import pytest
 from flask import Flask
-from google.cloud import ndb
 
 from securescaffold import factory
-from securescaffold import emulator
-
-
-@pytest.fixture(scope="session")
-def datastore():
-    """Start and stop the datastore emulator."""
-    with emulator.DatastoreEmulatorForTests():
-        yield
-
-
-@pytest.fixture(scope="function")
-def ndb_client(datastore):
-    client = ndb.Client()
-
-    yield client
-
-    # Now delete all entities.
-    with client.context():
-        for key in ndb.Query().iter(keys_only=True):
-            key.delete_async()
 
 
 def test_create_app_returns_an_app(ndb_client):
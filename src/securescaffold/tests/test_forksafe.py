@@ -0,0 +1,138 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import pickle
+from unittest import mock
+
+import pytest
+from google.auth import credentials as auth_credentials
+from google.cloud import ndb
+
+import securescaffold
+from securescaffold import datastore
+from securescaffold import factory
+from securescaffold import forksafe
+
+
+class Resource:
+    def __init__(self):
+        self.calls = 0
+        forksafe.register(self._after_fork)
+
+    def _after_fork(self):
+        self.calls += 1
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    settings = tmp_path / "settings.py"
+    settings.write_text('SECRET_KEY = "test"\n')
+    monkeypatch.setenv("FLASK_SETTINGS_FILENAME", str(settings))
+
+    app = securescaffold.create_app(__name__)
+    app.add_url_rule("/admin", "admin", securescaffold.admin_only(lambda: "admin"))
+
+    return app
+
+
+def test_after_fork_in_child_calls_callbacks():
+    resource = Resource()
+
+    forksafe.after_fork_in_child()
+
+    assert resource.calls == 1
+
+
+def test_register_does_not_keep_objects_alive():
+    resource = Resource()
+    count = len(forksafe._callbacks)
+
+    del resource
+    Resource()
+
+    assert len(forksafe._callbacks) == count
+
+
+def test_after_fork_in_child_resets_clients():
+    datastore._client = object()
+
+    forksafe.after_fork_in_child()
+
+    assert datastore._client is None
+
+
+def test_prepare_app(app):
+    middleware = app.extensions["securescaffold.access"]
+    assert middleware._paths is None
+
+    securescaffold.prepare_app(app)
+
+    assert middleware._paths[("/admin", "GET")] == "admin"
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires os.fork")
+def test_fork(app):
+    securescaffold.prepare_app(app)
+    adapter = app.http.adapter
+    session = app.http.session()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:  # pragma: no cover
+        # The child process. Report back to the parent and exit immediately.
+        os.close(read_fd)
+        result = {
+            "adapter": app.http.adapter is not adapter,
+            "session": app.http.session() is not session,
+            "paths": app.extensions["securescaffold.access"]._paths is not None,
+        }
+
+        with os.fdopen(write_fd, "wb") as fh:
+            pickle.dump(result, fh)
+
+        os._exit(0)
+
+    os.close(write_fd)
+
+    with os.fdopen(read_fd, "rb") as fh:
+        result = pickle.load(fh)
+
+    os.waitpid(pid, 0)
+
+    assert result == {"adapter": True, "session": True, "paths": True}
+    # The parent process is unchanged.
+    assert app.http.adapter is adapter
+
+
+def test_startup_read_does_not_keep_a_client(monkeypatch):
+    clients = []
+    client_class = ndb.Client
+
+    def make_client():
+        client = client_class(project="test", credentials=auth_credentials.AnonymousCredentials())
+        client.stub = mock.Mock(wraps=client.stub)
+        clients.append(client)
+
+        return client
+
+    monkeypatch.setattr(factory.ndb, "Client", make_client)
+    monkeypatch.setattr(factory.AppConfig, "singleton", classmethod(lambda cls: factory.AppConfig(secret_key="k")))
+    monkeypatch.setattr(datastore, "_client", None)
+
+    factory.get_config_from_datastore()
+
+    assert len(clients) == 1
+    assert clients[0].stub.close.called
+    assert datastore._client is None
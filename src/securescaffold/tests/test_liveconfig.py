@@ -0,0 +1,204 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+from unittest import mock
+
+import flask
+import pytest
+
+import securescaffold
+from securescaffold import datastore
+from securescaffold import factory
+from securescaffold import liveconfig
+
+
+class FakeStore:
+    """Stands in for the AppConfig and AppConfigVersion entities."""
+
+    def __init__(self):
+        self.version = 0
+        self.settings = {}
+        self.version_reads = 0
+        self.clients = []
+
+    def update(self, **values):
+        self.settings.update(values)
+        self.version += 1
+
+    def fetch_version(self, client=None):
+        self.version_reads += 1
+        self.clients.append(client)
+        return self.version
+
+    def fetch_settings(self, client=None):
+        return self.version, dict(self.settings)
+
+
+@pytest.fixture
+def ndb_clients(monkeypatch):
+    """The NDB clients created by LiveConfig."""
+    clients = []
+
+    def make_client():
+        client = mock.Mock()
+        clients.append(client)
+
+        return client
+
+    monkeypatch.setattr(liveconfig.ndb, "Client", make_client)
+
+    return clients
+
+
+@pytest.fixture
+def store(monkeypatch, ndb_clients):
+    store = FakeStore()
+    monkeypatch.setattr(liveconfig.LiveConfig, "_fetch_version", store.fetch_version)
+    monkeypatch.setattr(liveconfig.LiveConfig, "_fetch_settings", store.fetch_settings)
+
+    return store
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, store):
+    monkeypatch.setattr(datastore, "_client", None)
+    settings = tmp_path / "settings.py"
+    settings.write_text('SECRET_KEY = "test"\nLIVE_CONFIG_TTL = 30\nFEATURE = "old"\n')
+    monkeypatch.setenv("FLASK_SETTINGS_FILENAME", str(settings))
+    store.update(CSP_POLICY={"default-src": "'self'"})
+
+    app = securescaffold.create_app(__name__)
+
+    @app.route("/")
+    def index():
+        return liveconfig.get_config()["FEATURE"]
+
+    return app
+
+
+def wait_for_version(live_config, version):
+    for _ in range(100):
+        if live_config.version == version:
+            return
+
+        time.sleep(0.01)
+
+
+def test_overrides_apply_at_startup(app):
+    client = app.test_client()
+
+    response = client.get("/", base_url="https://localhost")
+
+    assert response.get_data(as_text=True) == "old"
+    assert response.headers["Content-Security-Policy"] == "default-src 'self'"
+    assert app.live_config.snapshot["SECRET_KEY"] == "test"
+
+
+def test_startup_read_does_not_keep_a_client(app, store, ndb_clients):
+    # The first read happens in create_app, which may be before a fork, so
+    # it uses its own client and doesn't create the shared one.
+    assert store.clients == ndb_clients
+    assert ndb_clients[0].stub.close.called
+    assert datastore._client is None
+
+    # Later reads use the shared client.
+    app.live_config.refresh()
+    assert store.clients[-1] is None
+
+
+def test_snapshot_is_read_only(app):
+    with pytest.raises(TypeError):
+        app.live_config.snapshot["FEATURE"] = "new"
+
+
+def test_update_base_keeps_overrides(app):
+    app.live_config.update_base({"FEATURE": "base", "CSP_POLICY_SOURCES": {"script-src": ["'sha256-abc'"]}})
+
+    assert app.live_config.snapshot["FEATURE"] == "base"
+    # The datastore's CSP_POLICY still wins, with the sources added to it.
+    policy = app.talisman.content_security_policy
+    assert policy == {"default-src": "'self'", "script-src": "'self' 'sha256-abc'"}
+
+
+def test_refresh_after_ttl(app, store):
+    client = app.test_client()
+    now = [0.0]
+    app.live_config.clock = lambda: now[0]
+    app.live_config._next_check = 30.0
+    store.update(FEATURE="new", CSP_POLICY={"default-src": "'none'"})
+
+    # Before the TTL, the version is not checked.
+    reads = store.version_reads
+    client.get("/", base_url="https://localhost")
+    assert store.version_reads == reads
+
+    now[0] = 31.0
+    client.get("/", base_url="https://localhost")
+    wait_for_version(app.live_config, store.version)
+
+    response = client.get("/", base_url="https://localhost")
+    assert response.get_data(as_text=True) == "new"
+    assert response.headers["Content-Security-Policy"] == "default-src 'none'"
+
+
+def test_unchanged_version_does_not_read_settings(app, store):
+    with mock.patch.object(liveconfig.LiveConfig, "_fetch_settings") as fetch_settings:
+        assert app.live_config.refresh() is False
+
+    assert not fetch_settings.called
+
+
+def test_request_sees_one_snapshot(app, store):
+    with app.test_request_context():
+        app.preprocess_request()
+        store.update(FEATURE="new")
+        app.live_config.refresh()
+
+        assert liveconfig.get_config()["FEATURE"] == "old"
+
+    with app.test_request_context():
+        app.preprocess_request()
+
+        assert liveconfig.get_config()["FEATURE"] == "new"
+
+
+def test_refresh_failure_keeps_snapshot(app, store):
+    snapshot = app.live_config.snapshot
+
+    with mock.patch.object(liveconfig.LiveConfig, "_fetch_version", side_effect=RuntimeError):
+        app.live_config._refresh_in_background()
+
+    assert app.live_config.snapshot is snapshot
+    assert not app.live_config._checking
+
+
+def test_get_config_without_live_config():
+    app = flask.Flask(__name__)
+    app.config["FEATURE"] = "value"
+
+    with app.app_context():
+        assert liveconfig.get_config()["FEATURE"] == "value"
+
+
+def test_update_settings(ndb_client):
+    with ndb_client.context():
+        version = factory.AppConfig.update_settings({"FEATURE": "new", "OTHER": 1})
+        version = factory.AppConfig.update_settings(remove=["OTHER"])
+        obj = factory.AppConfig.get_by_id(factory.AppConfig.SINGLETON_ID)
+        version_obj = factory.AppConfigVersion.get_by_id(factory.AppConfig.SINGLETON_ID)
+
+    assert obj.settings == {"FEATURE": "new"}
+    assert obj.secret_key
+    assert version == obj.version == version_obj.version == 2
@@ -0,0 +1,138 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import logging
+import queue
+
+import flask
+import pytest
+
+from securescaffold import logs
+from securescaffold.contrib.appengine import users
+
+
+@pytest.fixture
+def root_logger():
+    """Restore the root logger's handlers after the test."""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+
+    yield root
+
+    if logs._installed is not None:
+        logs._installed.uninstall()
+        logs._installed = None
+
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_parse_trace():
+    assert logs.parse_trace({"X-Cloud-Trace-Context": "abc123/456;o=1"}) == ("abc123", "456", True)
+    assert logs.parse_trace({"X-Cloud-Trace-Context": "abc123"}) == ("abc123", "", False)
+    assert logs.parse_trace({"traceparent": "00-abc123-def456-01"}) == ("abc123", "def456", True)
+    assert logs.parse_trace({}) == (None, None, False)
+
+
+def test_json_records_with_request_fields(root_logger, monkeypatch):
+    monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "my-project")
+    stream = io.StringIO()
+    app = flask.Flask(__name__)
+    structured = logs.StructuredLogging(app, stream=stream)
+    headers = {
+        "X-Cloud-Trace-Context": "abc123/456;o=1",
+        users.USER_AUTH_DOMAIN_HEADER: "example.com",
+        users.USER_EMAIL_HEADER: "alice@example.com",
+        users.USER_ID_HEADER: "123",
+    }
+
+    with app.test_request_context("/page", headers=headers):
+        logging.getLogger("test").warning("Hello %s", "world")
+
+    logging.getLogger("test").info("Outside a request")
+
+    try:
+        raise ValueError("oops")
+    except ValueError:
+        logging.getLogger("test").exception("Failed")
+
+    structured.stop()
+    first, second, third = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    assert first["message"] == "Hello world"
+    assert first["severity"] == "WARNING"
+    assert first["logging.googleapis.com/trace"] == "projects/my-project/traces/abc123"
+    assert first["logging.googleapis.com/spanId"] == "456"
+    assert first["path"] == "/page"
+    assert first["user_id"] == "123"
+    assert set(first["timestamp"]) == {"seconds", "nanos"}
+    assert "path" not in second
+    assert third["severity"] == "ERROR"
+    assert "ValueError: oops" in third["message"]
+
+
+def test_queue_drops_records_instead_of_blocking():
+    log_queue = queue.Queue(4)
+    handler = logs.DroppingQueueHandler(log_queue)
+    logger = logging.getLogger("test.dropping")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    try:
+        # Above half full, INFO records are dropped but warnings are kept,
+        # after a record with the number dropped so far.
+        for i in range(4):
+            logger.info("info %d", i)
+
+        logger.warning("warning 1")
+        assert handler.dropped == 0
+
+        # When the queue is full, all records are dropped.
+        logger.warning("warning 2")
+        logger.warning("warning 3")
+
+        assert log_queue.qsize() == 4
+        assert handler.dropped == 2
+
+        # When there is space again, the number dropped is logged first.
+        while not log_queue.empty():
+            log_queue.get_nowait()
+
+        logger.warning("warning 4")
+    finally:
+        logger.removeHandler(handler)
+        logger.propagate = True
+
+    messages = [log_queue.get_nowait().getMessage() for _ in range(log_queue.qsize())]
+    assert messages == ["Dropped 2 log records, the log queue was full", "warning 4"]
+    assert handler.dropped == 0
+
+
+def test_after_fork_starts_a_new_thread(root_logger):
+    stream = io.StringIO()
+    structured = logs.StructuredLogging(stream=stream)
+    structured.install()
+    old_listener = structured.listener
+
+    structured._after_fork()
+    logging.getLogger("test").warning("After the fork")
+    structured.stop()
+    old_listener.stop()
+
+    assert structured.listener is None
+    assert logging.getLogger().handlers == [structured.handler]
+    assert "After the fork" in stream.getvalue()
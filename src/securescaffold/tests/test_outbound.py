@@ -0,0 +1,157 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import http.server
+import threading
+import time
+from unittest import mock
+
+import flask
+import pytest
+import requests.adapters
+from google.auth import credentials as auth_credentials
+
+from securescaffold import outbound
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    failures = 0
+
+    def do_GET(self):
+        type(self).clients.add(self.client_address)
+
+        if type(self).failures:
+            type(self).failures -= 1
+            self.send_response(503)
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.clients = set()
+    Handler.failures = 0
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    yield f"http://127.0.0.1:{httpd.server_port}/"
+
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_sessions(**config):
+    app = flask.Flask("test")
+    app.config.update(config)
+
+    return outbound.HTTPSessions(app)
+
+
+def test_init_app_adds_sessions_to_app():
+    app = flask.Flask("test")
+    sessions = outbound.HTTPSessions(app)
+
+    assert app.http is sessions
+
+
+def test_session_is_per_thread_with_shared_pool():
+    sessions = make_sessions()
+    result = []
+
+    thread = threading.Thread(target=lambda: result.append(sessions.session()))
+    thread.start()
+    thread.join()
+
+    assert sessions.session() is sessions.session()
+    assert result[0] is not sessions.session()
+    assert result[0].get_adapter("https://example.com") is sessions.adapter
+    assert sessions.session().get_adapter("http://example.com") is sessions.adapter
+
+
+def test_session_reuses_connections(server):
+    sessions = make_sessions()
+
+    for _ in range(5):
+        assert sessions.session().get(server).text == "ok"
+
+    assert len(Handler.clients) == 1
+
+
+def test_session_retries(server):
+    sessions = make_sessions(HTTP_BACKOFF_FACTOR=0)
+    Handler.failures = 2
+
+    response = sessions.session().get(server)
+
+    assert response.status_code == 200
+
+
+def test_adapter_sets_default_timeout():
+    sessions = make_sessions(HTTP_TIMEOUT=5)
+    request = mock.Mock(url="https://example.com/foo")
+
+    with mock.patch.object(requests.adapters.HTTPAdapter, "send") as send:
+        sessions.adapter.send(request)
+        sessions.adapter.send(request, timeout=1)
+
+    assert send.call_args_list[0][1]["timeout"] == 5
+    assert send.call_args_list[1][1]["timeout"] == 1
+
+
+def test_adapter_limits_concurrent_requests_per_host():
+    adapter = outbound.PooledHTTPAdapter(per_host_limit=2)
+    active = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+
+        time.sleep(0.02)
+
+        with lock:
+            active["now"] -= 1
+
+    request = mock.Mock(url="https://example.com/foo")
+
+    with mock.patch.object(requests.adapters.HTTPAdapter, "send", send):
+        threads = [threading.Thread(target=adapter.send, args=(request,)) for _ in range(6)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+    assert active["max"] == 2
+
+
+def test_authorized_session_uses_shared_pool():
+    sessions = make_sessions()
+    creds = mock.Mock(spec=auth_credentials.Credentials)
+
+    session = sessions.authorized_session(creds)
+
+    assert session.get_adapter("https://example.com") is sessions.adapter
+    assert session._auth_request.session is sessions.session()
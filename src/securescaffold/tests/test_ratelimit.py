@@ -0,0 +1,220 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+import securescaffold
+from securescaffold import ratelimit
+from securescaffold.contrib.appengine import users
+
+
+class FakeRedis:
+    """Stands in for a Redis client, with the commands RedisStore uses."""
+
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def incrby(self, name, amount):
+        self.commands.append(("incrby", name, amount))
+
+    def expire(self, name, ttl):
+        self.commands.append(("expire", name, ttl))
+
+    def execute(self):
+        results = []
+
+        for command, name, value in self.commands:
+            if command == "incrby":
+                self.client.values[name] = self.client.values.get(name, 0) + value
+                results.append(self.client.values[name])
+            else:
+                self.client.ttls[name] = value
+                results.append(True)
+
+        return results
+
+
+@pytest.fixture
+def make_app(tmp_path, monkeypatch):
+    def _make_app(**settings):
+        settings.setdefault("SECRET_KEY", "test")
+        path = tmp_path / "settings.py"
+        path.write_text("".join(f"{name} = {value!r}\n" for name, value in settings.items()))
+        monkeypatch.setenv("FLASK_SETTINGS_FILENAME", str(path))
+        app = securescaffold.create_app(__name__)
+
+        @app.route("/")
+        def index():
+            return "index"
+
+        @app.route("/search")
+        @ratelimit.rate_limit("2/minute")
+        def search():
+            return "search"
+
+        return app
+
+    return _make_app
+
+
+def get(client, path, ip="192.0.2.1", **headers):
+    headers[ratelimit.X_APPENGINE_USER_IP] = ip
+
+    return client.get(path, headers=headers, base_url="https://localhost")
+
+
+def test_parse_limit():
+    assert ratelimit.Limit.parse("10/minute") == (10, 60)
+    assert ratelimit.Limit.parse("5/ second") == (5, 1)
+
+    with pytest.raises(ValueError):
+        ratelimit.Limit.parse("10 per minute")
+
+
+def test_token_bucket_refills():
+    now = [0.0]
+    limiter = ratelimit.RateLimiter(clock=lambda: now[0])
+    limit = ratelimit.Limit(3, 60)
+
+    assert [limiter.hit("s", "k", limit) for _ in range(4)] == [True, True, True, False]
+
+    # One token every 20 seconds.
+    now[0] = 20.0
+    assert limiter.hit("s", "k", limit)
+    assert not limiter.hit("s", "k", limit)
+    assert limiter.hit("s", "other", limit)
+
+
+def test_rate_limit_decorator(make_app):
+    app = make_app()
+    client = app.test_client()
+
+    responses = [get(client, "/search") for _ in range(3)]
+
+    assert [r.status_code for r in responses] == [200, 200, 429]
+    assert responses[2].headers["Retry-After"] == "60"
+    # Counted by IP address, and the global policy is off.
+    assert get(client, "/search", ip="192.0.2.2").status_code == 200
+    assert get(client, "/").status_code == 200
+
+
+def test_rate_limit_by_user(make_app):
+    app = make_app()
+    client = app.test_client()
+    user = {
+        users.USER_AUTH_DOMAIN_HEADER: "example.com",
+        users.USER_EMAIL_HEADER: "alice@example.com",
+        users.USER_ID_HEADER: "123",
+    }
+
+    assert get(client, "/search", ip="192.0.2.1", **user).status_code == 200
+    assert get(client, "/search", ip="192.0.2.2", **user).status_code == 200
+    assert get(client, "/search", ip="192.0.2.3", **user).status_code == 429
+    assert get(client, "/search", ip="192.0.2.3").status_code == 200
+
+
+def test_global_rate_limit(make_app):
+    app = make_app(RATE_LIMIT="1/minute")
+    client = app.test_client()
+
+    assert get(client, "/").status_code == 200
+    assert get(client, "/").status_code == 429
+    # Requests from admins and the Tasks scheduler are not limited.
+    assert get(client, "/", **{"X-Appengine-User-Is-Admin": "1"}).status_code == 200
+    assert get(client, "/", **{"X-Appengine-Queuename": "default"}).status_code == 200
+
+
+def test_shared_store_blocks_across_instances():
+    store = ratelimit.RedisStore(FakeRedis())
+    limit = ratelimit.Limit(3, 60)
+    instances = [ratelimit.RateLimiter(store=store, clock=lambda: 10.0, wall_clock=lambda: 70.0) for _ in range(2)]
+
+    for limiter in instances:
+        limiter._syncing = True  # Sync by hand, not in the background.
+        assert limiter.hit("s", "k", limit)
+        assert limiter.hit("s", "k", limit)
+        limiter.sync()
+
+    assert store.client.values == {"ratelimit:s:k:1": 4}
+    assert store.client.ttls == {"ratelimit:s:k:1": 60}
+    # The second instance saw the total, and blocks until the window ends.
+    assert not instances[1].hit("s", "k", limit)
+    assert instances[1]._blocked[("s", "k")] == 60.0
+    assert instances[0].hit("s", "k", limit)
+
+
+def test_memory_store_expires():
+    now = [0.0]
+    store = ratelimit.MemoryStore(clock=lambda: now[0])
+
+    assert store.increment([("a", 2, 60), ("b", 1, 60)]) == [2, 1]
+    assert store.increment([("a", 1, 60)]) == [3]
+
+    now[0] = 61.0
+    assert store.increment([("a", 1, 60)]) == [1]
+
+
+def test_buckets_are_bounded():
+    now = [0.0]
+    limiter = ratelimit.RateLimiter(max_keys=2, clock=lambda: now[0])
+    limit = ratelimit.Limit(1, 60)
+
+    limiter.hit("s", "a", limit)
+    now[0] = 61.0
+    limiter.hit("s", "b", limit)
+    limiter.hit("s", "c", limit)
+
+    assert set(limiter._buckets) == {("s", "b"), ("s", "c")}
+
+
+def test_buckets_evict_least_recently_used():
+    now = [0.0]
+    limiter = ratelimit.RateLimiter(max_keys=4, clock=lambda: now[0])
+    limit = ratelimit.Limit(1, 60)
+
+    assert limiter.hit("s", "active", limit)
+
+    # Many new clients don't reset the limit of a client that is still busy.
+    for i in range(20):
+        now[0] += 1
+        assert not limiter.hit("s", "active", limit)
+        limiter.hit("s", f"spray-{i}", limit)
+
+    assert len(limiter._buckets) <= 4
+    assert ("s", "active") in limiter._buckets
+
+
+def test_global_rate_limit_runs_first(make_app):
+    app = make_app(RATE_LIMIT="1/minute")
+
+    @app.route("/post", methods=["POST"])
+    def post():
+        return "post"
+
+    client = app.test_client()
+    headers = {ratelimit.X_APPENGINE_USER_IP: "192.0.2.1"}
+
+    # Rejected by the CSRF check, then by the rate limit without checking.
+    assert client.post("/post", headers=headers, base_url="https://localhost").status_code == 403
+    assert client.post("/post", headers=headers, base_url="https://localhost").status_code == 429
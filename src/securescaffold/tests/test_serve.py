@@ -0,0 +1,56 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+
+import pytest
+
+from securescaffold import serve
+
+
+@pytest.mark.parametrize(
+    "memory_mb,workers",
+    [("384", 2), ("768", 4), ("1536", 8), ("3072", 8), ("256", 2)],
+)
+def test_worker_config_for_instance_class(memory_mb, workers):
+    result = serve.worker_config({"GAE_MEMORY_MB": memory_mb})
+
+    assert result == {"workers": workers, "threads": serve.DEFAULT_THREADS}
+
+
+def test_worker_config_from_cpu_count():
+    result = serve.worker_config({}, cpu_count=2)
+
+    assert result["workers"] == 5
+
+
+def test_gunicorn_options():
+    args = argparse.Namespace(bind=None, workers=None, threads=None, preload=True, timeout=0, log_level="info")
+
+    result = serve.gunicorn_options(args, {"GAE_MEMORY_MB": "768", "PORT": "8081"})
+
+    assert result["bind"] == ":8081"
+    assert result["workers"] == 4
+    assert result["worker_class"] == "gthread"
+    assert result["preload_app"] is True
+
+
+def test_gunicorn_options_sync_worker():
+    args = argparse.Namespace(bind="127.0.0.1:80", workers=3, threads=1, preload=False, timeout=0, log_level="info")
+
+    result = serve.gunicorn_options(args, {})
+
+    assert result["bind"] == "127.0.0.1:80"
+    assert result["workers"] == 3
+    assert result["worker_class"] == "sync"
@@ -0,0 +1,289 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+from unittest import mock
+
+import flask
+import pytest
+from google.auth import credentials as auth_credentials
+from google.cloud import ndb
+
+import securescaffold
+from securescaffold import datastore
+from securescaffold import sessions
+
+
+SID = "a" * 43
+
+
+def make_app(**config):
+    app = flask.Flask(__name__)
+    app.config["SECRET_KEY"] = "test"
+    app.config["SESSION_STORE"] = "datastore"
+    app.config.update(config)
+    sessions.init_app(app)
+
+    @app.route("/")
+    def untouched():
+        return "OK"
+
+    @app.route("/get")
+    def get():
+        return flask.session.get("name", "")
+
+    @app.route("/set/<name>")
+    def set_name(name):
+        flask.session["name"] = name
+        return "OK"
+
+    @app.route("/clear")
+    def clear():
+        flask.session.clear()
+        return "OK"
+
+    @app.route("/login")
+    def login():
+        sessions.regenerate()
+        flask.session["user"] = "alice"
+        return "OK"
+
+    return app
+
+
+@pytest.fixture
+def scaffold_app(tmp_path, monkeypatch):
+    """An app from `create_app`, with Flask-SeaSurf's CSRF protection."""
+    settings = tmp_path / "settings.py"
+    settings.write_text('SECRET_KEY = "test"\nSESSION_STORE = "datastore"\n')
+    monkeypatch.setenv("FLASK_SETTINGS_FILENAME", str(settings))
+    app = securescaffold.create_app(__name__)
+
+    @app.route("/")
+    def untouched():
+        return "OK"
+
+    @app.route("/form")
+    def form():
+        return flask.render_template_string("{{ csrf_token() }}")
+
+    @app.route("/post", methods=["POST"])
+    def post():
+        flask.session["name"] = "alice"
+        return "OK"
+
+    return app
+
+
+@pytest.fixture
+def fake_datastore(monkeypatch):
+    """Keep Session entities in a dict, instead of the datastore."""
+    client = ndb.Client(project="test", credentials=auth_credentials.AnonymousCredentials())
+    monkeypatch.setattr(datastore, "_client", client)
+    entities = {}
+
+    def put(self):
+        entities[self.key.id()] = self
+
+    monkeypatch.setattr(sessions.Session, "put", put)
+    monkeypatch.setattr(sessions.Session, "get_by_id", mock.Mock(side_effect=entities.get))
+    monkeypatch.setattr(ndb.Key, "delete", lambda key: entities.pop(key.id(), None))
+
+    return entities
+
+
+def test_untouched_session_is_not_loaded_or_saved(fake_datastore):
+    client = make_app().test_client()
+    client.set_cookie("session", SID)
+
+    response = client.get("/")
+
+    assert not sessions.Session.get_by_id.called
+    assert "Set-Cookie" not in response.headers
+    assert "Cookie" not in response.vary
+
+
+def test_session_round_trip(fake_datastore):
+    client = make_app().test_client()
+
+    response = client.get("/set/alice")
+    cookie = client.get_cookie("session")
+
+    assert sessions.SESSION_ID_PATTERN.match(cookie.value)
+    assert fake_datastore[cookie.value].expires > sessions.utcnow()
+    # The cookie does not hold the session data.
+    assert "alice" not in response.headers["Set-Cookie"]
+
+    response = client.get("/get")
+    assert response.get_data(as_text=True) == "alice"
+
+
+def test_read_only_session_is_not_written(fake_datastore):
+    client = make_app().test_client()
+    client.get("/set/alice")
+    entity = fake_datastore[client.get_cookie("session").value]
+
+    response = client.get("/get")
+
+    assert fake_datastore[client.get_cookie("session").value] is entity
+    assert "Set-Cookie" not in response.headers
+
+
+def test_read_through_cache(fake_datastore):
+    app = make_app()
+    client = app.test_client()
+    client.get("/set/alice")
+
+    for _ in range(3):
+        assert client.get("/get").get_data(as_text=True) == "alice"
+
+    # Saving the session filled the cache.
+    assert not sessions.Session.get_by_id.called
+
+    app.session_interface._cache.clear()
+    client.get("/get")
+    assert sessions.Session.get_by_id.call_count == 1
+
+
+def test_cache_is_bounded(fake_datastore):
+    app = make_app(SESSION_CACHE_SIZE=2)
+
+    for name in ["alice", "bob", "carol"]:
+        app.test_client().get(f"/set/{name}")
+
+    assert len(app.session_interface._cache) == 2
+
+
+def test_cache_ttl(fake_datastore):
+    now = [0.0]
+    app = make_app()
+    app.session_interface.clock = lambda: now[0]
+    client = app.test_client()
+    client.get("/set/alice")
+
+    now[0] += app.session_interface.cache_ttl + 1
+    client.get("/get")
+
+    assert sessions.Session.get_by_id.call_count == 1
+
+
+def test_expired_session_is_ignored(fake_datastore):
+    app = make_app()
+    client = app.test_client()
+    client.get("/set/alice")
+    sid = client.get_cookie("session").value
+    fake_datastore[sid].expires = sessions.utcnow() - datetime.timedelta(seconds=1)
+    app.session_interface._cache.clear()
+
+    response = client.get("/get")
+
+    assert response.get_data(as_text=True) == ""
+
+
+def test_cleared_session_is_deleted(fake_datastore):
+    client = make_app().test_client()
+    client.get("/set/alice")
+
+    client.get("/clear")
+
+    assert fake_datastore == {}
+    assert client.get_cookie("session") is None
+
+
+def test_invalid_session_id_is_not_looked_up(fake_datastore):
+    client = make_app().test_client()
+    client.set_cookie("session", "not-a-session-id")
+
+    response = client.get("/get")
+
+    assert response.get_data(as_text=True) == ""
+    assert not sessions.Session.get_by_id.called
+
+
+def test_unknown_session_id_is_replaced(fake_datastore):
+    client = make_app().test_client()
+    client.set_cookie("session", SID)
+
+    client.get("/set/alice")
+    sid = client.get_cookie("session").value
+
+    assert sid != SID
+    assert list(fake_datastore) == [sid]
+
+
+def test_regenerate(fake_datastore):
+    client = make_app().test_client()
+    client.get("/set/alice")
+    old_sid = client.get_cookie("session").value
+
+    client.get("/login")
+    sid = client.get_cookie("session").value
+
+    assert sid != old_sid
+    assert list(fake_datastore) == [sid]
+    assert client.get("/get").get_data(as_text=True) == "alice"
+
+
+def test_csrf_token_is_not_stored(fake_datastore, scaffold_app):
+    client = scaffold_app.test_client()
+
+    for _ in range(3):
+        response = client.get("/", base_url="https://localhost")
+        assert response.status_code == 200
+
+    assert fake_datastore == {}
+    assert client.get_cookie("session") is None
+    assert not sessions.Session.get_by_id.called
+
+
+def test_csrf_with_session_cookie_does_not_load(fake_datastore, scaffold_app):
+    client = scaffold_app.test_client()
+    client.set_cookie("session", SID, domain="localhost")
+
+    client.get("/", base_url="https://localhost")
+
+    assert not sessions.Session.get_by_id.called
+
+
+def test_csrf_token_from_signed_cookie(fake_datastore, scaffold_app):
+    client = scaffold_app.test_client()
+    token = client.get("/form", base_url="https://localhost").get_data(as_text=True)
+    headers = {"X-CSRFToken": token, "Referer": "https://localhost/form"}
+
+    response = client.post("/post", base_url="https://localhost", headers=headers)
+
+    assert response.status_code == 200
+    assert list(fake_datastore) == [client.get_cookie("session").value]
+    assert fake_datastore[client.get_cookie("session").value].data.find(token) == -1
+
+    # A forged CSRF cookie is not trusted.
+    client.set_cookie("session-csrf", "forged", domain="localhost")
+    response = client.post("/post", base_url="https://localhost", headers=headers)
+
+    assert response.status_code == 403
+
+
+def test_unknown_session_store():
+    with pytest.raises(ValueError):
+        make_app(SESSION_STORE="memcache")
+
+
+def test_datastore_sessions(ndb_client):
+    client = make_app().test_client()
+    client.get("/set/alice")
+    client.application.session_interface._cache.clear()
+
+    response = client.get("/get")
+
+    assert response.get_data(as_text=True) == "alice"
@@ -0,0 +1,32 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from unittest import mock
+
+import flask
+import pytest
+
+from securescaffold import tasks
+
+
+def test_enqueue_requires_location():
+    app = flask.Flask(__name__)
+    app.config["TASKS_LOCATION"] = None
+    app.config["TASKS_QUEUE"] = "default"
+
+    with app.app_context(), mock.patch.object(tasks, "get_client") as get_client:
+        with pytest.raises(RuntimeError, match="TASKS_LOCATION"):
+            tasks.enqueue("/cron/job")
+
+    assert not get_client.called
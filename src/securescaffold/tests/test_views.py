@@ -12,9 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import tempfile
 import unittest
 
 import flask
+import jinja2
 
 import securescaffold.views
 
@@ -90,3 +93,108 @@ class RedirectTestCase(unittest.TestCase):
 
         self.assertEqual(response.status_code, 302)
         self.assertEqual(response.location, "/test?baz=qux&foo=bar")
+
+
+serve_app = flask.Flask(__name__)
+serve_app.add_url_rule("/", "home", securescaffold.views.lang_index)
+
+
+class ServeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+
+        for locale in ["en", "fr"]:
+            os.makedirs(os.path.join(self.tempdir.name, "intl", locale))
+            filename = os.path.join(self.tempdir.name, "intl", locale, "index.html")
+
+            with open(filename, "w") as fh:
+                fh.write(f"<html><head><title>{locale}</title></head></html>")
+
+        serve_app.config["LOCALES"] = ["en", "fr"]
+        serve_app.config["LOCALES_SERVE_MODE"] = "serve"
+        serve_app.config["LOCALES_SERVE_FILE"] = os.path.join(self.tempdir.name, "intl/{locale}/index.html")
+
+    def tearDown(self):
+        names = ["LOCALES", "LOCALES_SERVE_MODE", "LOCALES_SERVE_FILE", "LOCALES_TEMPLATE", "LOCALES_CANONICAL_ORIGIN"]
+
+        for name in names:
+            serve_app.config.pop(name, None)
+
+    def test_serves_negotiated_locale(self):
+        client = serve_app.test_client()
+        response = client.get("/", headers=[("Accept-Language", "fr-CH, fr;q=0.9")])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"<title>fr</title>", response.data)
+        self.assertEqual(response.headers["Content-Language"], "fr")
+        self.assertIn("Accept-Language", response.vary)
+        self.assertIn("User-Agent", response.vary)
+        self.assertEqual(response.headers["Link"], '<https://localhost/intl/fr/>; rel="canonical"')
+
+    def test_canonical_origin(self):
+        serve_app.config["LOCALES_CANONICAL_ORIGIN"] = "https://www.example.com"
+        client = serve_app.test_client()
+        response = client.get("/", headers=[("Accept-Language", "fr")])
+
+        self.assertEqual(response.headers["Link"], '<https://www.example.com/intl/fr/>; rel="canonical"')
+
+    def test_adds_base_for_relative_urls(self):
+        client = serve_app.test_client()
+        response = client.get("/")
+
+        self.assertIn(b'<head><base href="/intl/en/"><title>', response.data)
+
+    def test_ignores_header_element(self):
+        filename = os.path.join(self.tempdir.name, "intl", "en", "index.html")
+
+        with open(filename, "w") as fh:
+            fh.write('<!doctype html><header class="top">Title</header>')
+
+        client = serve_app.test_client()
+        response = client.get("/")
+
+        self.assertEqual(response.data, b'<!doctype html><header class="top">Title</header>')
+
+    def test_reads_changed_file(self):
+        client = serve_app.test_client()
+        client.get("/")
+
+        filename = os.path.join(self.tempdir.name, "intl", "en", "index.html")
+
+        with open(filename, "w") as fh:
+            fh.write("<html><head><base href='/'></head><body>Changed</body></html>")
+
+        response = client.get("/")
+
+        self.assertEqual(response.data, b"<html><head><base href='/'></head><body>Changed</body></html>")
+
+    def test_renders_template(self):
+        serve_app.config["LOCALES_TEMPLATE"] = "index-{locale}.html"
+        serve_app.jinja_loader = jinja2.DictLoader({"index-fr.html": "{{ locale }} {{ canonical_url }}"})
+        self.addCleanup(setattr, serve_app, "jinja_loader", None)
+
+        client = serve_app.test_client()
+        response = client.get("/", headers=[("Accept-Language", "fr")])
+
+        self.assertEqual(response.data, b"fr /intl/fr/")
+        self.assertEqual(response.headers["Content-Language"], "fr")
+
+    def test_redirects_crawlers(self):
+        client = serve_app.test_client()
+        headers = [("User-Agent", "Mozilla/5.0 (compatible; Googlebot/2.1)")]
+        response = client.get("/", headers=headers)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.location, "/intl/en/")
+        self.assertIn("User-Agent", response.vary)
+
+    def test_redirect_mode(self):
+        serve_app.config["LOCALES_SERVE_MODE"] = "redirect"
+
+        client = serve_app.test_client()
+        response = client.get("/", headers=[("Accept-Language", "fr")])
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.location, "/intl/fr/")
+        self.assertIn("Accept-Language", response.vary)
@@ -12,15 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import re
+import threading
 import urllib.parse
 from typing import Optional
 
 import flask
+import markupsafe
 from werkzeug.datastructures import LanguageAccept
 
 
 DEFAULT_LANGS = ["en"]
 DEFAULT_LANGS_REDIRECT_TO = "/intl/{locale}/"
+# "redirect" to the locale's URL, or "serve" the locale's page at the same URL.
+DEFAULT_LOCALES_SERVE_MODE = "redirect"
+DEFAULT_LOCALES_SERVE_FILE = "dist/intl/{locale}/index.html"
+# Crawlers are redirected, so each locale's page is indexed at its own URL.
+DEFAULT_CRAWLER_PATTERN = r"bot\b|crawler|spider|slurp|facebookexternalhit|embedly|preview"
+
+HEAD_PATTERN = re.compile(rb"<head\b[^>]*>", re.IGNORECASE)
+BASE_PATTERN = re.compile(rb"<base\b", re.IGNORECASE)
+
+_pages = {}
+_pages_lock = threading.Lock()
 
 
 def best_match(requested_langs: LanguageAccept, supported_langs: list) -> Optional[str]:
@@ -56,15 +71,9 @@ def add_query_to_url(path: str, qs: str) -> str:
     return urllib.parse.urlunsplit(parsed)
 
 
-def lang_redirect():
-    """Redirects the user depending on the Accept-Language header.
-
-    Use this with @flask.before_request or as a view.
-    """
-    config = flask.current_app.config
-    supported_langs = config.get("LOCALES", DEFAULT_LANGS)
-    locales_redirect_to = config.get("LOCALES_REDIRECT_TO", DEFAULT_LANGS_REDIRECT_TO)
-
+def negotiate_locale() -> str:
+    """The best supported locale for the request's Accept-Language header."""
+    supported_langs = flask.current_app.config.get("LOCALES", DEFAULT_LANGS)
     locale = best_match(flask.request.accept_languages, supported_langs)
 
     if locale is None:
@@ -73,6 +82,17 @@ def lang_redirect():
         else:
             locale = DEFAULT_LANGS[0]
 
+    return locale
+
+
+def lang_redirect():
+    """Redirects the user depending on the Accept-Language header.
+
+    Use this with @flask.before_request or as a view.
+    """
+    config = flask.current_app.config
+    locales_redirect_to = config.get("LOCALES_REDIRECT_TO", DEFAULT_LANGS_REDIRECT_TO)
+    locale = negotiate_locale()
     redirect_to = locales_redirect_to.format(locale=locale)
 
     if flask.request.query_string:
@@ -80,3 +100,93 @@ def lang_redirect():
         redirect_to = add_query_to_url(redirect_to, flask.request.query_string)
 
     return flask.redirect(redirect_to)
+
+
+def lang_index():
+    """Serves the page for the locale in the Accept-Language header.
+
+    With the "LOCALES_SERVE_MODE" setting "serve", the locale's page is
+    served at the requested URL, which saves the round trip of a redirect.
+    The page is the template named by "LOCALES_TEMPLATE", or else the file
+    named by "LOCALES_SERVE_FILE" (relative to the app's root path). Its
+    canonical URL is "LOCALES_REDIRECT_TO", on the "LOCALES_CANONICAL_ORIGIN"
+    origin (default https on the request's host).
+
+    Crawlers (matched by "LOCALES_CRAWLER_PATTERN") are redirected, as is
+    everyone when the mode is "redirect".
+    """
+    config = flask.current_app.config
+    mode = config.get("LOCALES_SERVE_MODE", DEFAULT_LOCALES_SERVE_MODE)
+
+    if mode == "redirect":
+        response = lang_redirect()
+    elif mode == "serve":
+        # Caches must not give a crawler's redirect to a browser, or the
+        # other way round.
+        response = lang_redirect() if is_crawler(flask.request) else serve_locale(negotiate_locale())
+        response.vary.add("User-Agent")
+    else:
+        raise ValueError(f"Unknown LOCALES_SERVE_MODE: {mode!r}")
+
+    response.vary.add("Accept-Language")
+
+    return response
+
+
+def serve_locale(locale: str) -> flask.Response:
+    """The locale's page, with Content-Language and a canonical link."""
+    app = flask.current_app
+    config = app.config
+    canonical = config.get("LOCALES_REDIRECT_TO", DEFAULT_LANGS_REDIRECT_TO).format(locale=locale)
+    template = config.get("LOCALES_TEMPLATE")
+
+    if template:
+        body = flask.render_template(template.format(locale=locale), locale=locale, canonical_url=canonical)
+        response = flask.make_response(body)
+    else:
+        path = os.path.join(app.root_path, config.get("LOCALES_SERVE_FILE", DEFAULT_LOCALES_SERVE_FILE))
+        # Relative URLs in the page resolve as they would at the canonical URL.
+        response = flask.Response(read_page(path.format(locale=locale), canonical), mimetype="text/html")
+
+    response.headers["Content-Language"] = locale
+    # App Engine terminates TLS, so the request's own scheme is http.
+    origin = config.get("LOCALES_CANONICAL_ORIGIN") or f"https://{flask.request.host}"
+    url = urllib.parse.urljoin(origin, canonical)
+    response.headers["Link"] = f'<{url}>; rel="canonical"'
+
+    return response
+
+
+def read_page(path: str, base_href: str) -> bytes:
+    """Read a static page, with a <base> tag for its canonical URL.
+
+    Pages are cached in memory, and read again when the file changes.
+    """
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size, base_href)
+    cached = _pages.get(path)
+
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with open(path, "rb") as fh:
+        page = fh.read()
+
+    match = HEAD_PATTERN.search(page)
+
+    if match and not BASE_PATTERN.search(page):
+        base = b'<base href="' + str(markupsafe.escape(base_href)).encode("utf-8") + b'">'
+        page = page[:match.end()] + base + page[match.end():]
+
+    with _pages_lock:
+        _pages[path] = (version, page)
+
+    return page
+
+
+def is_crawler(request) -> bool:
+    """True if the request's User-Agent looks like a search engine crawler."""
+    pattern = flask.current_app.config.get("LOCALES_CRAWLER_PATTERN", DEFAULT_CRAWLER_PATTERN)
+    user_agent = request.headers.get("User-Agent", "")
+
+    return bool(pattern and re.search(pattern, user_agent, re.IGNORECASE))